@@ -1,19 +1,39 @@
-from PySide6.QtWidgets import QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QGridLayout, QScrollArea, QCheckBox, QComboBox, QPushButton, QLabel
+from PySide6.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QGridLayout, QScrollArea, QCheckBox, QComboBox, QPushButton, QLabel, QLineEdit,
+                               QTableView, QHeaderView, QAbstractItemView)
 from PySide6.QtCore import Qt
+from PySide6.QtGui import QKeySequence
 from functools import partial
 import contextlib
+import time
+import numpy as np
 
 from database import config as cfg
 from presenters.MainStage import MainStage
+from UI.EventListModel import EventListModel
 
 class CaloLITE_Window(QMainWindow):
-    def __init__(self, mainStage:MainStage, eventNumbers: list[int]):
+    # Items of the hit cell colour drop-down list: (mode, scale) of MainStage.setCellColorMode
+    color_mode_choices = {"Colour by cluster": ("cluster", "linear"),
+                          "Colour by energy (linear)": ("energy", "linear"),
+                          "Colour by energy (log)": ("energy", "log")}
+    # Items of the calorimeter layers colour drop-down list: mode of MainStage.setGeometryColorMode
+    geometry_color_choices = {"Layer colours": "layer",
+                              "Hits (all events)": "hits",
+                              "Energy (all events)": "energy"}
+    # Items of the overlay colour drop-down list: mode of MainStage.setOverlayColorMode
+    overlay_color_choices = {"Overlay: cluster colours": "cluster",
+                             "Overlay: event colours": "event"}
+    max_overlay_events = 2000       # Overlaid events at most (the first ones of the list)
+    
+    def __init__(self, mainStage:MainStage, eventNumbers=None):
         super().__init__()
         self.setWindowTitle("Calo-LITE")
         self.resize(1200, 800)
         self.subDetector_checkboxes = {}            # dict[str: QCheckBox]
         self.group_checkboxes = {}                  # dict[str: QCheckBox]
-        self.eventNumbers = eventNumbers            # list[int]
+        # Sorted event numbers (np.ndarray), can be extended later by appendEventNumbers
+        self.eventNumbers = np.asarray(eventNumbers if eventNumbers is not None else [], dtype=np.int64)
+        self.queryEventNumbers = None               # np.ndarray matching the event query, None when no query is applied
 
         # Store mainStage presenter to UI (should already have scene, etc initialized in it)
         self.mainStageWidget = mainStage
@@ -27,6 +47,7 @@ class CaloLITE_Window(QMainWindow):
         event_selection_panel = self._create_event_selection_panel()
         detector_selection_panel = self._create_detector_selection_panel()
         axis_panel = self._create_auxfunc_panel()
+        cell_info_panel = self._create_cell_info_panel()
         
         # Create a scroll area for the sub-detector side panel
         scrollArea = QScrollArea()
@@ -34,10 +55,11 @@ class CaloLITE_Window(QMainWindow):
         scrollArea.setWidget(detector_selection_panel)
         
         # Assemble all panel to main container
-        mainContainerLayout.addWidget(self.mainStageWidget, 0, 0, 3, 1)     # row, col, rowSpan, colSpan
+        mainContainerLayout.addWidget(self.mainStageWidget, 0, 0, 4, 1)     # row, col, rowSpan, colSpan
         mainContainerLayout.addWidget(event_selection_panel, 0, 1)          # upper left
         mainContainerLayout.addWidget(scrollArea, 1, 1)                     # middle right
-        mainContainerLayout.addWidget(axis_panel, 2, 1)                     # lower right
+        mainContainerLayout.addWidget(cell_info_panel, 2, 1)                # lower right
+        mainContainerLayout.addWidget(axis_panel, 3, 1)                     # bottom right
         mainContainerLayout.setColumnStretch(0, 4)          # Main stage column gets 3 parts of stretch
         mainContainerLayout.setColumnStretch(1, 1)          # Side panel column gets 1 part of stretch
         
@@ -50,6 +72,25 @@ class CaloLITE_Window(QMainWindow):
         
     def on_reset_camera_clicked(self):
         self.mainStageWidget.resetCamera()
+        
+    def on_hud_toggled(self, checked):
+        self.mainStageWidget.setHudVisible(checked)
+        
+    def on_cell_volumes_toggled(self, checked):
+        try:
+            self.mainStageWidget.setCellVolumesEnabled(checked)
+        except ValueError as e:
+            self.showStatusMessage(str(e))
+            with self._signal_blocker(self.cell_volumes_checkbox):
+                self.cell_volumes_checkbox.setChecked(False)
+        
+    # Called once the geometry is loaded: the cell volumes need the cell extents of the geometry file
+    def setCellVolumesAvailable(self, available: bool):
+        self.cell_volumes_checkbox.setEnabled(available)
+        if not available:
+            with self._signal_blocker(self.cell_volumes_checkbox):
+                self.cell_volumes_checkbox.setChecked(False)
+            self.cell_volumes_checkbox.setToolTip("The geometry file has no cell extents (cell_geo_deta/cell_geo_dphi)")
      
     def on_subdet_toggled(self, subDetectorName:str, checked:bool):
         self.mainStageWidget.set_sub_detector_visibility(subDetectorName, checked)
@@ -74,12 +115,144 @@ class CaloLITE_Window(QMainWindow):
         # to update the header state also to 'checked' state
         self._update_group_header_state(member_names_for_group[0])
         
-    def number_changed(self, text):
-        if text == "<Default>":
+    def appendEventNumbers(self, eventNumbers):
+        """
+        Add (sorted) event numbers at the end of the drop-down list (used while the event file is still loading)
+        """
+        eventNumbers = np.asarray(eventNumbers, dtype=np.int64)
+        self.eventNumbers = np.concatenate((self.eventNumbers, eventNumbers)) if len(self.eventNumbers) else eventNumbers
+        if self.queryEventNumbers is not None:
+            return  # The drop-down list shows the query result
+        with self._signal_blocker(self.drop_down_list):
+            self.event_list_model.appendEventNumbers(eventNumbers)
+        
+    def on_query_entered(self):
+        """
+        Fill the drop-down list with the events passing the query typed in the query box (all events if it is empty)
+        """
+        expression = self.query_box.text().strip()
+        if not expression:
+            self.queryEventNumbers = None
+            self._set_drop_down_events(self.eventNumbers)
+            self.showStatusMessage(f"Showing all {len(self.eventNumbers)} events")
+            if self.overlay_button.isChecked():
+                self.on_overlay_toggled(True)
+            return
+        
+        start_time = time.perf_counter()
+        try:
+            matching_events = self.mainStageWidget.queryEvents(expression)
+        except ValueError as e:
+            self.showStatusMessage(str(e))
+            return
+        if matching_events is None:
+            self.showStatusMessage("The event summaries are not ready yet (computed once the events and the geometry are loaded), "
+                                   "the query can be applied once they are")
+            return
+        self.queryEventNumbers = matching_events
+        self._set_drop_down_events(matching_events)
+        self.showStatusMessage(f"{len(matching_events)} of {len(self.eventNumbers)} events match the query "
+                               f"({(time.perf_counter() - start_time) * 1e3:.1f} ms)")
+        if self.overlay_button.isChecked():
+            self.on_overlay_toggled(True)
+        
+    def showStatusMessage(self, message: str):
+        self.statusBar().showMessage(message)
+        
+    def showCellInfo(self, info: dict):
+        """
+        Show the cell picked on the main stage (dict from MainStage.pickCell, or None)
+        """
+        if info is None:
+            self.cell_info_label.setText("No cell under the cursor")
+            return
+        lines = [f"Cell ID: {info['cell_id']}" if info['cell_id'] is not None else "Cell ID: unknown",
+                 f"Layer: {info['layer']}",
+                 f"(x, y, z) = ({info['x']:.3f}, {info['y']:.3f}, {info['z']:.3f}) m",
+                 f"(Eta, Phi) = ({info['eta']:.3f}, {info['phi']:.3f})"]
+        if "event" in info:
+            lines.append(f"Hit cell of event {info['event']}, cluster {info['cluster']}")
+        lines.append(f"(picked in {info['pick_ms']:.2f} ms)")
+        self.cell_info_label.setText("\n".join(lines))
+        
+    def on_color_mode_changed(self, _text=None):
+        mode, scale = self.color_mode_choices[self.color_mode_box.currentText()]
+        try:
+            self.mainStageWidget.setCellColorMode(mode, scale, self.colormap_box.currentText())
+        except ValueError as e:
+            self.showStatusMessage(str(e))
+            # Back to the colouring by cluster
+            with self._signal_blocker(self.color_mode_box):
+                self.color_mode_box.setCurrentIndex(0)
+            mode = "cluster"
+        self.colormap_box.setEnabled(mode == "energy")
+        
+    def on_overlay_toggled(self, checked: bool):
+        """
+        Overlay all events of the drop-down list (the query result, or all events), or clear the overlay
+        """
+        if not checked:
+            self.mainStageWidget.clearOverlay()
+            return
+        listed_events = self.queryEventNumbers if self.queryEventNumbers is not None else self.eventNumbers
+        overlay_events = listed_events[:self.max_overlay_events].tolist()
+        start_time = time.perf_counter()
+        if not self.mainStageWidget.setOverlayEvents(overlay_events):
+            self.showStatusMessage("Events are not loaded yet, they can be overlaid once they are")
+            with self._signal_blocker(self.overlay_button):
+                self.overlay_button.setChecked(False)
+            return
+        truncated = f" (first {len(overlay_events)} of {len(listed_events)})" if len(overlay_events) < len(listed_events) else ""
+        self.showStatusMessage(f"Overlaying {len(overlay_events)} events{truncated}, "
+                               f"{self.mainStageWidget.overlayController.n_cells} cells ({(time.perf_counter() - start_time) * 1e3:.1f} ms)")
+        
+    def on_overlay_color_changed(self, text):
+        self.mainStageWidget.setOverlayColorMode(self.overlay_color_choices[text])
+        
+    def on_geometry_color_changed(self, text):
+        try:
+            self.mainStageWidget.setGeometryColorMode(self.geometry_color_choices[text])
+        except ValueError as e:
+            self.showStatusMessage(str(e))
+            with self._signal_blocker(self.geometry_color_box):
+                self.geometry_color_box.setCurrentIndex(0)
+            self.mainStageWidget.setGeometryColorMode("layer")
+        
+    def number_changed(self, row: int):
+        eventNumber = self.event_list_model.eventNumberAt(row)
+        if eventNumber is None:
             self.mainStageWidget.resetEventDisplay()
         else:
-            self.mainStageWidget.changeEventDisplay(int(text))
+            self.mainStageWidget.changeEventDisplay(eventNumber)
         self.drop_down_list.hidePopup() 
+        
+    def on_jump_entered(self):
+        """
+        Select the event typed in the jump box, or the next listed one if it is not in the list
+        """
+        text = self.jump_box.text().strip()
+        if not text:
+            return
+        try:
+            eventNumber = int(text)
+        except ValueError:
+            self.showStatusMessage(f"Not an event number: {text}")
+            return
+        row = self.event_list_model.nearestRow(eventNumber)
+        if row is None:
+            self.showStatusMessage("No event listed")
+            return
+        if self.event_list_model.eventNumberAt(row) != eventNumber:
+            self.showStatusMessage(f"Event {eventNumber} is not listed, showing event {self.event_list_model.eventNumberAt(row)}")
+        self.drop_down_list.setCurrentIndex(row)
+        
+    def on_step_event(self, step: int):
+        """
+        Select the previous (step -1) or next (step +1) listed event
+        """
+        row = self.drop_down_list.currentIndex() + step
+        if 1 <= row < self.event_list_model.rowCount():
+            self.drop_down_list.setCurrentIndex(row)
 
                 
     # =============================================================            
@@ -92,18 +265,93 @@ class CaloLITE_Window(QMainWindow):
         """
         sidePanelBase = QWidget(self)
         sidePanelLayout = QVBoxLayout(sidePanelBase)
+        
+        # Query box: the drop-down list only shows the events passing the query (Enter to apply, empty for all events)
+        self.query_box = QLineEdit()
+        self.query_box.setPlaceholderText("Event query, e.g. 1.3 <= eta <= 1.6 and n_clusters >= 3")
+        self.query_box.setToolTip("Columns: event, n_particles, eta, phi (first truth particle), n_clusters, n_cells,\n"
+                                  "max_cluster_cells, min_cluster_cells, cells_<layer> (e.g. cells_EMB2, once the geometry is loaded)\n"
+                                  "Operators: < <= > >= == !=, and, or, not, + - * /, abs(). Empty query: all events")
+        self.query_box.returnPressed.connect(self.on_query_entered)
+        sidePanelLayout.addWidget(self.query_box)
+        
+        # The drop-down list shows a virtual model over the event number array: only the visible rows are made.
+        # Its popup is a table view with fixed row heights (a list view lays out every row when shown), and the
+        # combo box size is not computed from the contents (which would also go through every row)
+        self.event_list_model = EventListModel(self.eventNumbers, self)
+        event_list_view = QTableView()
+        event_list_view.horizontalHeader().hide()
+        event_list_view.horizontalHeader().setStretchLastSection(True)
+        event_list_view.verticalHeader().hide()
+        event_list_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        event_list_view.verticalHeader().setDefaultSectionSize(event_list_view.fontMetrics().height() + 4)
+        event_list_view.setShowGrid(False)
+        event_list_view.setSelectionBehavior(QAbstractItemView.SelectRows)
         self.drop_down_list = QComboBox()
         self.drop_down_list.setStyleSheet("combobox-popup: 0;")
+        self.drop_down_list.setSizeAdjustPolicy(QComboBox.AdjustToMinimumContentsLengthWithIcon)
+        self.drop_down_list.setMinimumContentsLength(12)
+        self.drop_down_list.setModel(self.event_list_model)
+        self.drop_down_list.setView(event_list_view)
         self.drop_down_list.setMaxVisibleItems(20) # Set maximum visible items in dropdown
-        display_items = ["<Default>"] + [str(event) for event in self.eventNumbers]
-        self.drop_down_list.addItems(display_items)
-        self.drop_down_list.currentTextChanged.connect(self.number_changed)
+        self.drop_down_list.currentIndexChanged.connect(self.number_changed)
         self.drop_down_list.setCurrentIndex(0)
         
+        # Jump box (event number, Enter to select it) and previous/next event buttons
+        navigationLayout = QHBoxLayout()
+        self.prev_button = QPushButton("< Prev")
+        self.prev_button.setShortcut(QKeySequence("Ctrl+Left"))
+        self.prev_button.setToolTip("Previous listed event (Ctrl+Left)")
+        self.prev_button.clicked.connect(partial(self.on_step_event, -1))
+        self.jump_box = QLineEdit()
+        self.jump_box.setPlaceholderText("Go to event number")
+        self.jump_box.returnPressed.connect(self.on_jump_entered)
+        self.next_button = QPushButton("Next >")
+        self.next_button.setShortcut(QKeySequence("Ctrl+Right"))
+        self.next_button.setToolTip("Next listed event (Ctrl+Right)")
+        self.next_button.clicked.connect(partial(self.on_step_event, 1))
+        navigationLayout.addWidget(self.prev_button)
+        navigationLayout.addWidget(self.jump_box)
+        navigationLayout.addWidget(self.next_button)
+        
         sidePanelLayout.addWidget(self.drop_down_list)
+        sidePanelLayout.addLayout(navigationLayout)
+        
+        # Colouring of the hit cells: by cluster, or by cell energy (linear/log scale) with a colour map
+        colorLayout = QHBoxLayout()
+        self.color_mode_box = QComboBox()
+        self.color_mode_box.addItems(list(self.color_mode_choices))
+        self.color_mode_box.currentTextChanged.connect(self.on_color_mode_changed)
+        self.colormap_box = QComboBox()
+        self.colormap_box.addItems(list(cfg.cell_colormaps))
+        self.colormap_box.setEnabled(False)
+        self.colormap_box.currentTextChanged.connect(self.on_color_mode_changed)
+        colorLayout.addWidget(self.color_mode_box)
+        colorLayout.addWidget(self.colormap_box)
+        sidePanelLayout.addLayout(colorLayout)
+        
+        # Overlay of the hit cells of all listed events (drawn on top of the selected event)
+        overlayLayout = QHBoxLayout()
+        self.overlay_button = QPushButton("Overlay listed events")
+        self.overlay_button.setCheckable(True)
+        self.overlay_button.toggled.connect(self.on_overlay_toggled)
+        self.overlay_color_box = QComboBox()
+        self.overlay_color_box.addItems(list(self.overlay_color_choices))
+        self.overlay_color_box.currentTextChanged.connect(self.on_overlay_color_changed)
+        overlayLayout.addWidget(self.overlay_button)
+        overlayLayout.addWidget(self.overlay_color_box)
+        sidePanelLayout.addLayout(overlayLayout)
         
         return sidePanelBase
     
+    def _set_drop_down_events(self, eventNumbers):
+        """
+        Replace the event numbers of the drop-down list (the displayed event is kept on screen)
+        """
+        with self._signal_blocker(self.drop_down_list):
+            self.event_list_model.setEventNumbers(eventNumbers)
+            self.drop_down_list.setCurrentIndex(0)
+    
     def _create_detector_selection_panel(self) -> QWidget:
         """
         Creates panel containing group header and sub-detector checkboxes
@@ -145,6 +393,22 @@ class CaloLITE_Window(QMainWindow):
         sidePanelLayout.addStretch(1) # Push all group sections to the top
         return sidePanelBase
     
+    def _create_cell_info_panel(self) -> QWidget:
+        """
+        Creates panel showing the information of the cell clicked on the main stage
+        """
+        sidePanelBase = QWidget(self)
+        sidePanelLayout = QVBoxLayout(sidePanelBase)
+        
+        self.cell_info_label = QLabel("Click on a cell to show its information")
+        self.cell_info_label.setWordWrap(True)
+        self.cell_info_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        self.mainStageWidget.cellPicked.connect(self.showCellInfo)
+        
+        sidePanelLayout.addWidget(self.cell_info_label)
+        
+        return sidePanelBase
+    
     def _create_auxfunc_panel(self) -> QWidget:
         """
         Creates panel for axis control
@@ -159,9 +423,29 @@ class CaloLITE_Window(QMainWindow):
         
         self.reset_cam = QPushButton("Reset Cam")
         self.reset_cam.clicked.connect(self.on_reset_camera_clicked)
+        
+        # Frame times over the main stage
+        self.hud_checkbox = QCheckBox("HUD")
+        self.hud_checkbox.setChecked(self.mainStageWidget.show_hud)
+        self.hud_checkbox.setToolTip("Show FPS, CPU/GPU time per frame and the costliest renderables")
+        self.hud_checkbox.toggled.connect(self.on_hud_toggled)
+        
+        # Cells drawn as their boxes/wedges instead of points
+        self.cell_volumes_checkbox = QCheckBox("Cell volumes")
+        self.cell_volumes_checkbox.setChecked(self.mainStageWidget.show_cell_volumes)
+        self.cell_volumes_checkbox.setToolTip("Draw the calorimeter cells as outlines of their real extents, and the hit cells as filled volumes")
+        self.cell_volumes_checkbox.toggled.connect(self.on_cell_volumes_toggled)
+         
+        # Colours of the calorimeter layers: per layer, or cross-event occupancy of every cell
+        self.geometry_color_box = QComboBox()
+        self.geometry_color_box.addItems(list(self.geometry_color_choices))
+        self.geometry_color_box.currentTextChanged.connect(self.on_geometry_color_changed)
          
         sidePanelLayout.addWidget(self.toggle_axis)
         sidePanelLayout.addWidget(self.reset_cam) 
+        sidePanelLayout.addWidget(self.hud_checkbox)
+        sidePanelLayout.addWidget(self.cell_volumes_checkbox)
+        sidePanelLayout.addWidget(self.geometry_color_box)
         
         return sidePanelBase
     
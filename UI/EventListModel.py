@@ -0,0 +1,94 @@
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex
+import numpy as np
+
+
+class EventListModel(QAbstractListModel):
+    """
+    Virtual list model of the event drop-down list, backed by a sorted array of event numbers.
+
+    Row 0 is the "<Default>" item, row i > 0 is event event_numbers[i-1]. No item is stored: the text of a row
+    is only made when the view asks for it (i.e. for the rows on screen), and looking up an event (typed jump,
+    keyboard search) is a binary search over the array, so that the cost of the list does not depend on the
+    number of events.
+    """
+    default_text = "<Default>"
+
+    def __init__(self, eventNumbers=None, parent=None):
+        super().__init__(parent)
+        self._event_numbers = np.zeros(0, dtype=np.int64)
+        self._n_events = 0          # used part of _event_numbers (which has spare capacity for appends)
+        if eventNumbers is not None:
+            self.setEventNumbers(eventNumbers)
+
+    # (Public) The listed event numbers (sorted np.ndarray, not to be modified)
+    @property
+    def event_numbers(self) -> np.ndarray:
+        return self._event_numbers[:self._n_events]
+
+    # (Public) Replace the listed event numbers (sorted)
+    def setEventNumbers(self, eventNumbers):
+        self.beginResetModel()
+        self._event_numbers = np.array(eventNumbers, dtype=np.int64)
+        self._n_events = len(self._event_numbers)
+        self.endResetModel()
+
+    # (Public) Add event numbers at the end of the list (sorted, and not smaller than the listed ones)
+    def appendEventNumbers(self, eventNumbers):
+        eventNumbers = np.asarray(eventNumbers, dtype=np.int64)
+        if len(eventNumbers) == 0:
+            return
+        n_events = self._n_events + len(eventNumbers)
+        if n_events > len(self._event_numbers):
+            # Grow by doubling, so that loading the events chunk by chunk stays linear
+            grown = np.empty(max(n_events, 2 * len(self._event_numbers)), dtype=np.int64)
+            grown[:self._n_events] = self.event_numbers
+            self._event_numbers = grown
+        self.beginInsertRows(QModelIndex(), self._n_events + 1, n_events)
+        self._event_numbers[self._n_events:n_events] = eventNumbers
+        self._n_events = n_events
+        self.endInsertRows()
+
+    # (Public) Event number of a row, None for the "<Default>" row or out of range
+    def eventNumberAt(self, row: int):
+        if not 1 <= row <= self._n_events:
+            return None
+        return int(self._event_numbers[row - 1])
+
+    # (Public) Row of an event number, None if it is not listed
+    def rowOfEvent(self, evtnum: int):
+        idx = int(np.searchsorted(self.event_numbers, evtnum))
+        if idx == self._n_events or self._event_numbers[idx] != evtnum:
+            return None
+        return idx + 1
+
+    # (Public) Row of the first listed event >= evtnum (the last row if there is none), None if the list is empty
+    def nearestRow(self, evtnum: int):
+        if self._n_events == 0:
+            return None
+        return min(int(np.searchsorted(self.event_numbers, evtnum)), self._n_events - 1) + 1
+
+
+    # =========================================================
+    # QAbstractListModel interface
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._n_events + 1
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        row = index.row()
+        if row == 0:
+            return self.default_text
+        if row > self._n_events:
+            return None
+        return str(self._event_numbers[row - 1])
+
+    def match(self, start, role, value, hits=1, flags=Qt.MatchStartsWith | Qt.MatchWrap):
+        # Used by the keyboard search of the views (typing digits on the drop-down list): the typed number goes to
+        # that event, or to the next listed one, by binary search instead of comparing the text of every row
+        text = str(value).strip()
+        if role not in (Qt.DisplayRole, Qt.EditRole) or not text.isdigit():
+            return []
+        row = self.nearestRow(int(text))
+        return [] if row is None else [self.index(row, 0)]
@@ -0,0 +1,132 @@
+import os
+import numpy as np
+import awkward as ak
+import uproot
+
+from database import config as cfg
+
+# Rough (r, z) placement of each sampling layer [mm]: barrel layers are cylinders of radius r
+# spanning |z| < z_max, endcap layers are disks at |z| = z spanning r_min < r < r_max
+_BARREL_LAYERS = {"PreSamplerB": (1420, 3100), "EMB1": (1550, 3100), "EMB2": (1750, 3100), "EMB3": (1950, 3100),
+                  "TileBar0": (2450, 2800), "TileBar1": (2850, 2800), "TileBar2": (3450, 2800),
+                  "TileGap1": (3100, 3600), "TileGap2": (2700, 3600), "TileGap3": (2000, 3600),
+                  "TileExt0": (2450, 6000), "TileExt1": (2950, 6000), "TileExt2": (3550, 6000)}
+_ENDCAP_LAYERS = {"PreSamplerE": (3650, 1200, 1700), "EME1": (3750, 300, 2000), "EME2": (3900, 300, 2000), "EME3": (4150, 300, 2000),
+                  "HEC0": (4400, 400, 2000), "HEC1": (4750, 400, 2000), "HEC2": (5200, 400, 2000), "HEC3": (5650, 400, 2000),
+                  "FCAL0": (4800, 70, 450), "FCAL1": (5250, 70, 450), "FCAL2": (5700, 70, 450)}
+
+
+def make_geometry_file(file_name: str, n_cells: int = 187650, seed: int = 0) -> str:
+    """
+    Write a synthetic geometry file with the layout of database/cell_geo+.root:
+    a "CellGeo" TTree with a single entry, each branch being a vector over all cells.
+    """
+    rng = np.random.default_rng(seed)
+    n_layers = len(cfg.sub_detector_namelist)
+    # Layer sizes do not need to match the real geometry, only to be uneven like it
+    layer_weights = rng.uniform(0.2, 1.0, n_layers) ** 3
+    samp = np.sort(rng.choice(n_layers, size=n_cells, p=layer_weights / layer_weights.sum())).astype(np.uint16)
+
+    phi = rng.uniform(-np.pi, np.pi, n_cells)
+    r = np.empty(n_cells)
+    z = np.empty(n_cells)
+    for samp_num, samp_name in enumerate(cfg.sub_detector_namelist):
+        in_layer = samp == samp_num
+        n_in_layer = int(in_layer.sum())
+        if samp_name in _BARREL_LAYERS:
+            r_layer, z_max = _BARREL_LAYERS[samp_name]
+            r[in_layer] = r_layer
+            z[in_layer] = rng.uniform(-z_max, z_max, n_in_layer)
+        else:
+            z_layer, r_min, r_max = _ENDCAP_LAYERS[samp_name]
+            r[in_layer] = rng.uniform(r_min, r_max, n_in_layer)
+            z[in_layer] = z_layer * rng.choice([-1.0, 1.0], n_in_layer)
+    eta = np.arcsinh(z / r)
+
+    branches = {"cell_geo_ID": np.sort(rng.choice(np.arange(7 * 10**8, 7 * 10**8 + 4 * n_cells), n_cells, replace=False)).astype(np.uint64),
+                "cell_geo_sampling": samp,
+                "cell_geo_eta": eta.astype(np.float32),
+                "cell_geo_phi": phi.astype(np.float32),
+                "cell_geo_rPerp": r.astype(np.float32),
+                "cell_geo_X": (r * np.cos(phi)).astype(np.float32),
+                "cell_geo_Y": (r * np.sin(phi)).astype(np.float32),
+                "cell_geo_Z": z.astype(np.float32),
+                "cell_geo_deta": np.full(n_cells, 0.025, dtype=np.float32),
+                "cell_geo_dphi": np.full(n_cells, 2 * np.pi / 256, dtype=np.float32)}
+
+    with uproot.recreate(file_name) as f:
+        f.mktree("CellGeo", {name: ak.Array([values]).type.content for name, values in branches.items()})
+        f["CellGeo"].extend({name: ak.Array([values]) for name, values in branches.items()})
+    return file_name
+
+
+def make_event_file(file_name: str, geometry_file: str, n_events: int = 1000, mean_clusters: float = 3.0,
+                    mean_cells_per_cluster: float = 60.0, tree_name: str = "EventTree",
+                    branch_prefix: str = "mgex422_cluster_cell", seed: int = 0) -> str:
+    """
+    Write a synthetic ParticleGun-like event file: eventNumber, truthPartEta/Phi (one or two particles)
+    and {branch_prefix}_X/_Y/_Z/_ID/_E, a list of clusters per event each being a list of cells picked
+    from the geometry file (so coordinates and IDs match the geometry).
+
+    uproot can only write singly-jagged branches into a TTree, so the event tree is written as an RNTuple,
+    which uproot reads back through the same interface as a TTree.
+    """
+    rng = np.random.default_rng(seed)
+    with uproot.open(geometry_file) as f:
+        tree = f["CellGeo"]
+        geo = {name: tree[f"cell_geo_{name}"].array()[0].to_numpy() for name in ("ID", "X", "Y", "Z", "eta", "phi")}
+
+    n_particles = rng.integers(1, 3, n_events)
+    truth_eta = rng.uniform(-2.5, 2.5, n_particles.sum())
+    truth_phi = rng.uniform(-np.pi, np.pi, n_particles.sum())
+
+    # Cells are picked around the direction of the first particle of each event
+    n_clusters = rng.poisson(mean_clusters, n_events)
+    n_cells = np.maximum(rng.poisson(mean_cells_per_cluster, n_clusters.sum()), 1)
+    first_particle = np.concatenate([[0], np.cumsum(n_particles)[:-1]])
+    cell_event = np.repeat(np.repeat(np.arange(n_events), n_clusters), n_cells)
+    cell_dir_eta = truth_eta[first_particle][cell_event] + rng.normal(0, 0.1, len(cell_event))
+    cell_dir_phi = truth_phi[first_particle][cell_event] + rng.normal(0, 0.1, len(cell_event))
+
+    # Random geometry cell in the same (eta, phi) bin as the hit direction (or the next non-empty bin)
+    n_phi_bins = 64
+    def bin_key(eta, phi):
+        eta_bin = np.clip(((eta + 5.0) / 0.1).astype(np.int64), 0, 99)
+        phi_bin = ((phi + np.pi) / (2 * np.pi / n_phi_bins)).astype(np.int64) % n_phi_bins
+        return eta_bin * n_phi_bins + phi_bin
+    geo_order = np.argsort(bin_key(geo["eta"], geo["phi"]), kind="stable")
+    geo_sorted_keys = bin_key(geo["eta"], geo["phi"])[geo_order]
+    hit_keys = bin_key(cell_dir_eta, (cell_dir_phi + np.pi) % (2 * np.pi) - np.pi)
+    bin_start = np.searchsorted(geo_sorted_keys, hit_keys, side="left")
+    bin_width = np.searchsorted(geo_sorted_keys, hit_keys, side="right") - bin_start
+    picked = bin_start + (rng.random(len(hit_keys)) * np.maximum(bin_width, 1)).astype(np.int64)
+    cells = geo_order[np.clip(picked, 0, len(geo_order) - 1)]
+
+    def nest(values):
+        return ak.unflatten(ak.unflatten(values, n_cells), n_clusters)
+
+    with uproot.recreate(file_name) as f:
+        f[tree_name] = {"eventNumber": rng.permutation(np.arange(n_events, dtype=np.int64) * 3 + 1000),
+                        "truthPartEta": ak.unflatten(truth_eta.astype(np.float32), n_particles),
+                        "truthPartPhi": ak.unflatten(truth_phi.astype(np.float32), n_particles),
+                        f"{branch_prefix}_X": nest(geo["X"][cells]),
+                        f"{branch_prefix}_Y": nest(geo["Y"][cells]),
+                        f"{branch_prefix}_Z": nest(geo["Z"][cells]),
+                        f"{branch_prefix}_ID": nest(geo["ID"][cells]),
+                        f"{branch_prefix}_E": nest(rng.exponential(300.0, len(cells)).astype(np.float32))}
+    return file_name
+
+
+def make_fixtures(directory: str, n_cells: int, n_events: int, mean_clusters: float = 3.0,
+                  mean_cells_per_cluster: float = 60.0, seed: int = 0) -> tuple[str, str]:
+    """
+    Return (geometry file, event file) of the requested sizes in `directory`, writing them if they do not exist yet
+    """
+    os.makedirs(directory, exist_ok=True)
+    geometry_file = os.path.join(directory, f"cell_geo_{n_cells}.root")
+    event_file = os.path.join(directory, f"events_{n_cells}_{n_events}_{mean_clusters:g}_{mean_cells_per_cluster:g}.root")
+    if not os.path.exists(geometry_file):
+        make_geometry_file(geometry_file, n_cells, seed)
+    if not os.path.exists(event_file):
+        make_event_file(event_file, geometry_file, n_events, mean_clusters, mean_cells_per_cluster, seed=seed)
+    return geometry_file, event_file
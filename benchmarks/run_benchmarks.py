@@ -0,0 +1,211 @@
+"""
+Headless benchmark suite on synthetic ROOT fixtures.
+
+Run from the repository root:
+    python -m benchmarks.run_benchmarks --events 10000 --output bench_results.json
+
+Times the construction of CalorimeterManager (cold from ROOT, warm from the geometry cache) and of the
+cell volumes, EventManager (eager, eager in cell-ID mode, lazy, and from the Arrow file converted with convert_events.py
+when pyarrow is installed), the per-event summaries and queries, the cross-event cell occupancy, per-event
+getter access, and offscreen rendering of MainStage.paintGL (Qt offscreen platform, software OpenGL). Results are written as JSON.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import statistics
+import numpy as np
+
+from benchmarks.SyntheticFixtures import make_fixtures
+from useCaseClasses.CalorimeterManager import CalorimeterManager
+from useCaseClasses.EventManager import EventManager
+from useCaseClasses.EventSummary import EventSummary
+from useCaseClasses.CellOccupancy import CellOccupancy
+from useCaseClasses.CellVolumes import CellVolumes
+
+
+def time_call(func, repeats: int) -> list[float]:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def make_result(name: str, times: list[float], **params) -> dict:
+    result = {"name": name, "params": params, "repeats": len(times), "times_s": times,
+              "min_s": min(times), "median_s": statistics.median(times), "mean_s": statistics.fmean(times)}
+    print(f"{name:<45} median {result['median_s']*1e3:10.3f} ms   min {result['min_s']*1e3:10.3f} ms   {params if params else ''}")
+    return result
+
+
+def bench_geometry(geometry_file: str, repeats: int) -> list[dict]:
+    cache_dir = f"{geometry_file}.cache"
+    def cold_load():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        CalorimeterManager(geometry_file, use_cache=False)
+    results = [make_result("CalorimeterManager.cold", time_call(cold_load, repeats))]
+
+    CalorimeterManager(geometry_file, use_cache=True)     # write the cache
+    results.append(make_result("CalorimeterManager.warm_cache", time_call(lambda: CalorimeterManager(geometry_file, use_cache=True), repeats)))
+
+    manager = CalorimeterManager(geometry_file, use_cache=True)
+    results.append(make_result("CellVolumes.fromGeometry", time_call(lambda: CellVolumes.fromGeometry(manager.cells_coord, manager.cell_extents,
+                                                                                                       manager.layer_offsets, manager.layer_namelist), repeats),
+                               n_cells=len(manager.cells_coord)))
+    return results
+
+
+def bench_events(event_file: str, repeats: int, n_access: int, tree_name: str, branch_prefix: str,
+                 geometry_file: str = None) -> list[dict]:
+    results = []
+    nbytes = EventManager(event_file, tree_name, branch_prefix).event_store.nbytes
+    results.append(make_result("EventManager.eager", time_call(lambda: EventManager(event_file, tree_name, branch_prefix), repeats),
+                               store_mb=round(nbytes / 1024**2, 2)))
+    results += bench_arrow_events(event_file, repeats, tree_name, branch_prefix)
+    if geometry_file is not None:
+        calorimeter_manager = CalorimeterManager(geometry_file)
+        make_manager = lambda: EventManager(event_file, tree_name, branch_prefix, calorimeter_manager=calorimeter_manager)
+        nbytes = make_manager().event_store.nbytes
+        results.append(make_result("EventManager.eager_cell_ids", time_call(make_manager, repeats), store_mb=round(nbytes / 1024**2, 2)))
+        occupancy_manager = make_manager()
+        accumulate = lambda: CellOccupancy.fromEventManager(occupancy_manager, calorimeter_manager, use_cache=False)
+        results.append(make_result("CellOccupancy.accumulate", time_call(accumulate, repeats), n_events=len(occupancy_manager.getEventNumbers()),
+                                   n_hit_cells=accumulate().n_hit_cells))
+    event_manager = EventManager(event_file, tree_name, branch_prefix)
+    results.append(make_result("EventSummary.build", time_call(lambda: EventSummary.fromEventStore(event_manager.event_store), repeats)))
+    event_summary = event_manager.getEventSummary()
+    query = "1.3 <= eta <= 1.6 and n_clusters >= 3 and n_cells > 200"
+    results.append(make_result("EventSummary.query", time_call(lambda: event_summary.query(query), repeats * 10),
+                               n_events=len(event_summary), n_matching=len(event_summary.query(query))))
+    results.append(make_result("EventManager.lazy", time_call(lambda: EventManager(event_file, tree_name, branch_prefix, lazy=True).close(), repeats)))
+
+    rng = np.random.default_rng(0)
+    for lazy in (False, True):
+        event_manager = EventManager(event_file, tree_name, branch_prefix, lazy=lazy, cache_size=n_access)
+        event_numbers = event_manager.getEventNumbers()
+        sample = [event_numbers[i] for i in rng.choice(len(event_numbers), min(n_access, len(event_numbers)), replace=False)]
+        def access_all():
+            for evtnum in sample:
+                event_manager.getTruthEndTrajXYZforAnEvent(evtnum)
+                event_manager.getTruthEndTrajEtaPhiforAnEvent(evtnum)
+                event_manager.getClustersCellsArrayforAnEvent(evtnum)
+        # First pass is the cold access in lazy mode, later passes hit the cache
+        mode = "lazy" if lazy else "eager"
+        per_event = [t / len(sample) for t in time_call(access_all, 1)]
+        results.append(make_result(f"EventManager.{mode}.first_access_per_event", per_event, n_events=len(sample)))
+        per_event = [t / len(sample) for t in time_call(access_all, repeats)]
+        results.append(make_result(f"EventManager.{mode}.cached_access_per_event", per_event, n_events=len(sample)))
+        if lazy:
+            event_manager.close()
+    return results
+
+
+def bench_arrow_events(event_file: str, repeats: int, tree_name: str, branch_prefix: str) -> list[dict]:
+    # Same events converted to Arrow IPC (skipped without pyarrow)
+    try:
+        from convert_events import convertFile
+    except ImportError:
+        print("pyarrow not installed, skipping the Arrow event file benchmarks")
+        return []
+    arrow_file = os.path.splitext(event_file)[0] + ".arrow"
+    if not os.path.exists(arrow_file) or os.path.getmtime(arrow_file) < os.path.getmtime(event_file):
+        convertFile(event_file, arrow_file, tree_name, branch_prefix, batch_size=50000)
+    results = [make_result("EventManager.eager_arrow", time_call(lambda: EventManager(arrow_file, tree_name, branch_prefix), repeats))]
+    event_manager = EventManager(arrow_file, tree_name, branch_prefix, lazy=True)
+    event_numbers = event_manager.getEventNumbers()[:200]
+    def access_all():
+        for evtnum in event_numbers:
+            event_manager.event_source.readEntry(*event_manager.event_index.lookup(evtnum))
+    per_event = [t / len(event_numbers) for t in time_call(access_all, repeats)]
+    results.append(make_result("EventManager.lazy_arrow.read_entry_per_event", per_event, n_events=len(event_numbers)))
+    event_manager.close()
+    return results
+
+
+def bench_render(geometry_file: str, event_file: str, n_frames: int, tree_name: str, branch_prefix: str,
+                 width: int, height: int) -> list[dict]:
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.environ.setdefault("LIBGL_ALWAYS_SOFTWARE", "1")
+    from PySide6.QtCore import Qt, QCoreApplication
+    from PySide6.QtGui import QSurfaceFormat
+    from PySide6.QtWidgets import QApplication
+    from controllers.CalorimeterController import CalorimeterController
+    from controllers.EventController import EventController
+    from controllers.Renderable import Axis
+    from presenters.MainStage import MainStage, Scene
+
+    QCoreApplication.setAttribute(Qt.AA_UseSoftwareOpenGL)
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    fmt = QSurfaceFormat()
+    fmt.setDepthBufferSize(24)
+    QSurfaceFormat.setDefaultFormat(fmt)
+
+    calorimeter_controller = CalorimeterController(CalorimeterManager(geometry_file))
+    event_manager = EventManager(event_file, tree_name, branch_prefix)
+    event_controller = EventController(event_manager)
+    event_controller.setCalorimeterManager(calorimeter_controller.calo_manager)
+    mainStage = MainStage(Scene(), Axis(), calorimeter_controller.getAllSubDetector(), event_controller)
+    mainStage.resize(width, height)
+
+    first_frame_time = time_call(mainStage.grabFramebuffer, 1)
+    if not mainStage.isValid():
+        print("Offscreen rendering skipped: could not create an OpenGL context")
+        return [{"name": "MainStage.paintGL", "skipped": "could not create an OpenGL context"}]
+
+    results = [make_result("MainStage.first_frame", first_frame_time, width=width, height=height)]
+    def rotate_and_grab():
+        mainStage.yRot += 2.0
+        mainStage.grabFramebuffer()
+    results.append(make_result("MainStage.paintGL.geometry", time_call(rotate_and_grab, n_frames), width=width, height=height))
+    mainStage.interacting = True
+    results.append(make_result("MainStage.paintGL.geometry_low_detail", time_call(rotate_and_grab, n_frames), width=width, height=height))
+    mainStage.interacting = False
+
+    event_controller.updateTargetEventDisplay(event_manager.getEventNumbers()[0])
+    results.append(make_result("MainStage.paintGL.geometry_and_event", time_call(rotate_and_grab, n_frames), width=width, height=height))
+    app.processEvents()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Headless CaloLITE benchmarks on synthetic ROOT fixtures")
+    parser.add_argument('-c', "--cells", type=int, default=187650, help="Number of cells in the synthetic geometry")
+    parser.add_argument('-e', "--events", type=int, default=2000, help="Number of events in the synthetic event file")
+    parser.add_argument('-nc', "--mean_clusters", type=float, default=3.0, help="Mean number of clusters per event")
+    parser.add_argument('-ncc', "--mean_cells_per_cluster", type=float, default=60.0, help="Mean number of cells per cluster")
+    parser.add_argument('-r', "--repeats", type=int, default=3, help="Repeats of each construction benchmark")
+    parser.add_argument('-na', "--n_access", type=int, default=200, help="Number of events accessed in the getter benchmarks")
+    parser.add_argument('-nf', "--n_frames", type=int, default=30, help="Number of frames in the rendering benchmarks")
+    parser.add_argument("--width", type=int, default=1200, help="Width of the offscreen frame")
+    parser.add_argument("--height", type=int, default=800, help="Height of the offscreen frame")
+    parser.add_argument("--no_render", action="store_true", help="Skip the offscreen rendering benchmarks")
+    parser.add_argument('-fd', "--fixtures_dir", type=str, default="benchmarks/fixtures", help="Directory where the synthetic ROOT files are written (and reused)")
+    parser.add_argument('-o', "--output", type=str, default="bench_results.json", help="JSON file the results are written to")
+    args = parser.parse_args()
+
+    tree_name, branch_prefix = "EventTree", "mgex422_cluster_cell"
+    print("Preparing fixtures...")
+    geometry_file, event_file = make_fixtures(args.fixtures_dir, args.cells, args.events,
+                                              args.mean_clusters, args.mean_cells_per_cluster)
+
+    results = []
+    results += bench_geometry(geometry_file, args.repeats)
+    results += bench_events(event_file, args.repeats, args.n_access, tree_name, branch_prefix, geometry_file)
+    if not args.no_render:
+        results += bench_render(geometry_file, event_file, args.n_frames, tree_name, branch_prefix, args.width, args.height)
+
+    import uproot, awkward
+    report = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "machine": {"platform": platform.platform(), "processor": platform.processor(), "python": platform.python_version(),
+                          "numpy": np.__version__, "uproot": uproot.__version__, "awkward": awkward.__version__},
+              "fixtures": {"geometry_file": geometry_file, "event_file": event_file, "cells": args.cells, "events": args.events,
+                           "mean_clusters": args.mean_clusters, "mean_cells_per_cluster": args.mean_cells_per_cluster},
+              "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
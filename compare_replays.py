@@ -0,0 +1,57 @@
+"""
+Compare the frame times of replays of the same recorded session (launch.py --replay), e.g. before and after
+a change, or on two machines.
+
+Run from the repository root, e.g.:
+    python compare_replays.py session_before_timings.json session_after_timings.json
+
+For each record type (camera, event, layer, group, axis, and all of them), prints the p50/p95/p99 frame time
+of every file and, for the files after the first one, their ratio to the first one (> 1: slower).
+"""
+import sys
+import json
+import argparse
+
+
+def loadTimings(path: str) -> dict:
+    with open(path) as f:
+        timings = json.load(f)
+    if "frame_ms" not in timings:
+        sys.exit(f"{path} is not a replay timings file")
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the frame-time percentiles of replays of a recorded session")
+    parser.add_argument("timing_files", type=str, nargs='+', help="Replay timings files (the first one is the reference)")
+    parser.add_argument('-p', "--percentiles", type=str, nargs='+', default=["p50", "p95", "p99"], choices=["mean", "p50", "p90", "p95", "p99", "max"], help="Percentiles shown")
+    parser.add_argument('-a', "--actions", action="store_true", help="Also compare the time to apply each record (event reading, layer toggles, ...)")
+    args = parser.parse_args()
+
+    all_timings = [loadTimings(path) for path in args.timing_files]
+    recordings = {timings["recording"] for timings in all_timings}
+    if len(recordings) > 1:
+        print(f"Warning: replays of different recordings ({', '.join(sorted(recordings))})")
+    stage_sizes = {tuple(timings["stage_size"]) for timings in all_timings}
+    if len(stage_sizes) > 1:
+        print(f"Warning: replays on different main stage sizes ({', '.join(f'{w}x{h}' for w, h in sorted(stage_sizes))})")
+    for idx, (path, timings) in enumerate(zip(args.timing_files, all_timings)):
+        renderer = timings.get("gl_info", {}).get("gl_renderer", "unknown renderer")
+        width, height = timings["stage_size"]
+        print(f"[{idx}] {path}: {timings['n_records']} records x {timings['repeats']}, {width}x{height}, {renderer}")
+
+    sections = [("frame_ms", "Frame time [ms]")] + ([("action_ms", "Action time [ms]")] if args.actions else [])
+    for section, title in sections:
+        print(f"\n{title}")
+        record_types = list(dict.fromkeys(record_type for timings in all_timings for record_type in timings[section]))
+        for record_type in record_types:
+            reference = all_timings[0][section].get(record_type, {})
+            for percentile in args.percentiles:
+                cells = []
+                for timings in all_timings:
+                    value = timings[section].get(record_type, {}).get(percentile)
+                    text = f"{value:9.2f}" if value is not None else "        -"
+                    if timings is not all_timings[0] and value is not None and reference.get(percentile):
+                        text += f" (x{value / reference[percentile]:.2f})"
+                    cells.append(f"{text:<18}")
+                print(f"  {record_type:<7} {percentile:<4} " + "".join(cells))
@@ -1,12 +1,17 @@
 from OpenGL.GL import *
 from OpenGL.GLU import *
+import numpy as np
 
 from database import config as cfg
-from controllers.Renderable import Renderable
+from controllers.Renderable import Renderable, DrawState
+from controllers.VertexBuffer import VertexBuffer
+from controllers.InstancedMesh import InstancedMesh
+from controllers.ColorMap import ColorMap
 from useCaseClasses.CalorimeterManager import CalorimeterManager
 
 class CalorimeterController():
-    def __init__(self, caloManager:CalorimeterManager) -> None:
+    # lod_fraction: fraction of the cells of each layer drawn while the camera is moving (0 to always draw all cells)
+    def __init__(self, caloManager:CalorimeterManager, lod_fraction: float = 0.08) -> None:
         self.calo_manager = caloManager
         
         self.SD_namelist = cfg.sub_detector_namelist
@@ -16,8 +21,42 @@ class CalorimeterController():
         
         for idx, samp_name in enumerate(self.SD_namelist):
             SD_cells = self.calo_manager.getCalorimeterCells(samp_name)
-            SD_controller = SubDetectorController(SD_cells, size=self.SD_sizelist[idx], color=self.SD_colorlist[idx])
+            SD_lod_rows = self.calo_manager.getDecimatedCellRows(samp_name, lod_fraction) if lod_fraction > 0 else None
+            SD_controller = SubDetectorController(SD_cells, size=self.SD_sizelist[idx], color=self.SD_colorlist[idx], SD_lod_rows=SD_lod_rows)
             self.SD_controllers[samp_name] = SD_controller
+        self.show_volumes = False
+    
+    # (Public) Draw the cells of every layer as volumes (outlines of their boxes/wedges, see CalorimeterManager.getCellVolumes)
+    # instead of points; the volumes are computed the first time
+    def showCellVolumes(self, visible: bool):
+        if visible:
+            cell_volumes = self.calo_manager.getCellVolumes()
+            layer_offsets = self.calo_manager.layer_offsets
+            for idx, samp_name in enumerate(self.SD_namelist):
+                SD_controller = self.SD_controllers[samp_name]
+                if SD_controller.volume_mesh is None:
+                    SD_controller.setVolumes(cell_volumes.instances[layer_offsets[idx]:layer_offsets[idx+1]])
+        for SD_controller in self.SD_controllers.values():
+            SD_controller.show_volumes = visible
+        self.show_volumes = visible
+    
+    # (Public) Colour every cell of the geometry from one value per cell (rows of CalorimeterManager.cells_coord, e.g. hit
+    # counts), on a "linear" or "log" scale of a colour map of cfg.cell_colormaps; cells with a value <= 0 get empty_color.
+    # None restores the colour of each layer.
+    def showCellValues(self, values=None, scale: str = "log", colormap: str = "viridis", empty_color=(0.55, 0.55, 0.55)):
+        if values is None:
+            for SD_controller in self.SD_controllers.values():
+                SD_controller.setCellColors(None)
+            return
+        values = np.asarray(values)
+        filled = values > 0
+        colors = np.empty((len(values), 3), dtype=np.float32)
+        colors[:] = empty_color
+        if filled.any():
+            colors[filled] = ColorMap.get(colormap).map(values[filled], scale=scale)
+        layer_offsets = self.calo_manager.layer_offsets
+        for idx, samp_name in enumerate(self.SD_namelist):
+            self.SD_controllers[samp_name].setCellColors(colors[layer_offsets[idx]:layer_offsets[idx+1]])
     
            
     def getSubDetector(self, samp_name: str) -> Renderable:
@@ -28,22 +67,55 @@ class CalorimeterController():
 
 
 class SubDetectorController(Renderable):
-    def __init__(self, SD_cells, size=1.5, color=(0,0,0)):
-        self.cells_coords = SD_cells   # List((float, float, float))
+    def __init__(self, SD_cells, size=1.5, color=(0,0,0), SD_lod_rows=None):
+        self.cells_coords = SD_cells   # np.ndarray, shape (N, 3), float32
         self.point_size = size 
         self.color = color
+        self.draw_state = DrawState(point_size=size)     # Set by the Scene, once for all layers of the same size
+        # Static geometry: uploaded once to the GPU on first render, then drawn in a single call
+        self.vertex_buffer = VertexBuffer(self.cells_coords)
+        # Decimated subset of the cells (rows SD_lod_rows), drawn instead while the stage asks for low detail (camera moving)
+        self.lod_rows = SD_lod_rows
+        self.lod_vertex_buffer = VertexBuffer(self.cells_coords[SD_lod_rows]) if SD_lod_rows is not None else None
+        # Optional volumes of the cells (setVolumes), drawn as outlines instead of the points while show_volumes
+        self.volume_mesh = None
+        self.lod_volume_mesh = None
+        self.show_volumes = False
+        
+    # (Public) Give the volumes of the cells ((N, 13) instances, see CellVolumes), in the order of the cells
+    def setVolumes(self, instances):
+        self.volume_mesh = InstancedMesh(instances)
+        self.lod_volume_mesh = InstancedMesh(instances[self.lod_rows]) if self.lod_rows is not None else None
+        colors = self.vertex_buffer.colors
+        if colors is not None:
+            self.volume_mesh.setColors(colors)
+            if self.lod_volume_mesh is not None:
+                self.lod_volume_mesh.setColors(colors[self.lod_rows])
+        
+    # (Public) Draw the cells with one colour each ((N, 3), e.g. from CalorimeterController.showCellValues),
+    # None for the colour of the layer
+    def setCellColors(self, colors):
+        self.vertex_buffer.setColors(colors)
+        if self.lod_vertex_buffer is not None:
+            self.lod_vertex_buffer.setColors(colors[self.lod_rows] if colors is not None else None)
+        if self.volume_mesh is not None:
+            self.volume_mesh.setColors(colors)
+            if self.lod_volume_mesh is not None:
+                self.lod_volume_mesh.setColors(colors[self.lod_rows] if colors is not None else None)
         
     def render(self, target_stage):
-        if not self.cells_coords:
+        if len(self.cells_coords) == 0:
             # Check if list of cell coord is empty, should neve get here
             return
         
-        glPointSize(self.point_size)
+        low_detail = getattr(target_stage, "low_detail", False)
+        if self.show_volumes and self.volume_mesh is not None and InstancedMesh.isSupported():
+            volume_mesh = self.lod_volume_mesh if self.lod_volume_mesh is not None and low_detail else self.volume_mesh
+            volume_mesh.draw(filled=False, color=self.color, use_colors=True)
+            return
+        
         glColor3f(*self.color)
-        glBegin(GL_POINTS)
-        for cell_coord in self.cells_coords:
-            glVertex3f(*cell_coord)
-        glEnd()
-            
-            
-            
+        if self.lod_vertex_buffer is not None and low_detail:
+            self.lod_vertex_buffer.draw(GL_POINTS, use_colors=True)
+        else:
+            self.vertex_buffer.draw(GL_POINTS, use_colors=True)
@@ -0,0 +1,63 @@
+import numpy as np
+
+from database import config as cfg
+
+
+class ColorMap:
+    """
+    Colour lookup table mapping scalar values (e.g. cell energies) to RGB colours.
+
+    The colours given at evenly spaced stops are interpolated once into a table of `n_colors` entries,
+    so that mapping N values is one normalisation and one gather into the table (no per-value Python work).
+    """
+    _colormaps = {}     # name -> ColorMap, built on first use from cfg.cell_colormaps
+
+    def __init__(self, stops, n_colors: int = 256):
+        stops = np.asarray(stops, dtype=np.float64).reshape(-1, 3)
+        stop_positions = np.linspace(0.0, 1.0, len(stops))
+        positions = np.linspace(0.0, 1.0, n_colors)
+        self.table = np.column_stack([np.interp(positions, stop_positions, stops[:, channel])
+                                      for channel in range(3)]).astype(np.float32)     # (n_colors, 3)
+
+    # (Public) Return the colour map of a name in cfg.cell_colormaps
+    @staticmethod
+    def get(name: str) -> 'ColorMap':
+        if name not in ColorMap._colormaps:
+            if name not in cfg.cell_colormaps:
+                raise ValueError(f"Unknown colour map {name} (available: {', '.join(cfg.cell_colormaps)})")
+            ColorMap._colormaps[name] = ColorMap(cfg.cell_colormaps[name])
+        return ColorMap._colormaps[name]
+
+    # (Public) Return the (vmin, vmax) range used for some values: their min/max, for a log scale
+    # the smallest positive value (at least 1e-3 of the maximum) as minimum
+    @staticmethod
+    def valueRange(values, scale: str = "linear"):
+        values = np.asarray(values)
+        if len(values) == 0:
+            return 0.0, 1.0
+        vmax = float(values.max())
+        if scale == "log":
+            positive = values[values > 0]
+            if len(positive) == 0:
+                return 1.0, 1.0
+            return max(float(positive.min()), vmax * 1e-3), vmax
+        return float(values.min()), vmax
+
+    # (Public) Return the (N, 3) float32 colours of N values on a "linear" or "log" scale between vmin and vmax
+    # (default: valueRange of the values); values outside of the range get the colour of the closest end
+    def map(self, values, vmin: float = None, vmax: float = None, scale: str = "linear") -> np.ndarray:
+        if scale not in ("linear", "log"):
+            raise ValueError(f"Unknown colour scale {scale} (linear or log)")
+        values = np.asarray(values, dtype=np.float64)
+        auto_vmin, auto_vmax = self.valueRange(values, scale) if vmin is None or vmax is None else (vmin, vmax)
+        vmin = auto_vmin if vmin is None else vmin
+        vmax = auto_vmax if vmax is None else vmax
+
+        if scale == "log":
+            vmin = max(vmin, np.finfo(np.float64).tiny)
+            values = np.log(np.maximum(values, vmin))
+            vmin, vmax = np.log(vmin), np.log(max(vmax, vmin))
+        span = vmax - vmin
+        normalised = (values - vmin) / span if span > 0 else np.zeros_like(values)
+        indices = np.clip((normalised * (len(self.table) - 1) + 0.5).astype(np.int64), 0, len(self.table) - 1)
+        return self.table[indices]
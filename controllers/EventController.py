@@ -4,56 +4,274 @@ import numpy as np
 
 from database import config as cfg
 from useCaseClasses.EventManager import EventManager
-from controllers.Renderable import Renderable
+from useCaseClasses.EventPrefetcher import EventPrefetcher
+from useCaseClasses.LayeredEventCells import LayeredEventCells
+from useCaseClasses.CellSpatialIndex import CellSpatialIndex
+from controllers.Renderable import Renderable, DrawState
+from controllers.VertexBuffer import VertexBuffer
+from controllers.InstancedMesh import InstancedMesh
+from controllers.ColorMap import ColorMap
+from instrumentation.Profiler import profiler
 
 
 class EventController(Renderable):
-    def __init__(self, eventManager: EventManager):
+    # The draw calls of the displayed event (one per layer and cluster, one line per particle) are recorded once
+    # by the Scene and replayed until the event, its colours or the visible layers change (markDirty); not when
+    # the hit cells are drawn as volumes (instanced draws are not recorded in display lists)
+    @property
+    def cacheable(self):
+        return self.cell_volumes is None
+    
+    def __init__(self, eventManager: EventManager, prefetcher: EventPrefetcher = None):
         self.eventManager = eventManager
+        self.prefetcher = prefetcher                # Optional, prepares the neighbouring events in the background
         self.targetEvt_num = None
-        self.targetEvt_TruthEndTrajXYZ = None       # Now a list of tuples: [(x1,y1,z1), (x2,y2,z2), ...]
-        self.targetEvt_TruthEndTrajEtaPhi = None
-        self.targetEvt_ClustersCellsCoord = None    # [cluster 1: [cell 1: (x1, y1, z1), cell2: (x2, y2, z2)], cluster 2: [...], ... ]
+        self.targetEvt_TruthEndTrajXYZ = None       # np.ndarray (n_particles, 3): [(x1,y1,z1), (x2,y2,z2), ...]
+        self.targetEvt_TruthEndTrajEtaPhi = None    # np.ndarray (n_particles, 2)
+        self.targetEvt_ClustersCellsCoord = None    # np.ndarray (n_cells, 3), all cells of all clusters
+        self.targetEvt_ClustersOffsets = None       # np.ndarray (n_clusters+1,), cluster k is cells[offsets[k]:offsets[k+1]]
+        self.targetEvt_LayeredCells = None          # LayeredEventCells, once the geometry is known (see setCalorimeterManager)
+        self._targetEvt_SpatialIndex = None         # CellSpatialIndex over the hit cells, built on the first pick
         self.point_size = 8.0
         self.color_choices = cfg.clusters_color_choices                      
+        self.cells_vertex_buffer = VertexBuffer()
+        
+        # Colour of the hit cells: "cluster" (one colour per cluster) or "energy" (per-cell colours from the cell
+        # energies, which must be loaded, see EventManager load_energies), on a "linear" or "log" scale with
+        # a colour map of cfg.cell_colormaps. Changing it only recomputes the colours of the displayed cells.
+        self.color_mode = "cluster"
+        self.energy_scale = "linear"
+        self.colormap_name = "viridis"
+        self.targetEvt_CellEnergies = None          # np.ndarray (n_cells,) [MeV], in the order of the cells in cells_vertex_buffer
+        self.targetEvt_EnergyRange = None           # (min, max) of the colour scale [MeV]
+        
+        # Hit cells are grouped by sampling layer when a CalorimeterManager is given, so that the layers
+        # hidden with the layer checkboxes are skipped when drawing
+        self.calorimeterManager = None
+        self.layer_visibilities = [True] * len(cfg.sub_detector_namelist)
+        
+        # Hit cells drawn as filled volumes (boxes/wedges of their geometry cells) when the cell volumes are given
+        # (see setCellVolumes), in the order of targetEvt_LayeredCells
+        self.cell_volumes = None
+        self.cells_volume_mesh = InstancedMesh()
+        
+    @property
+    def draw_state(self):
+        return DrawState(point_size=self.point_size, line_width=1.0)
+        
+    # (Public) Give the geometry used to tag the hit cells with their layer, and regroup the displayed event
+    def setCalorimeterManager(self, calorimeterManager):
+        self.calorimeterManager = calorimeterManager
+        if self.prefetcher is not None:
+            self.prefetcher.setCalorimeterManager(calorimeterManager)
+        if self.targetEvt_num is not None:
+            cell_energies = self.eventManager.getClustersCellEnergiesforAnEvent(self.targetEvt_num) if self.eventManager.load_energies else None
+            self._updateTargetEventCells(None, cell_energies)
+        
+    # (Public) Draw the hit cells as the volumes of their cells (CellVolumes, see CalorimeterManager.getCellVolumes),
+    # or as points (None)
+    def setCellVolumes(self, cellVolumes):
+        self.cell_volumes = cellVolumes
+        self._updateCellVolumes()
+        self.markDirty()
+        
+    # (Public) Show/hide the hit cells of a sampling layer (only changes the ranges drawn)
+    def setLayerVisibility(self, samp_name: str, visible: bool):
+        self.layer_visibilities[cfg.sub_detector_namelist.index(samp_name)] = visible
+        self.markDirty()
+    
+    # (Public) Set the colouring of the hit cells (mode: "cluster" or "energy"; scale: "linear" or "log"; colormap: a name of
+    # cfg.cell_colormaps), None keeps the current value. Raises ValueError for unknown values or if the energies are not loaded.
+    def setColorMode(self, mode: str = None, scale: str = None, colormap: str = None):
+        mode = self.color_mode if mode is None else mode
+        scale = self.energy_scale if scale is None else scale
+        colormap = self.colormap_name if colormap is None else colormap
+        if mode not in ("cluster", "energy"):
+            raise ValueError(f"Unknown colour mode {mode} (cluster or energy)")
+        if scale not in ("linear", "log"):
+            raise ValueError(f"Unknown colour scale {scale} (linear or log)")
+        ColorMap.get(colormap)
+        if mode == "energy" and not self.eventManager.load_energies:
+            raise ValueError("Cell energies are not loaded (launch with --energies to colour the cells by energy)")
+        self.color_mode, self.energy_scale, self.colormap_name = mode, scale, colormap
+        self._updateCellColors()
     
     def updateTargetEventDisplay(self, targetEvt_num):
-        self.targetEvt_num = targetEvt_num
-        self.targetEvt_TruthEndTrajXYZ = self.eventManager.getTruthEndTrajXYZforAnEvent(self.targetEvt_num)
-        self.targetEvt_TruthEndTrajEtaPhi = self.eventManager.getTruthEndTrajEtaPhiforAnEvent(self.targetEvt_num)
-        self.targetEvt_ClustersCellsCoord = self.eventManager.getClustersCellsCoordforAnEvent(self.targetEvt_num)
+        with profiler.span("event.switch"):
+            self.targetEvt_num = targetEvt_num
+            if self.prefetcher is not None:
+                prepared_event = self.prefetcher.getPreparedEvent(self.targetEvt_num)
+                self.targetEvt_TruthEndTrajXYZ = prepared_event.traj_xyz
+                self.targetEvt_TruthEndTrajEtaPhi = prepared_event.traj_eta_phi
+                self.targetEvt_ClustersCellsCoord = prepared_event.cells_coord
+                self.targetEvt_ClustersOffsets = prepared_event.cluster_offsets
+                layered_cells = prepared_event.layered_cells
+                cell_energies = prepared_event.cell_energies
+                self.prefetcher.prefetchAround(self.targetEvt_num)
+            else:
+                self.targetEvt_TruthEndTrajXYZ = self.eventManager.getTruthEndTrajXYZforAnEvent(self.targetEvt_num)
+                self.targetEvt_TruthEndTrajEtaPhi = self.eventManager.getTruthEndTrajEtaPhiforAnEvent(self.targetEvt_num)
+                self.targetEvt_ClustersCellsCoord, self.targetEvt_ClustersOffsets = self.eventManager.getClustersCellsArrayforAnEvent(self.targetEvt_num)
+                layered_cells = None
+                cell_energies = self.eventManager.getClustersCellEnergiesforAnEvent(self.targetEvt_num) if self.eventManager.load_energies else None
+            self._updateTargetEventCells(layered_cells, cell_energies)
 
         print(f"EventController: Updated target trajectory for event {self.targetEvt_num}: ")
         for particle_idx in range(len(self.targetEvt_TruthEndTrajXYZ)):
             print(f"    Particle {particle_idx}: (Eta,Phi)=({self.targetEvt_TruthEndTrajEtaPhi[particle_idx][0]:.3f}, {self.targetEvt_TruthEndTrajEtaPhi[particle_idx][1]:.3f}); \
                   (x,y,z)=({self.targetEvt_TruthEndTrajXYZ[particle_idx][0]:.3f}, {self.targetEvt_TruthEndTrajXYZ[particle_idx][1]:.3f}, {self.targetEvt_TruthEndTrajXYZ[particle_idx][2]:.3f})")
-        for cluster_idx in range(len(self.targetEvt_ClustersCellsCoord)):
-            print(f"    Cluster {cluster_idx}: {len(self.targetEvt_ClustersCellsCoord[cluster_idx])} cell(s)")
+        for cluster_idx, n_cells in enumerate(np.diff(self.targetEvt_ClustersOffsets)):
+            print(f"    Cluster {cluster_idx}: {n_cells} cell(s)")
+        if self.targetEvt_CellEnergies is not None and len(self.targetEvt_CellEnergies) > 0:
+            print(f"    Cell energies: {self.targetEvt_CellEnergies.min():.1f} to {self.targetEvt_CellEnergies.max():.1f} MeV")
+
+    # Group the cells of the target event by layer (unless already done, e.g. by the prefetcher) and upload them,
+    # with their energies (in file order, or None) reordered the same way
+    def _updateTargetEventCells(self, layered_cells: LayeredEventCells, cell_energies=None):
+        if layered_cells is None and self.calorimeterManager is not None:
+            layered_cells = LayeredEventCells.fromEvent(self.eventManager, self.calorimeterManager, self.targetEvt_num,
+                                                        self.targetEvt_ClustersCellsCoord, self.targetEvt_ClustersOffsets)
+        self.targetEvt_LayeredCells = layered_cells
+        self._targetEvt_SpatialIndex = None
+        if layered_cells is not None:
+            self.cells_vertex_buffer.setData(layered_cells.cells_coord)
+            self.targetEvt_CellEnergies = cell_energies[layered_cells.cell_order] if cell_energies is not None else None
+        else:
+            self.cells_vertex_buffer.setData(self.targetEvt_ClustersCellsCoord)
+            self.targetEvt_CellEnergies = cell_energies
+        self._updateCellVolumes()
+        self._updateCellColors()
+        
+    # Volumes of the displayed cells, gathered from the volumes of the geometry rows of the cells
+    def _updateCellVolumes(self):
+        layered_cells = self.targetEvt_LayeredCells
+        if self.cell_volumes is None or layered_cells is None or layered_cells.cell_rows is None:
+            self.cells_volume_mesh.setInstances(np.zeros((0, 13), dtype=np.float32))
+            return
+        self.cells_volume_mesh.setInstances(self.cell_volumes.getInstances(layered_cells.cell_rows, layered_cells.cells_coord))
+        self.cells_volume_mesh.setColors(self.cells_vertex_buffer.colors)
+        
+    # Per-vertex colours of the displayed cells for the energy mode, all cells of the event mapped in one NumPy operation
+    def _updateCellColors(self):
+        self.markDirty()
+        if self.color_mode != "energy" or self.targetEvt_CellEnergies is None:
+            self.cells_vertex_buffer.setColors(None)
+            self.cells_volume_mesh.setColors(None)
+            self.targetEvt_EnergyRange = None
+            return
+        with profiler.span("event.colors"):
+            self.targetEvt_EnergyRange = ColorMap.valueRange(self.targetEvt_CellEnergies, self.energy_scale)
+            self.cells_vertex_buffer.setColors(ColorMap.get(self.colormap_name).map(self.targetEvt_CellEnergies, *self.targetEvt_EnergyRange,
+                                                                                     scale=self.energy_scale))
+            self.cells_volume_mesh.setColors(self.cells_vertex_buffer.colors)
 
     def reset(self):
         self.targetEvt_num = None
         self.targetEvt_TruthEndTrajXYZ = None
         self.targetEvt_TruthEndTrajEtaPhi = None
         self.targetEvt_ClustersCellsCoord = None
+        self.targetEvt_ClustersOffsets = None
+        self.targetEvt_LayeredCells = None
+        self._targetEvt_SpatialIndex = None
+        self.targetEvt_CellEnergies = None
+        self.targetEvt_EnergyRange = None
+        self.markDirty()
+        
+    # (Public) Return a dict describing the hit cell of a visible layer seen closest to the ray (within max_angle), or None
+    def pickHitCell(self, origin, direction, max_angle: float):
+        layered_cells = self.targetEvt_LayeredCells
+        if layered_cells is None:
+            return None
+        if self._targetEvt_SpatialIndex is None:
+            self._targetEvt_SpatialIndex = CellSpatialIndex(layered_cells.cells_coord, layered_cells.cell_layers)
+        # Cells of unknown layer (last group) are always visible
+        picked = self._targetEvt_SpatialIndex.pickRay(origin, direction, max_angle, self.layer_visibilities + [True])
+        if picked is None:
+            return None
+        
+        hit_idx = picked[0]
+        cell_index = int(layered_cells.cell_rows[hit_idx])
+        if cell_index >= 0:
+            info = self.calorimeterManager.getCellInfo(cell_index)
+        else:
+            info = {"cell_id": None, "layer": None,
+                    **self.calorimeterManager.describePosition(*(float(coord) for coord in layered_cells.cells_coord[hit_idx]))}
+        segment_idx = np.searchsorted(layered_cells.segment_first, hit_idx, side='right') - 1
+        info.update({"event": self.targetEvt_num, "cluster": layered_cells.segment_cluster[segment_idx]})
+        return info
         
     def render(self, target_stage):
         self._render_truth_trajectory()
         self._render_cluster_cells()
+        
+    def renderParts(self):
+        return [("trajectories", lambda target_stage: self._render_truth_trajectory()),
+                ("clusters", lambda target_stage: self._render_cluster_cells())]
     
     def _render_cluster_cells(self):
-        if self.targetEvt_ClustersCellsCoord is not None:
-            for cluster_idx in range(len(self.targetEvt_ClustersCellsCoord)):
+        if self.cell_volumes is not None and self.cells_volume_mesh.count > 0 and InstancedMesh.isSupported():
+            self._render_cluster_volumes()
+        elif self.targetEvt_ClustersCellsCoord is not None and self.color_mode == "energy" and self.cells_vertex_buffer.has_colors:
+            self._render_energy_colored_cells()
+        elif self.targetEvt_LayeredCells is not None:
+            self._render_layered_cluster_cells()
+        elif self.targetEvt_ClustersCellsCoord is not None:
+            # All cells of the event sit in one buffer, each cluster is one contiguous range of it
+            for cluster_idx in range(len(self.targetEvt_ClustersOffsets) - 1):
                 color = self.color_choices[cluster_idx % len(self.color_choices)]
-                glPointSize(self.point_size)
                 glColor3f(*color)
-                glBegin(GL_POINTS)
-                cell_coords = self.targetEvt_ClustersCellsCoord[cluster_idx]
-                for cell_coord in cell_coords:
-                    glVertex3f(*cell_coord)
-                glEnd()
+                first = self.targetEvt_ClustersOffsets[cluster_idx]
+                count = self.targetEvt_ClustersOffsets[cluster_idx+1] - first
+                self.cells_vertex_buffer.draw(GL_POINTS, int(first), int(count))
+            
+    def _render_layered_cluster_cells(self):
+        # One draw per (visible layer, cluster) segment: the cost depends on the visible layers, not on the number of cells
+        layered_cells = self.targetEvt_LayeredCells
+        for layer_idx in range(layered_cells.n_layers + 1):
+            # Last group: cells of unknown layer, always shown
+            if layer_idx < layered_cells.n_layers and not self.layer_visibilities[layer_idx]:
+                continue
+            for segment_idx in range(layered_cells.layer_segment_offsets[layer_idx], layered_cells.layer_segment_offsets[layer_idx+1]):
+                glColor3f(*self.color_choices[layered_cells.segment_cluster[segment_idx] % len(self.color_choices)])
+                self.cells_vertex_buffer.draw(GL_POINTS, layered_cells.segment_first[segment_idx], layered_cells.segment_count[segment_idx])
+            
+    def _render_cluster_volumes(self):
+        # Same segments as the points (one draw per visible layer and cluster, or per visible layer with the
+        # energy colours), each drawing the volumes of its cells in one instanced call
+        layered_cells = self.targetEvt_LayeredCells
+        use_colors = self.color_mode == "energy" and self.cells_volume_mesh.has_colors
+        for layer_idx in range(layered_cells.n_layers + 1):
+            # Last group: cells of unknown layer, always shown
+            if layer_idx < layered_cells.n_layers and not self.layer_visibilities[layer_idx]:
+                continue
+            if use_colors:
+                first = layered_cells.layer_cell_offsets[layer_idx]
+                self.cells_volume_mesh.draw(filled=True, first=first, count=layered_cells.layer_cell_offsets[layer_idx+1] - first, use_colors=True)
+                continue
+            for segment_idx in range(layered_cells.layer_segment_offsets[layer_idx], layered_cells.layer_segment_offsets[layer_idx+1]):
+                self.cells_volume_mesh.draw(filled=True, first=layered_cells.segment_first[segment_idx], count=layered_cells.segment_count[segment_idx],
+                                            color=self.color_choices[layered_cells.segment_cluster[segment_idx] % len(self.color_choices)])
+            
+    def _render_energy_colored_cells(self):
+        # Per-vertex colours: one draw per run of consecutive visible layers (a single draw when all layers are shown)
+        layered_cells = self.targetEvt_LayeredCells
+        if layered_cells is None:
+            self.cells_vertex_buffer.draw(GL_POINTS, use_colors=True)
+            return
+        run_first = None
+        for layer_idx in range(layered_cells.n_layers + 1):
+            # Last group: cells of unknown layer, always shown
+            visible = layer_idx == layered_cells.n_layers or self.layer_visibilities[layer_idx]
+            if visible and run_first is None:
+                run_first = layered_cells.layer_cell_offsets[layer_idx]
+            elif not visible and run_first is not None:
+                self.cells_vertex_buffer.draw(GL_POINTS, run_first, layered_cells.layer_cell_offsets[layer_idx] - run_first, use_colors=True)
+                run_first = None
+        if run_first is not None:
+            self.cells_vertex_buffer.draw(GL_POINTS, run_first, layered_cells.layer_cell_offsets[-1] - run_first, use_colors=True)
             
     def _render_truth_trajectory(self):
-        # self.targetEvt_TruthEndTrajXYZ is now a list of (x,y,z) tuples, or None
+        # self.targetEvt_TruthEndTrajXYZ is a (n_particles, 3) array of (x,y,z), or None
         if self.targetEvt_TruthEndTrajXYZ is not None:
             for particle_traj_coords in self.targetEvt_TruthEndTrajXYZ:
                 try:
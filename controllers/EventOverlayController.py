@@ -0,0 +1,189 @@
+from OpenGL.GL import *
+import numpy as np
+
+from database import config as cfg
+from useCaseClasses.EventManager import EventManager
+from controllers.Renderable import Renderable, DrawState
+from controllers.VertexBuffer import VertexBuffer
+from instrumentation.Profiler import profiler
+
+
+class EventOverlayController(Renderable):
+    """
+    Hit cells and truth trajectories of many events drawn on top of each other.
+
+    The cells of all overlaid events are concatenated, event after event, into one vertex buffer with per-vertex
+    colours (colour of the cluster, or one colour per event), and the truth trajectories into one buffer of line
+    segments: drawing costs two draw calls, whatever the number of events. Adding events appends them at the end
+    of the buffers; removing events only rewrites the buffers from the first removed event on (VertexBuffer.replaceFrom).
+    When some layers are hidden, the cells of the visible layers are drawn through an index buffer (one call too),
+    rebuilt only when the visibilities or the events change.
+    """
+    def __init__(self, eventManager: EventManager):
+        self.eventManager = eventManager
+        self.calorimeterManager = None
+        self.event_numbers = []                 # Overlaid events, in the order of their cells in the buffers
+        self._event_cell_counts = []            # Number of cells of each overlaid event
+        self._event_line_counts = []            # Number of line vertices (2 per particle) of each overlaid event
+        self._cell_layers = np.zeros(0, dtype=np.int16)     # (N,) layer of each cell, n_layers when unknown
+        self._cell_clusters = np.zeros(0, dtype=np.int32)   # (N,) cluster of each cell in its event, to recolour without reading the events
+        self.point_size = 6.0
+        self.line_color = (0.0, 0.0, 0.0)
+        self.color_choices = cfg.clusters_color_choices
+        self.color_mode = "cluster"             # "cluster" (colour of the cluster in its event) or "event" (one colour per event)
+        self.cells_vertex_buffer = VertexBuffer()
+        self.lines_vertex_buffer = VertexBuffer()
+        self.layer_visibilities = [True] * len(cfg.sub_detector_namelist)
+        self._indices_dirty = False
+
+    @property
+    def draw_state(self):
+        return DrawState(point_size=self.point_size, line_width=1.0)
+
+    @property
+    def n_cells(self) -> int:
+        return self.cells_vertex_buffer.count
+
+    # (Public) Give the geometry used to tag the overlaid cells with their layer (for the layer visibilities)
+    def setCalorimeterManager(self, calorimeterManager):
+        self.calorimeterManager = calorimeterManager
+        if self.n_cells > 0:
+            self._cell_layers = self._layersOfCoords(self.cells_vertex_buffer.vertices)
+            self._indices_dirty = True
+
+    # (Public) Show/hide the overlaid cells of a sampling layer
+    def setLayerVisibility(self, samp_name: str, visible: bool):
+        self.layer_visibilities[cfg.sub_detector_namelist.index(samp_name)] = visible
+        self._indices_dirty = True
+
+    # (Public) Colour the overlaid cells by "cluster" or by "event", recolours all overlaid cells
+    def setColorMode(self, mode: str):
+        if mode not in ("cluster", "event"):
+            raise ValueError(f"Unknown overlay colour mode {mode} (cluster or event)")
+        self.color_mode = mode
+        if self.n_cells > 0:
+            self.cells_vertex_buffer.setColors(self._cellColors(self.event_numbers, self._event_cell_counts, self._cell_clusters))
+
+    # (Public) Overlay exactly these events: the ones not overlaid yet are appended, the others removed
+    def setEvents(self, event_numbers):
+        wanted = set(event_numbers)
+        self.removeEvents([evtnum for evtnum in self.event_numbers if evtnum not in wanted])
+        self.addEvents(event_numbers)
+
+    # (Public) Append events to the overlay (events already overlaid are skipped)
+    def addEvents(self, event_numbers):
+        overlaid = set(self.event_numbers)
+        new_events = [evtnum for evtnum in dict.fromkeys(event_numbers) if evtnum not in overlaid]
+        if not new_events:
+            return
+        with profiler.span("overlay.add"):
+            cells, clusters, layers, lines = [], [], [], []
+            for evtnum in new_events:
+                cells_coord, cluster_offsets = self.eventManager.getClustersCellsArrayforAnEvent(evtnum)
+                cells.append(cells_coord)
+                clusters.append(np.repeat(np.arange(len(cluster_offsets) - 1, dtype=np.int32), np.diff(cluster_offsets)))
+                layers.append(self._eventCellLayers(evtnum, cells_coord))
+                lines.append(self._eventTrajectoryLines(evtnum))
+            new_cell_counts = [len(event_cells) for event_cells in cells]
+            new_clusters = np.concatenate(clusters)
+            self.event_numbers.extend(new_events)
+            self._event_cell_counts.extend(new_cell_counts)
+            self._event_line_counts.extend(len(event_lines) for event_lines in lines)
+            self.cells_vertex_buffer.replaceFrom(self.n_cells, np.concatenate(cells), self._cellColors(new_events, new_cell_counts, new_clusters))
+            self.lines_vertex_buffer.replaceFrom(self.lines_vertex_buffer.count, np.concatenate(lines))
+            self._cell_layers = np.concatenate([self._cell_layers] + layers)
+            self._cell_clusters = np.concatenate([self._cell_clusters, new_clusters])
+            self._indices_dirty = True
+
+    # (Public) Remove events from the overlay: the buffers are rewritten from the first removed event on
+    def removeEvents(self, event_numbers):
+        removed = set(event_numbers)
+        positions = [pos for pos, evtnum in enumerate(self.event_numbers) if evtnum in removed]
+        if not positions:
+            return
+        with profiler.span("overlay.remove"):
+            first_pos = positions[0]
+            kept_events = [pos for pos in range(first_pos, len(self.event_numbers)) if self.event_numbers[pos] not in removed]
+            self.cells_vertex_buffer.replaceFrom(*self._keptTail(self.cells_vertex_buffer, self._event_cell_counts, first_pos, kept_events))
+            self.lines_vertex_buffer.replaceFrom(*self._keptTail(self.lines_vertex_buffer, self._event_line_counts, first_pos, kept_events)[:2])
+
+            kept_cells = self._keptMask(self._event_cell_counts, first_pos, kept_events)
+            first_cell = sum(self._event_cell_counts[:first_pos])
+            self._cell_layers = np.concatenate([self._cell_layers[:first_cell], self._cell_layers[first_cell:][kept_cells]])
+            self._cell_clusters = np.concatenate([self._cell_clusters[:first_cell], self._cell_clusters[first_cell:][kept_cells]])
+            self.event_numbers = self.event_numbers[:first_pos] + [self.event_numbers[pos] for pos in kept_events]
+            self._event_cell_counts = self._event_cell_counts[:first_pos] + [self._event_cell_counts[pos] for pos in kept_events]
+            self._event_line_counts = self._event_line_counts[:first_pos] + [self._event_line_counts[pos] for pos in kept_events]
+            self._indices_dirty = True
+
+    # (Public) Remove all events from the overlay
+    def clear(self):
+        self.removeEvents(list(self.event_numbers))
+
+    @staticmethod
+    def _keptMask(counts: list[int], first_pos: int, kept_events: list[int]) -> np.ndarray:
+        # Mask over the items of the events from first_pos on, True for the items of the kept events
+        tail_counts = np.asarray(counts[first_pos:], dtype=np.int64)
+        kept = np.zeros(len(tail_counts), dtype=bool)
+        kept[np.asarray(kept_events, dtype=np.int64) - first_pos] = True
+        return np.repeat(kept, tail_counts)
+
+    def _keptTail(self, vertex_buffer: VertexBuffer, counts: list[int], first_pos: int, kept_events: list[int]):
+        # (first item, items of the kept events after it, their colours) for VertexBuffer.replaceFrom
+        first = sum(counts[:first_pos])
+        kept = self._keptMask(counts, first_pos, kept_events)
+        colors = vertex_buffer.colors[first:][kept] if vertex_buffer.has_colors else None
+        return first, vertex_buffer.vertices[first:][kept], colors
+
+    def _cellColors(self, event_numbers, event_cell_counts, cell_clusters) -> np.ndarray:
+        # Colours of the cells of these events, from the number of cells of each event and the cluster of each cell
+        choices = np.asarray(self.color_choices, dtype=np.float32)
+        if self.color_mode == "event":
+            return np.repeat(choices[np.asarray(event_numbers, dtype=np.int64) % len(choices)], event_cell_counts, axis=0)
+        return choices[cell_clusters % len(choices)]
+
+    def _eventCellLayers(self, evtnum: int, cells_coord) -> np.ndarray:
+        if self.calorimeterManager is None:
+            return np.full(len(cells_coord), len(cfg.sub_detector_namelist), dtype=np.int16)
+        if self.eventManager.cell_id_mode:
+            cell_indices, _ = self.eventManager.getClustersCellIndicesforAnEvent(evtnum)
+            return self._layersOfRows(cell_indices)
+        return self._layersOfCoords(cells_coord)
+
+    def _layersOfCoords(self, cells_coord) -> np.ndarray:
+        return self._layersOfRows(self.calorimeterManager.findCellIndicesByCoord(cells_coord))
+
+    def _layersOfRows(self, cell_indices) -> np.ndarray:
+        # Cells of unknown layer (-1) get n_layers, they are always drawn
+        layers = self.calorimeterManager.getCellLayers(cell_indices)
+        return np.where(layers < 0, len(self.calorimeterManager.layer_namelist), layers).astype(np.int16)
+
+    def _eventTrajectoryLines(self, evtnum: int) -> np.ndarray:
+        # One segment from the origin to the end point of each truth particle with finite coordinates
+        traj_xyz = np.asarray(self.eventManager.getTruthEndTrajXYZforAnEvent(evtnum), dtype=np.float32).reshape(-1, 3)
+        traj_xyz = traj_xyz[np.isfinite(traj_xyz).all(axis=1)]
+        lines = np.zeros((2 * len(traj_xyz), 3), dtype=np.float32)
+        lines[1::2] = traj_xyz
+        return lines
+
+    def _updateIndices(self):
+        # Index buffer of the cells of the visible layers, None when all of them are visible
+        visible = np.array(self.layer_visibilities + [True])
+        if visible.all():
+            self.cells_vertex_buffer.setIndices(None)
+        else:
+            self.cells_vertex_buffer.setIndices(np.flatnonzero(visible[self._cell_layers]))
+        self._indices_dirty = False
+
+    def render(self, target_stage):
+        if self.lines_vertex_buffer.count > 0:
+            glColor3f(*self.line_color)
+            self.lines_vertex_buffer.draw(GL_LINES)
+        if self.n_cells == 0:
+            return
+        if self._indices_dirty:
+            self._updateIndices()
+        if self.cells_vertex_buffer.has_indices:
+            self.cells_vertex_buffer.drawIndexed(GL_POINTS, use_colors=True)
+        else:
+            self.cells_vertex_buffer.draw(GL_POINTS, use_colors=True)
@@ -0,0 +1,236 @@
+import ctypes
+from OpenGL.GL import *
+import numpy as np
+
+
+class InstancedMesh:
+    """
+    GPU instancing of a unit cube, placed once per instance by the rows of an (N, 13) float32 array (see
+    useCaseClasses/CellVolumes.py): one draw call draws any number of cell volumes, filled (shaded faces) or as
+    outlines (edges), with one colour for all of them or one per instance.
+
+    Like VertexBuffer, the instances (and optional (N, 3) colours) are kept on the CPU side until the first draw,
+    then uploaded once to buffer objects. The unit cube meshes and the shader placing them are shared by all
+    meshes and made on the first draw. Needs GLSL shaders and instanced arrays (OpenGL 3.3, or ARB_instanced_arrays
+    with ARB_draw_instanced): check isSupported() before drawing, with the GL context current.
+    """
+    # Generic attribute locations of the shader
+    _position_location, _normal_location, _instance_location, _color_location = 0, 1, 2, 6
+
+    _vertex_shader = """
+        #version 120
+        attribute vec3 position;        // Corner of the unit cube [-0.5, 0.5]^3
+        attribute vec3 normal;          // Face normal of the unit cube
+        attribute vec4 centre_taper;
+        attribute vec3 axis_u;
+        attribute vec3 axis_v;
+        attribute vec3 axis_w;
+        attribute vec3 instance_color;
+        uniform vec3 color;
+        uniform bool use_instance_colors;
+        uniform bool shaded;
+        varying vec3 frag_color;
+        void main() {
+            float widening = 1.0 + centre_taper.w * position.z;
+            vec3 world = centre_taper.xyz + (axis_u * position.x + axis_v * position.y) * widening + axis_w * position.z;
+            gl_Position = gl_ModelViewProjectionMatrix * vec4(world, 1.0);
+            frag_color = use_instance_colors ? instance_color : color;
+            if (shaded) {
+                // The axes are orthogonal: the normal transform (inverse transpose) divides each axis by its squared length
+                vec3 world_normal = axis_u * (normal.x / dot(axis_u, axis_u)) + axis_v * (normal.y / dot(axis_v, axis_v))
+                                  + axis_w * (normal.z / dot(axis_w, axis_w));
+                vec3 eye_normal = normalize(gl_NormalMatrix * world_normal);
+                frag_color *= 0.45 + 0.55 * abs(eye_normal.z);
+            }
+        }
+    """
+    _fragment_shader = """
+        #version 120
+        varying vec3 frag_color;
+        void main() {
+            gl_FragColor = vec4(frag_color, 1.0);
+        }
+    """
+
+    _supported = None
+    _shared = None                      # Program, uniform locations and cube meshes, made on the first draw
+
+    def __init__(self, instances=None):
+        self._instances = None
+        self._instance_vbo = None
+        self._needs_upload = False
+        self._colors = None
+        self._color_vbo = None
+        self._colors_need_upload = False
+        self.count = 0
+        if instances is not None:
+            self.setInstances(instances)
+
+    # (Public) Whether the GL context can draw instanced meshes (checked once, with the context current)
+    @staticmethod
+    def isSupported() -> bool:
+        if InstancedMesh._supported is None:
+            InstancedMesh._supported = bool(glDrawArraysInstanced) and bool(glVertexAttribDivisor) and bool(glCreateShader)
+            if not InstancedMesh._supported:
+                print("InstancedMesh: instanced drawing is not available with this OpenGL context, cells are drawn as points")
+        return InstancedMesh._supported
+
+    def setInstances(self, instances):
+        """
+        Replace the instances ((N, 13), see CellVolumes), the upload to the GPU happens on the next draw
+        """
+        self._instances = np.ascontiguousarray(instances, dtype=np.float32).reshape(-1, 13)
+        self.count = len(self._instances)
+        self._needs_upload = True
+        if self._colors is not None and len(self._colors) != self.count:
+            self.setColors(None)
+
+    def setColors(self, colors):
+        """
+        Replace the per-instance colours ((N, 3), or None), the upload to the GPU happens on the next draw
+        """
+        self._colors = np.ascontiguousarray(colors, dtype=np.float32).reshape(-1, 3) if colors is not None else None
+        self._colors_need_upload = self._colors is not None
+
+    @property
+    def instances(self) -> np.ndarray:
+        return self._instances
+
+    @property
+    def has_colors(self) -> bool:
+        return self._colors is not None and len(self._colors) == self.count
+
+    def draw(self, filled=True, first=0, count=None, color=(0, 0, 0), use_colors=False):
+        """
+        Draw `count` instances starting from `first` (default: all of them) in one call, as shaded faces (filled) or
+        as edges, with the per-instance colours if use_colors (otherwise `color`)
+        """
+        if count is None:
+            count = self.count - first
+        if count <= 0:
+            return
+        shared = self._getShared()
+        if self._needs_upload:
+            self._instance_vbo = self._uploadArray(self._instance_vbo, self._instances)
+            self._needs_upload = False
+        use_colors = use_colors and self.has_colors
+        if use_colors and self._colors_need_upload:
+            self._color_vbo = self._uploadArray(self._color_vbo, self._colors)
+            self._colors_need_upload = False
+
+        glUseProgram(shared["program"])
+        glUniform3f(shared["color"], *color)
+        glUniform1i(shared["use_instance_colors"], int(use_colors))
+        glUniform1i(shared["shaded"], int(filled))
+
+        mesh_vbo, n_vertices = shared["faces"] if filled else shared["edges"]
+        glBindBuffer(GL_ARRAY_BUFFER, mesh_vbo)
+        self._setAttribute(self._position_location, 3, 24, 0, divisor=0)
+        self._setAttribute(self._normal_location, 3, 24, 12, divisor=0)
+        # Instance attributes start at instance `first` (no base instance in OpenGL 3.3)
+        glBindBuffer(GL_ARRAY_BUFFER, self._instance_vbo)
+        stride = self._instances.strides[0]
+        for idx, (size, offset) in enumerate(((4, 0), (3, 16), (3, 28), (3, 40))):
+            self._setAttribute(self._instance_location + idx, size, stride, first * stride + offset, divisor=1)
+        if use_colors:
+            glBindBuffer(GL_ARRAY_BUFFER, self._color_vbo)
+            self._setAttribute(self._color_location, 3, 12, first * 12, divisor=1)
+
+        glDrawArraysInstanced(GL_TRIANGLES if filled else GL_LINES, 0, n_vertices, count)
+
+        for location in range(self._color_location + 1 if use_colors else self._color_location):
+            glVertexAttribDivisor(location, 0)
+            glDisableVertexAttribArray(location)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glUseProgram(0)
+
+    def release(self):
+        """
+        Free the GPU buffers (must be called with the GL context current)
+        """
+        for vbo in (self._instance_vbo, self._color_vbo):
+            if vbo is not None:
+                glDeleteBuffers(1, [vbo])
+        self._instance_vbo = self._color_vbo = None
+        self._needs_upload = self._instances is not None
+        self._colors_need_upload = self._colors is not None
+
+    @staticmethod
+    def _setAttribute(location: int, size: int, stride: int, offset: int, divisor: int):
+        glEnableVertexAttribArray(location)
+        glVertexAttribPointer(location, size, GL_FLOAT, GL_FALSE, stride, ctypes.c_void_p(offset))
+        glVertexAttribDivisor(location, divisor)
+
+    @staticmethod
+    def _uploadArray(vbo, array: np.ndarray):
+        if vbo is None:
+            vbo = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        glBufferData(GL_ARRAY_BUFFER, array.nbytes, array, GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        return vbo
+
+    @classmethod
+    def _getShared(cls) -> dict:
+        if cls._shared is None:
+            program = cls._compileProgram()
+            faces, edges = cls._unitCubeMeshes()
+            cls._shared = {"program": program,
+                           "color": glGetUniformLocation(program, "color"),
+                           "use_instance_colors": glGetUniformLocation(program, "use_instance_colors"),
+                           "shaded": glGetUniformLocation(program, "shaded"),
+                           "faces": (cls._uploadArray(None, faces), len(faces)),
+                           "edges": (cls._uploadArray(None, edges), len(edges))}
+        return cls._shared
+
+    @classmethod
+    def _compileProgram(cls):
+        program = glCreateProgram()
+        shaders = []
+        for shader_type, source in ((GL_VERTEX_SHADER, cls._vertex_shader), (GL_FRAGMENT_SHADER, cls._fragment_shader)):
+            shader = glCreateShader(shader_type)
+            glShaderSource(shader, source)
+            glCompileShader(shader)
+            if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+                raise RuntimeError(f"InstancedMesh: shader compilation failed: {glGetShaderInfoLog(shader).decode(errors='replace')}")
+            glAttachShader(program, shader)
+            shaders.append(shader)
+        # Position on location 0 (aliased with the fixed-function vertex in compatibility contexts)
+        for location, name in ((cls._position_location, "position"), (cls._normal_location, "normal"),
+                               (cls._instance_location, "centre_taper"), (cls._instance_location + 1, "axis_u"),
+                               (cls._instance_location + 2, "axis_v"), (cls._instance_location + 3, "axis_w"),
+                               (cls._color_location, "instance_color")):
+            glBindAttribLocation(program, location, name)
+        glLinkProgram(program)
+        for shader in shaders:
+            glDeleteShader(shader)
+        if not glGetProgramiv(program, GL_LINK_STATUS):
+            raise RuntimeError(f"InstancedMesh: shader link failed: {glGetProgramInfoLog(program).decode(errors='replace')}")
+        return program
+
+    @staticmethod
+    def _unitCubeMeshes():
+        # (position, normal) rows: two counter-clockwise triangles per face for the faces, 12 edges for the outlines
+        corners = np.array([[x, y, z] for x in (-0.5, 0.5) for y in (-0.5, 0.5) for z in (-0.5, 0.5)], dtype=np.float32)
+        faces = []
+        for axis in range(3):
+            for sign in (-1.0, 1.0):
+                normal = np.zeros(3, dtype=np.float32)
+                normal[axis] = sign
+                # Two other axes, ordered so that (a, b, normal) is right-handed
+                a, b = (axis + 1) % 3, (axis + 2) % 3
+                if sign < 0:
+                    a, b = b, a
+                quad = []
+                for da, db in ((-0.5, -0.5), (0.5, -0.5), (0.5, 0.5), (-0.5, 0.5)):
+                    corner = np.zeros(3, dtype=np.float32)
+                    corner[axis], corner[a], corner[b] = 0.5 * sign, da, db
+                    quad.append(corner)
+                for corner_idx in (0, 1, 2, 0, 2, 3):
+                    faces.append(np.concatenate([quad[corner_idx], normal]))
+        edges = []
+        for i in range(len(corners)):
+            for j in range(i + 1, len(corners)):
+                if np.count_nonzero(corners[i] != corners[j]) == 1:
+                    edges += [np.concatenate([corners[i], np.zeros(3)]), np.concatenate([corners[j], np.zeros(3)])]
+        return np.array(faces, dtype=np.float32), np.array(edges, dtype=np.float32)
@@ -1,24 +1,59 @@
 from abc import ABC, abstractclassmethod
+from typing import NamedTuple
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from PySide6.QtGui import QPainter, QFont
 from PySide6.QtCore import Qt
 
+
+# GL state shared by the renderables drawn together (see Scene): None leaves a value as it is
+class DrawState(NamedTuple):
+    point_size: float = None
+    line_width: float = None
+
+
 # ==== Renderable Interface ====
 class Renderable(ABC):
+    # Renderables with a DrawState do not set its values themselves: the Scene groups them by draw state and sets it
+    # once per group. None: render sets any GL state it needs (and the Scene assumes nothing about it afterwards).
+    draw_state = None
+    # Cacheable renderables are recorded once in a display list by the Scene and replayed until their render key
+    # changes (e.g. markDirty after a change of what they draw). Only for small amounts of data: the vertex arrays
+    # drawn are copied into the list.
+    cacheable = False
+    revision = 0
+    
     @abstractclassmethod
     def render(self, target_stage):
         pass
     
+    # (Public) Tell the Scene that what render draws changed
+    def markDirty(self):
+        self.revision += 1
+    
+    # Value that changes whenever the recorded commands of a cacheable renderable would, for a stage
+    def renderKey(self, target_stage):
+        return self.revision
+    
+    # [(part name, render function of the part)] doing render in parts timed separately by the Scene
+    # (see Scene.collect_timings), e.g. the hit cells and the trajectories of an event; None: render is not split
+    def renderParts(self):
+        return [(None, self.render)]
+    
     
 class Cell(Renderable):
+    cacheable = True
+    
     def __init__(self, coords, size=1.0, color=(0,0,0)):
         self.x, self.y, self.z = coords
         self.size = size
         self.color = color
         
+    @property
+    def draw_state(self):
+        return DrawState(point_size=self.size)
+        
     def render(self, target_stage):
-        glPointSize(self.size)
         glColor3f(*self.color)
         glBegin(GL_POINTS)
         glVertex(self.x, self.y, self.z)
@@ -0,0 +1,209 @@
+from OpenGL.GL import *
+import numpy as np
+
+
+class VertexBuffer:
+    """
+    Retained-mode GPU storage for a contiguous (N, 3) float32 vertex array.
+
+    The data is kept on the CPU side until the first draw call, since the buffer
+    object can only be created once the OpenGL context of the stage is current
+    (i.e. inside paintGL). After that, drawing costs a single glDrawArrays call,
+    no matter how many vertices the buffer holds.
+
+    Optional per-vertex (N, 3) float32 colours are kept in a second buffer object, so that they can be
+    replaced (e.g. another colour map) without uploading the vertices again.
+
+    A buffer can also grow and shrink from its end (replaceFrom, e.g. events added to or removed from an overlay):
+    the CPU and GPU storage then keep spare capacity (doubled when full) and only the vertices that changed
+    are uploaded, with glBufferSubData. An optional index buffer (setIndices) draws a subset of the vertices
+    in one glDrawElements call.
+    """
+    def __init__(self, vertices=None):
+        self._vbo = None
+        self._vertices = None
+        self._vertex_storage = None         # (capacity, 3), self._vertices is a view of its first `count` rows
+        self._upload_first = 0              # First vertex not uploaded yet (see replaceFrom)
+        self._needs_upload = False
+        self._color_vbo = None
+        self._colors = None
+        self._color_storage = None
+        self._colors_upload_first = 0
+        self._colors_need_upload = False
+        self._index_vbo = None
+        self._indices = None
+        self._indices_need_upload = False
+        self.count = 0
+        if vertices is not None:
+            self.setData(vertices)
+        
+    def setData(self, vertices):
+        """
+        Replace the vertex data, the upload to the GPU happens on the next draw
+        """
+        self._vertices = np.ascontiguousarray(vertices, dtype=np.float32).reshape(-1, 3)
+        self._vertex_storage = self._vertices
+        self.count = len(self._vertices)
+        self._upload_first = 0
+        self._needs_upload = True
+        
+    def setColors(self, colors):
+        """
+        Replace the per-vertex colours ((N, 3), one per vertex, or None), the upload to the GPU happens on the next draw
+        """
+        self._colors = np.ascontiguousarray(colors, dtype=np.float32).reshape(-1, 3) if colors is not None else None
+        self._color_storage = self._colors
+        self._colors_upload_first = 0
+        self._colors_need_upload = self._colors is not None
+        
+    def replaceFrom(self, first: int, vertices, colors=None):
+        """
+        Keep the first `first` vertices and replace all the following ones by `vertices` (first=count to append), with
+        their (n, 3) colours (None: no per-vertex colours any more); only the new vertices are uploaded on the next draw
+        """
+        vertices = np.asarray(vertices, dtype=np.float32).reshape(-1, 3)
+        first = min(first, self.count)
+        count = first + len(vertices)
+        with_colors = colors is not None
+        if self._vertex_storage is None or count > len(self._vertex_storage):
+            capacity = max(count, 2 * (len(self._vertex_storage) if self._vertex_storage is not None else 0), 1024)
+            self._vertex_storage = self._grow(self._vertex_storage, first, capacity)
+            self._color_storage = self._grow(self._color_storage, first, capacity) if with_colors else None
+        elif with_colors and (self._color_storage is None or len(self._color_storage) < len(self._vertex_storage)):
+            # Colours given for the first time: the colours of the kept vertices are unknown, replaced by black
+            self._color_storage = self._grow(self._color_storage if self.has_colors else None, first, len(self._vertex_storage))
+        self._vertex_storage[first:count] = vertices
+        self._vertices = self._vertex_storage[:count]
+        if with_colors:
+            self._color_storage[first:count] = np.asarray(colors, dtype=np.float32).reshape(-1, 3)
+            self._colors = self._color_storage[:count]
+        else:
+            self._color_storage = self._colors = None
+        self.count = count
+        self._upload_first = min(self._upload_first, first) if self._needs_upload else first
+        self._colors_upload_first = min(self._colors_upload_first, first) if self._colors_need_upload else first
+        self._needs_upload = True
+        self._colors_need_upload = with_colors
+        
+    @staticmethod
+    def _grow(storage, n_kept: int, capacity: int) -> np.ndarray:
+        grown = np.zeros((capacity, 3), dtype=np.float32)
+        if storage is not None:
+            grown[:n_kept] = storage[:n_kept]
+        return grown
+        
+    def setIndices(self, indices):
+        """
+        Set the vertices drawn by drawIndexed (array of vertex indices, or None)
+        """
+        self._indices = np.ascontiguousarray(indices, dtype=np.uint32) if indices is not None else None
+        self._indices_need_upload = self._indices is not None
+        
+    @property
+    def vertices(self) -> np.ndarray:
+        return self._vertices
+        
+    @property
+    def colors(self) -> np.ndarray:
+        return self._colors
+        
+    @property
+    def has_indices(self) -> bool:
+        return self._indices is not None
+        
+    @property
+    def has_colors(self) -> bool:
+        return self._colors is not None and len(self._colors) == self.count
+        
+    def draw(self, mode=GL_POINTS, first=0, count=None, use_colors=False):
+        """
+        Draw `count` vertices starting from `first` (default: the whole buffer) in one call,
+        with the per-vertex colours if use_colors (otherwise with the current glColor)
+        """
+        if count is None:
+            count = self.count - first
+        if count <= 0:
+            return
+        use_colors = self._bind(use_colors)
+        glDrawArrays(mode, first, count)
+        self._unbind(use_colors)
+        
+    def drawIndexed(self, mode=GL_POINTS, use_colors=False):
+        """
+        Draw the vertices of the index buffer (see setIndices) in one call
+        """
+        if self._indices is None or len(self._indices) == 0 or self.count == 0:
+            return
+        use_colors = self._bind(use_colors)
+        if self._index_vbo is None:
+            self._index_vbo = glGenBuffers(1)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self._index_vbo)
+        if self._indices_need_upload:
+            glBufferData(GL_ELEMENT_ARRAY_BUFFER, self._indices.nbytes, self._indices, GL_DYNAMIC_DRAW)
+            self._indices_need_upload = False
+        glDrawElements(mode, len(self._indices), GL_UNSIGNED_INT, None)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        self._unbind(use_colors)
+        
+    def _bind(self, use_colors: bool) -> bool:
+        # Upload what changed and set the vertex (and colour) arrays, return whether the colours are used
+        if self._needs_upload:
+            self._upload()
+        use_colors = use_colors and self.has_colors
+        if use_colors:
+            if self._colors_need_upload:
+                self._uploadColors()
+            glBindBuffer(GL_ARRAY_BUFFER, self._color_vbo)
+            glEnableClientState(GL_COLOR_ARRAY)
+            glColorPointer(3, GL_FLOAT, 0, None)
+            
+        glBindBuffer(GL_ARRAY_BUFFER, self._vbo)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glVertexPointer(3, GL_FLOAT, 0, None)
+        return use_colors
+        
+    def _unbind(self, use_colors: bool):
+        glDisableClientState(GL_VERTEX_ARRAY)
+        if use_colors:
+            glDisableClientState(GL_COLOR_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        
+    def release(self):
+        """
+        Free the GPU buffer (must be called with the GL context current)
+        """
+        if self._vbo is not None:
+            glDeleteBuffers(1, [self._vbo])
+            self._vbo = None
+        if self._color_vbo is not None:
+            glDeleteBuffers(1, [self._color_vbo])
+            self._color_vbo = None
+        if self._index_vbo is not None:
+            glDeleteBuffers(1, [self._index_vbo])
+            self._index_vbo = None
+        self._upload_first = self._colors_upload_first = 0
+        self._needs_upload = self._vertices is not None
+        self._colors_need_upload = self._colors is not None
+        self._indices_need_upload = self._indices is not None
+        
+    def _upload(self):
+        if self._vbo is None:
+            self._vbo = glGenBuffers(1)
+        self._uploadStorage(self._vbo, self._vertex_storage, self._upload_first)
+        self._needs_upload = False
+        
+    def _uploadColors(self):
+        if self._color_vbo is None:
+            self._color_vbo = glGenBuffers(1)
+        self._uploadStorage(self._color_vbo, self._color_storage, self._colors_upload_first)
+        self._colors_need_upload = False
+        
+    def _uploadStorage(self, vbo, storage, first: int):
+        # Whole storage when the GPU buffer has another size (or is new), otherwise only the rows from `first` on
+        glBindBuffer(GL_ARRAY_BUFFER, vbo)
+        if glGetBufferParameteriv(GL_ARRAY_BUFFER, GL_BUFFER_SIZE) != storage.nbytes or first == 0:
+            usage = GL_STATIC_DRAW if storage is self._vertices or storage is self._colors else GL_DYNAMIC_DRAW
+            glBufferData(GL_ARRAY_BUFFER, storage.nbytes, storage, usage)
+        elif first < self.count:
+            glBufferSubData(GL_ARRAY_BUFFER, first * 12, (self.count - first) * 12, storage[first:self.count])
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
@@ -0,0 +1,121 @@
+"""
+Convert event ROOT files (e.g. the .mltree.root samples) to Arrow IPC or Parquet files, which EventManager
+opens directly (see useCaseClasses/ArrowEventSource.py) without going through uproot.
+
+Run from the repository root, e.g.:
+    python convert_events.py database/pi0.mltree.root                       (writes database/pi0.mltree.arrow)
+    python convert_events.py "database/pi0_*.root" -o converted -f parquet
+
+The cell coordinates are written in metres as one (N, 3) float32 block per record batch, the cell IDs and
+energies too when the ROOT file has them. Arrow IPC files are written uncompressed, so that they can be
+memory-mapped and read without any copy; Parquet files are smaller but decoded on read. Needs pyarrow.
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc
+import pyarrow.parquet as pq
+import uproot
+
+from useCaseClasses.EventSource import EventSource, EventColumns
+from useCaseClasses.ROOTEventSource import ROOTEventSource
+
+
+def _nestedListArray(event_cluster_offsets, cluster_cell_offsets, values):
+    # list<list<values>> per event and cluster from the CSR offsets
+    clusters = pa.ListArray.from_arrays(pa.array(cluster_cell_offsets.astype(np.int32)), values)
+    return pa.ListArray.from_arrays(pa.array(event_cluster_offsets.astype(np.int32)), clusters)
+
+
+def _makeRecordBatch(columns: EventColumns, id_columns: EventColumns, branch_prefix: str) -> pa.RecordBatch:
+    particle_offsets = pa.array(columns.event_particle_offsets.astype(np.int32))
+    arrays = {"eventNumber": pa.array(np.asarray(columns.event_numbers, dtype=np.int64)),
+              "truthPartEta": pa.ListArray.from_arrays(particle_offsets, pa.array(np.asarray(columns.truth_eta, dtype=np.float32))),
+              "truthPartPhi": pa.ListArray.from_arrays(particle_offsets, pa.array(np.asarray(columns.truth_phi, dtype=np.float32)))}
+    cells_xyz = pa.FixedSizeListArray.from_arrays(pa.array(np.asarray(columns.cells_coord, dtype=np.float32).reshape(-1)), 3)
+    arrays[f"{branch_prefix}_XYZ"] = _nestedListArray(columns.event_cluster_offsets, columns.cluster_cell_offsets, cells_xyz)
+    if id_columns is not None:
+        arrays[f"{branch_prefix}_ID"] = _nestedListArray(id_columns.event_cluster_offsets, id_columns.cluster_cell_offsets,
+                                                         pa.array(np.asarray(id_columns.cell_ids, dtype=np.uint64)))
+    if columns.cell_energies is not None:
+        arrays[f"{branch_prefix}_E"] = _nestedListArray(columns.event_cluster_offsets, columns.cluster_cell_offsets,
+                                                        pa.array(np.asarray(columns.cell_energies, dtype=np.float32)))
+    return pa.record_batch(arrays)
+
+
+# Convert one ROOT file, return (number of events, output file size)
+def convertFile(input_file: str, output_file: str, tree_name: str, branch_prefix: str, batch_size: int, compression: str = "zstd"):
+    with uproot.open(input_file) as f:
+        branch_names = set(f[tree_name].keys())
+    has_ids = f"{branch_prefix}_ID" in branch_names
+    has_energies = f"{branch_prefix}_E" in branch_names
+    # Same reading (and mm -> m conversion) as when EventManager reads the ROOT file; the cell IDs are read separately,
+    # chunk by chunk in step with the coordinates
+    coord_chunks = ROOTEventSource([input_file], tree_name, branch_prefix, load_energies=has_energies).iterateColumns(step_size=batch_size)
+    id_chunks = ROOTEventSource([input_file], tree_name, branch_prefix, cell_id_mode=True).iterateColumns(step_size=batch_size) if has_ids else None
+
+    is_parquet = os.path.splitext(output_file)[1].lower() in EventSource.parquet_extensions
+    tmp_file = output_file + ".tmp"
+    writer, n_events = None, 0
+    try:
+        for columns in coord_chunks:
+            id_columns = next(id_chunks, None) if has_ids else None
+            if has_ids and (id_columns is None or len(id_columns) != len(columns)):
+                raise ValueError(f"{input_file}: the cell ID branch ({branch_prefix}_ID) does not have the same events as the coordinates")
+            batch = _makeRecordBatch(columns, id_columns, branch_prefix)
+            if writer is None:
+                schema = batch.schema.with_metadata({"calolite.branch_prefix": branch_prefix, "calolite.source": os.path.basename(input_file)})
+                writer = pq.ParquetWriter(tmp_file, schema, compression=compression) if is_parquet else pa.ipc.new_file(tmp_file, schema)
+            if is_parquet:
+                writer.write_batch(batch, row_group_size=len(batch))
+            else:
+                writer.write_batch(batch)
+            n_events += len(batch)
+        if has_ids and next(id_chunks, None) is not None:
+            raise ValueError(f"{input_file}: the cell ID branch ({branch_prefix}_ID) has more events than the coordinates")
+    except BaseException:
+        # No partial output is left behind
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    if writer is None:
+        raise ValueError(f"{input_file} has no event")
+    writer.close()
+    os.replace(tmp_file, output_file)
+    return n_events, os.path.getsize(output_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert event ROOT files to Arrow IPC / Parquet files for faster loading")
+    parser.add_argument("event_files", type=str, nargs='+', help="Event ROOT file(s) or glob pattern(s)")
+    parser.add_argument('-o', "--output_dir", type=str, default=None, help="Directory the converted files are written to (default: next to each input file)")
+    parser.add_argument('-f', "--format", type=str, default="arrow", choices=["arrow", "parquet"], help="Output format (arrow: memory-mapped without copy, parquet: smaller)")
+    parser.add_argument('-et', "--event_tree", type=str, default="EventTree", help="TTree name in the event file")
+    parser.add_argument('-cb', "--cell_coord_branch", type=str, default="mgex422_cluster_cell", help="TTree branch prefix of the cell coordinates in the event file")
+    parser.add_argument('-bs', "--batch_size", type=int, default=50000, help="Number of events per record batch / row group")
+    parser.add_argument("--compression", type=str, default="zstd", help="Parquet compression codec")
+    args = parser.parse_args()
+
+    input_files = []
+    for pattern in args.event_files:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            sys.exit(f"No event file matches {pattern}")
+        input_files += matches
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    for input_file in input_files:
+        output_dir = args.output_dir if args.output_dir is not None else os.path.dirname(input_file)
+        output_file = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(input_file))[0]}.{args.format}")
+        start_time = time.perf_counter()
+        n_events, n_bytes = convertFile(input_file, output_file, args.event_tree, args.cell_coord_branch, args.batch_size, args.compression)
+        elapsed = time.perf_counter() - start_time
+        print(f"{input_file} -> {output_file}: {n_events} events, {n_bytes / 1024**2:.1f} MB "
+              f"(from {os.path.getsize(input_file) / 1024**2:.1f} MB) in {elapsed:.2f} s")
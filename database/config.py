@@ -42,6 +42,30 @@ sub_detector_sizelist = [1.5, 1.5, 1.5, 1.5,        # PreSamplerB, EMB1, EMB2, E
                          1.5, 1.5, 1.5              # FCAL0, FCAL1, FCAL2
                         ]
 
+# Cell volumes (see useCaseClasses/CellVolumes.py): the geometry file gives the eta/phi extents of the cells but not
+# their depth, approximated per layer [m], along the radius ("r", barrel layers) or along the beam axis ("z", endcap
+# layers). Cells are drawn as projective wedges (widening away from the interaction point), except in the
+# layers of sub_detector_nonprojective_list, drawn as plain boxes.
+sub_detector_depthlist = [0.02, 0.10, 0.28, 0.10,   # PreSamplerB, EMB1, EMB2, EMB3
+                          0.02, 0.16, 0.26, 0.12,   # PreSamplerE, EME1, EME2, EME3
+                          0.28, 0.45, 0.50, 0.40,   # HEC0, HEC1, HEC2, HEC3
+                          0.30, 0.84, 0.38,         # TileBar0, TileBar1, TileBar2
+                          0.28, 0.38, 0.02,         # TileGap1, TileGap2, TileGap3
+                          0.30, 0.54, 0.68,         # TileExt0, TileExt1, TileExt2
+                          0.45, 0.45, 0.45          # FCAL0, FCAL1, FCAL2
+                         ]
+
+sub_detector_depth_axislist = ["r", "r", "r", "r",  # PreSamplerB, EMB1, EMB2, EMB3
+                               "z", "z", "z", "z",  # PreSamplerE, EME1, EME2, EME3
+                               "z", "z", "z", "z",  # HEC0, HEC1, HEC2, HEC3
+                               "r", "r", "r",       # TileBar0, TileBar1, TileBar2
+                               "r", "r", "z",       # TileGap1, TileGap2, TileGap3
+                               "r", "r", "r",       # TileExt0, TileExt1, TileExt2
+                               "z", "z", "z"        # FCAL0, FCAL1, FCAL2
+                              ]
+
+sub_detector_nonprojective_list = ["FCAL0", "FCAL1", "FCAL2"]
+
 detector_group_definitions = {
             "EM Barrel": ["PreSamplerB", "EMB1", "EMB2", "EMB3"],
             "EM Endcap": ["PreSamplerE", "EME1", "EME2", "EME3"],
@@ -58,4 +82,18 @@ clusters_color_choices = [(1, 0, 0),
                           (1, 0.48, 0),
                           (0.36, 1, 0),
                           (0, 1, 0.63),
-                          (0, 1, 0.94)]
\ No newline at end of file
+                          (0, 1, 0.94)]
+# Colour maps of the energy-coloured hit cells: colours at evenly spaced stops from low to high energy,
+# linearly interpolated in between (see controllers/ColorMap.py)
+cell_colormaps = {
+            "viridis": [(0.267, 0.005, 0.329), (0.279, 0.175, 0.483), (0.230, 0.322, 0.546),
+                        (0.173, 0.449, 0.558), (0.128, 0.567, 0.551), (0.157, 0.684, 0.502),
+                        (0.369, 0.789, 0.383), (0.678, 0.864, 0.190), (0.993, 0.906, 0.144)],
+            "inferno": [(0.001, 0.000, 0.014), (0.156, 0.044, 0.326), (0.341, 0.062, 0.429),
+                        (0.511, 0.130, 0.422), (0.735, 0.216, 0.330), (0.885, 0.342, 0.206),
+                        (0.978, 0.557, 0.035), (0.973, 0.775, 0.176), (0.988, 0.998, 0.645)],
+            "plasma":  [(0.050, 0.030, 0.528), (0.254, 0.014, 0.615), (0.417, 0.001, 0.658),
+                        (0.692, 0.165, 0.565), (0.798, 0.280, 0.470), (0.890, 0.397, 0.370),
+                        (0.973, 0.585, 0.252), (0.993, 0.747, 0.155), (0.940, 0.975, 0.131)],
+            "coolwarm": [(0.230, 0.299, 0.754), (0.865, 0.865, 0.865), (0.706, 0.016, 0.150)],
+}
@@ -0,0 +1,202 @@
+import json
+import ctypes
+import platform as host_platform
+from collections import deque
+import numpy as np
+from OpenGL.GL import *
+
+
+class GpuTimer:
+    """
+    GPU time of the frames drawn on the main stage and of their parts, from GL_TIMESTAMP queries (OpenGL 3.3 or
+    ARB_timer_query; without it, `supported` is False and nothing is measured).
+
+    A timestamp is queried at the start of the frame and after each part (mark), the GPU time of a part being the
+    difference with the previous timestamp. The results are only read once the GPU has reached them, a few frames
+    later (collect), so that measuring never stalls the pipeline; while max_pending_frames frames are still in
+    flight, the next frames are not measured. Must be used with the GL context current.
+    """
+    max_pending_frames = 4
+
+    def __init__(self):
+        self.supported = None           # Checked on the first frame (needs the context)
+        self._free_queries = []
+        self._pending = deque()         # (part labels, queries) of the measured frames, oldest first
+        self._labels = None             # Part labels and queries of the frame being measured
+        self._queries = None
+
+    # (Public) Start measuring a frame, returns False if it is not measured
+    def beginFrame(self) -> bool:
+        if self.supported is None:
+            self.supported = self._checkSupport()
+        if not self.supported or len(self._pending) >= self.max_pending_frames:
+            self._labels = None
+            return False
+        self._labels, self._queries = [], []
+        self._queryTimestamp()
+        return True
+
+    # (Public) End the part `label` of the frame (the part started at the previous mark, or at beginFrame)
+    def mark(self, label: str):
+        if self._labels is None:
+            return
+        self._labels.append(label)
+        self._queryTimestamp()
+
+    def endFrame(self):
+        if self._labels is None:
+            return
+        self._pending.append((self._labels, self._queries))
+        self._labels = None
+
+    # (Public) Return [(frame GPU time [ms], {part label: GPU time [ms]}), ...] of the frames whose results are available
+    def collect(self) -> list:
+        frames = []
+        while self._pending:
+            labels, queries = self._pending[0]
+            if not glGetQueryObjectiv(queries[-1], GL_QUERY_RESULT_AVAILABLE):
+                break
+            self._pending.popleft()
+            timestamps = np.array([self._queryResult(query) for query in queries], dtype=np.int64)
+            self._free_queries += queries
+            part_ms = np.diff(timestamps) / 1e6
+            parts = {}
+            for label, ms in zip(labels, part_ms):
+                parts[label] = parts.get(label, 0.0) + float(ms)
+            frames.append((float(timestamps[-1] - timestamps[0]) / 1e6, parts))
+        return frames
+
+    # (Public) Delete the query objects (with the context current)
+    def release(self):
+        queries = self._free_queries + [query for _, frame_queries in self._pending for query in frame_queries]
+        if queries:
+            glDeleteQueries(len(queries), queries)
+        self._free_queries, self._pending = [], deque()
+
+
+    @staticmethod
+    def _checkSupport() -> bool:
+        if not bool(glQueryCounter):
+            return False
+        try:
+            glDeleteQueries(1, [glGenQueries(1)[0]])
+        except Exception:
+            return False
+        return True
+
+    def _queryTimestamp(self):
+        if not self._free_queries:
+            self._free_queries = [int(query) for query in glGenQueries(64)]
+        query = self._free_queries.pop()
+        glQueryCounter(query, GL_TIMESTAMP)
+        self._queries.append(query)
+
+    @staticmethod
+    def _queryResult(query: int) -> int:
+        # (PyOpenGL cannot convert the 64-bit output array by itself)
+        result = ctypes.c_uint64(0)
+        glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(result))
+        return result.value
+
+
+class FrameStats:
+    """
+    Rolling frame-time statistics of the main stage: interval between frames (FPS), CPU time of each paintGL,
+    GPU time (GpuTimer) and the CPU/GPU time of each renderable (collected by Scene.render_all), over the last
+    `window` frames.
+
+    The frame times are also histogrammed on fixed log-spaced bins (histogram_edges_ms, 20 per decade), over the
+    window and since the start, and dumped to JSON with the OpenGL renderer and the machine (dump), so that the
+    files of different machines or builds can be compared bin by bin.
+    """
+    histogram_edges_ms = np.concatenate(([0.0], np.geomspace(0.1, 1000.0, 81), [np.inf]))
+
+    def __init__(self, window: int = 600):
+        self.window = window
+        self.n_frames = 0
+        self.gl_info = {}               # Renderer, version, vendor (set by MainStage on the first frame)
+        self._frame_starts = deque(maxlen=window)       # perf_counter() at the start of each frame [s]
+        self._cpu_ms = deque(maxlen=window)
+        self._gpu_ms = deque(maxlen=window)
+        self._renderable_cpu_ms = {}    # label -> deque of CPU times [ms], over the frames it was drawn in
+        self._renderable_gpu_ms = {}
+        self._total_cpu_counts = np.zeros(len(self.histogram_edges_ms) - 1, dtype=np.int64)
+        self._total_gpu_counts = np.zeros(len(self.histogram_edges_ms) - 1, dtype=np.int64)
+
+    # (Public) Add a frame: start time [s], CPU time of paintGL [ms] and of each renderable {label: ms}
+    def addFrame(self, start_time: float, cpu_ms: float, renderable_cpu_ms: dict = None):
+        self.n_frames += 1
+        self._frame_starts.append(start_time)
+        self._cpu_ms.append(cpu_ms)
+        self._total_cpu_counts[self._binIndex(cpu_ms)] += 1
+        for label, ms in (renderable_cpu_ms or {}).items():
+            self._renderable_cpu_ms.setdefault(label, deque(maxlen=self.window)).append(ms)
+
+    # (Public) Add the GPU times of a frame (from GpuTimer.collect, frames later than its addFrame)
+    def addGpuFrame(self, gpu_ms: float, renderable_gpu_ms: dict = None):
+        self._gpu_ms.append(gpu_ms)
+        self._total_gpu_counts[self._binIndex(gpu_ms)] += 1
+        for label, ms in (renderable_gpu_ms or {}).items():
+            self._renderable_gpu_ms.setdefault(label, deque(maxlen=self.window)).append(ms)
+
+    # (Public) Frames per second over the frames of the last second (0 if fewer than 2)
+    def fps(self) -> float:
+        if len(self._frame_starts) < 2:
+            return 0.0
+        starts = np.asarray(self._frame_starts)
+        recent = starts[starts >= starts[-1] - 1.0]
+        return (len(recent) - 1) / (recent[-1] - recent[0]) if len(recent) >= 2 and recent[-1] > recent[0] else 0.0
+
+    # (Public) Percentiles of the CPU/GPU frame times and mean time of each renderable, over the window
+    def summary(self) -> dict:
+        renderables = {}
+        for label in dict.fromkeys(list(self._renderable_cpu_ms) + list(self._renderable_gpu_ms)):
+            cpu_ms, gpu_ms = self._renderable_cpu_ms.get(label), self._renderable_gpu_ms.get(label)
+            renderables[label] = {"cpu_ms_mean": float(np.mean(cpu_ms)) if cpu_ms else None,
+                                  "gpu_ms_mean": float(np.mean(gpu_ms)) if gpu_ms else None}
+        return {"n_frames": self.n_frames, "window": self.window, "fps": self.fps(),
+                "cpu_ms": self._percentiles(self._cpu_ms), "gpu_ms": self._percentiles(self._gpu_ms),
+                "renderables": renderables}
+
+    # (Public) Frame-time counts per bin of histogram_edges_ms, over the window and since the start
+    def histograms(self) -> dict:
+        edges = self.histogram_edges_ms
+        return {"edges_ms": [float(edge) if np.isfinite(edge) else None for edge in edges],
+                "cpu_window": np.histogram(np.asarray(self._cpu_ms), edges)[0].tolist(),
+                "gpu_window": np.histogram(np.asarray(self._gpu_ms), edges)[0].tolist(),
+                "cpu_total": self._total_cpu_counts.tolist(),
+                "gpu_total": self._total_gpu_counts.tolist()}
+
+    # (Public) Write the summary and histograms, with the OpenGL renderer and machine, to a JSON file
+    def dump(self, path: str):
+        report = {"machine": {"platform": host_platform.platform(), "processor": host_platform.processor(),
+                              "python": host_platform.python_version(), **self.gl_info},
+                  "summary": self.summary(), "histograms": self.histograms()}
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1)
+
+    # (Public) Text lines of the HUD: FPS, frame times and the costliest renderables
+    def hudLines(self, max_renderables: int = 8) -> list[str]:
+        cpu, gpu = self._percentiles(self._cpu_ms), self._percentiles(self._gpu_ms)
+        lines = [f"{self.fps():5.1f} FPS",
+                 f"CPU paintGL {cpu['mean']:6.2f} ms (p95 {cpu['p95']:6.2f})" if cpu else "CPU paintGL -",
+                 f"GPU frame   {gpu['mean']:6.2f} ms (p95 {gpu['p95']:6.2f})" if gpu else "GPU frame   - (no timer queries)"]
+        renderables = self.summary()["renderables"]
+        costs = sorted(renderables.items(), key=lambda item: -max(item[1]["cpu_ms_mean"] or 0.0, item[1]["gpu_ms_mean"] or 0.0))
+        for label, times in costs[:max_renderables]:
+            cpu_text = f"{times['cpu_ms_mean']:6.2f}" if times["cpu_ms_mean"] is not None else "     -"
+            gpu_text = f"{times['gpu_ms_mean']:6.2f}" if times["gpu_ms_mean"] is not None else "     -"
+            lines.append(f"  {label:<22.22} cpu {cpu_text} gpu {gpu_text} ms")
+        return lines
+
+
+    def _binIndex(self, ms: float) -> int:
+        return min(max(int(np.searchsorted(self.histogram_edges_ms, ms, side='right')) - 1, 0), len(self.histogram_edges_ms) - 2)
+
+    @staticmethod
+    def _percentiles(values) -> dict:
+        if not values:
+            return {}
+        values = np.asarray(values)
+        return {"mean": float(values.mean()), "p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+                "p99": float(np.percentile(values, 99)), "max": float(values.max())}
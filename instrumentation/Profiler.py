@@ -0,0 +1,133 @@
+import csv
+import json
+import time
+import threading
+import tracemalloc
+import contextlib
+import cProfile
+import numpy as np
+
+
+class _Span:
+    """
+    One open timing span (see Profiler.span)
+    """
+    __slots__ = ("name", "start_time", "start_mem", "max_peak_mem")
+
+    def __init__(self, name: str, start_time: float, start_mem: int):
+        self.name = name
+        self.start_time = start_time
+        self.start_mem = start_mem
+        self.max_peak_mem = start_mem
+
+
+class Profiler:
+    """
+    Collects named timing spans (wall time and, optionally, peak traced memory) around startup and hot-path code.
+
+    Disabled by default: span() then returns a shared no-op context manager, so instrumented code
+    costs next to nothing. Once enabled (launch.py --profile), every span records its wall time. With
+    memory tracing (launch.py --profile_memory) it also records the peak memory allocated (through
+    tracemalloc) while it was open; tracemalloc slows every allocation down, so the timings are then
+    inflated. The peak memory tracking is process wide, so a span overlapping with another thread's
+    work also sees that thread's allocations.
+    """
+    _NULL_SPAN = contextlib.nullcontext()
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._open_spans = []           # all currently open spans, from all threads
+        self._durations = {}            # span name -> list of durations [s]
+        self._peak_mems = {}            # span name -> max peak memory above span start [bytes]
+        self._cprofile = None
+
+    # (Public) Start collecting spans, optionally with their peak memory and a cProfile capture of the main thread
+    def enable(self, trace_memory: bool = False, with_cprofile: bool = False):
+        self.enabled = True
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if with_cprofile:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    # (Public) Context manager timing the enclosed block under `name`
+    def span(self, name: str):
+        if not self.enabled:
+            return self._NULL_SPAN
+        return self._timedSpan(name)
+
+    # (Public) Record an externally measured duration (e.g. startup milestones)
+    def record(self, name: str, seconds: float, peak_mem: int = 0):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._durations.setdefault(name, []).append(seconds)
+            self._peak_mems[name] = max(self._peak_mems.get(name, 0), peak_mem)
+
+    # (Public) Aggregated statistics per span name
+    def summary(self) -> list[dict]:
+        with self._lock:
+            items = [(name, np.asarray(durations), self._peak_mems.get(name, 0)) for name, durations in self._durations.items()]
+        rows = []
+        for name, durations, peak_mem in sorted(items, key=lambda item: -item[1].sum()):
+            rows.append({"span": name,
+                         "count": len(durations),
+                         "total_s": float(durations.sum()),
+                         "mean_ms": float(durations.mean() * 1e3),
+                         "p50_ms": float(np.percentile(durations, 50) * 1e3),
+                         "p95_ms": float(np.percentile(durations, 95) * 1e3),
+                         "max_ms": float(durations.max() * 1e3),
+                         "peak_mem_mb": peak_mem / 1024**2})
+        return rows
+
+    # (Public) Write <prefix>.json and <prefix>.csv reports (and <prefix>.prof if cProfile was on)
+    def dump(self, prefix: str):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(f"{prefix}.prof")
+        rows = self.summary()
+        with open(f"{prefix}.json", "w") as f:
+            json.dump({"spans": rows}, f, indent=2)
+        with open(f"{prefix}.csv", "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["span", "count", "total_s", "mean_ms", "p50_ms", "p95_ms", "max_ms", "peak_mem_mb"])
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"Profiler: report written to {prefix}.json / {prefix}.csv" + (f" / {prefix}.prof" if self._cprofile is not None else ""))
+
+    @contextlib.contextmanager
+    def _timedSpan(self, name: str):
+        span = self._openSpan(name)
+        try:
+            yield
+        finally:
+            self._closeSpan(span)
+
+    def _openSpan(self, name: str) -> _Span:
+        with self._lock:
+            current_mem = self._updatePeaks()
+            span = _Span(name, time.perf_counter(), current_mem)
+            self._open_spans.append(span)
+        return span
+
+    def _closeSpan(self, span: _Span):
+        end_time = time.perf_counter()
+        with self._lock:
+            self._updatePeaks()
+            self._open_spans.remove(span)
+            self._durations.setdefault(span.name, []).append(end_time - span.start_time)
+            self._peak_mems[span.name] = max(self._peak_mems.get(span.name, 0), span.max_peak_mem - span.start_mem)
+
+    def _updatePeaks(self) -> int:
+        # Fold the peak reached since the last span event into every open span, then restart peak tracking
+        if not tracemalloc.is_tracing():
+            return 0
+        current_mem, peak_mem = tracemalloc.get_traced_memory()
+        for open_span in self._open_spans:
+            open_span.max_peak_mem = max(open_span.max_peak_mem, peak_mem)
+        tracemalloc.reset_peak()
+        return current_mem
+
+
+# Process-wide profiler used by the instrumented code
+profiler = Profiler()
@@ -1,27 +1,56 @@
+import os
 import sys
+import time
 import argparse
 from PySide6.QtGui import QSurfaceFormat
 from PySide6.QtWidgets import QApplication
 
-from useCaseClasses.CalorimeterManager import CalorimeterManager
-from useCaseClasses.EventManager import EventManager
-from controllers.CalorimeterController import CalorimeterController
-from controllers.EventController import EventController
 from controllers.Renderable import Axis
 from presenters.MainStage import MainStage, Scene
+from presenters.DataLoaders import CalorimeterLoader, EventLoader, StartupLoader
+from presenters.InteractionRecording import InteractionRecorder, InteractionReplayer
 from UI.CaloLITE_UI import CaloLITE_Window
+from instrumentation.Profiler import profiler
    
 
 if __name__ == '__main__':
+    launch_start_time = time.perf_counter()
     parser = argparse.ArgumentParser(description="This file lauches a GUI to display single event in the ATLAS Calorimeter")
     parser.add_argument('-ft', "--file_type", type=str, default="pi0", choices=["pi0", "pi+"], help="Choose event file type (pi0, pi+)")
+    parser.add_argument('-ef', "--event_files", type=str, nargs='+', default=None, help="Event file(s) or glob pattern(s) (e.g. \"database/pi0_*.root\"), ROOT or converted Arrow/Parquet files, overrides --file_type")
     parser.add_argument('-et', "--event_tree", type=str, default="EventTree", help="TTree name in the event file")
     parser.add_argument('-cb', "--cell_coord_branch", type=str, default="mgex422_cluster_cell", help="TTree branch prefix of the cell coordinates in the event file")
+    parser.add_argument('-id', "--cell_ids", action="store_true", help="Read the cluster cells as cell IDs (CELL_COORD_BRANCH_ID) looked up in the geometry, instead of their X/Y/Z coordinates")
+    parser.add_argument('-en', "--energies", action="store_true", help="Also read the cell energies (CELL_COORD_BRANCH_E), to colour the hit cells by energy")
+    parser.add_argument('-lz', "--lazy", action="store_true", help="Only index event numbers at startup, read each event from file on first access")
+    parser.add_argument('-cs', "--cache_size", type=int, default=256, help="Number of decoded events kept in memory in lazy mode")
+    parser.add_argument('-ngc', "--no_geo_cache", action="store_true", help="Always read the geometry from the ROOT file, ignoring (and not writing) the geometry cache")
+    parser.add_argument('-lf', "--lod_fraction", type=float, default=0.08, help="Fraction of the cells of each layer drawn while rotating/zooming (0 to always draw all cells)")
+    parser.add_argument('-pf', "--prefetch", type=int, default=5, help="Number of next/previous events prepared in the background after an event is displayed (0 to disable)")
+    parser.add_argument('-pb', "--prefetch_budget", type=float, default=256, help="Memory budget [MB] of the prefetched events cache")
+    parser.add_argument('-pr', "--profile", type=str, nargs='?', const="calolite_profile", default=None, help="Record timing spans and write the report to PROFILE.json/.csv at exit (default prefix: calolite_profile)")
+    parser.add_argument('-pm', "--profile_memory", action="store_true", help="With --profile, also record the peak memory of the spans (tracemalloc, slows the timed code down)")
+    parser.add_argument('-cp', "--cprofile", action="store_true", help="With --profile, also write a cProfile capture of the main thread to PROFILE.prof")
+    parser.add_argument('-hud', "--hud", action="store_true", help="Show the frame-time HUD (FPS, CPU/GPU time per frame and per renderable) at startup")
+    parser.add_argument('-fs', "--frame_stats", type=str, nargs='?', const="calolite_frame_stats.json", default=None, help="Collect the frame times and write their statistics and histograms to FRAME_STATS at exit (default: calolite_frame_stats.json)")
+    parser.add_argument('-cv', "--cell_volumes", action="store_true", help="Draw the calorimeter cells as outlines of their real extents (eta/phi from the geometry file) and the hit cells as filled volumes, instead of points")
+    parser.add_argument('-rec', "--record", type=str, default=None, help="Record the camera moves, event selections and layer/axis toggles to RECORD (JSON lines), to be replayed with --replay")
+    parser.add_argument('-rp', "--replay", type=str, default=None, help="Replay a recorded session once loaded (offscreen unless QT_QPA_PLATFORM is set), measure every frame, write the timings and quit")
+    parser.add_argument('-ro', "--replay_output", type=str, default=None, help="File the replay timings are written to (default: REPLAY_timings.json)")
+    parser.add_argument('-rr', "--replay_repeats", type=int, default=1, help="Number of times the recorded session is replayed")
     args = parser.parse_args()
     
+    if args.profile is not None:
+        profiler.enable(trace_memory=args.profile_memory, with_cprofile=args.cprofile)
+    
     # Handle file name based choices of file type in argument (this can be freely changed)
     if args.file_type == "pi0": f = "pi0.mltree.root"
     elif args.file_type == "pi+": f = "piplus.mltree.root"
+    event_files = args.event_files if args.event_files is not None else f"database/{f}"
+    
+    # Replays are run without showing anything, unless a platform is chosen explicitly
+    if args.replay is not None:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
     
     # Create the QApplication instance
     app = QApplication(sys.argv)
@@ -31,28 +60,50 @@ if __name__ == '__main__':
     fmt.setDepthBufferSize(24)
     QSurfaceFormat.setDefaultFormat(fmt)
 
-    # =====================================================
-    # Initialize the useCase classes (for handling the database)
-    calorimeter_manager = CalorimeterManager("database/cell_geo+.root")    
-    event_manager = EventManager(f"database/{f}", args.event_tree, args.cell_coord_branch)
-    
-    # =====================================================
-    # Initialize the controller classes 
-    # (instances that contain instructions how the object in supposed to be drawn)
-    axis_controller = Axis()
-    calorimeter_controller = CalorimeterController(calorimeter_manager)
-    sub_detector_controllers = calorimeter_controller.getAllSubDetector()
-    event_controller = EventController(event_manager)
-    
     # =====================================================
     # Initialize the presenter classes 
     # (instances that execute the instructions for drawing the objects, connected to UI buttons)
     ## Assemble the mainStage (Scene for overall control, objects like: axis, ...)
+    ## The calorimeter layers and the event controller are added once loaded in the background
+    axis_controller = Axis()
     scene = Scene()
-    mainStage = MainStage(scene, axis_controller, sub_detector_controllers, event_controller)
+    mainStage = MainStage(scene, axis_controller)
+    mainStage.lod_enabled = args.lod_fraction > 0
+    if args.frame_stats is not None:
+        mainStage.setFrameStatsEnabled(True)
+    if args.hud:
+        mainStage.setHudVisible(True)
+    if args.cell_volumes:
+        mainStage.setCellVolumesEnabled(True)
 
     # =====================================================
-    # Initialize the UI class (display window)
-    window = CaloLITE_Window(mainStage, event_manager.getEventNumbers()) # Pass mainStage here
+    # Initialize the UI class (display window), shown right away
+    window = CaloLITE_Window(mainStage) # Pass mainStage here
     window.show()
-    sys.exit(app.exec())
+    
+    # =====================================================
+    # Load the useCase classes (for handling the database) and their controller classes 
+    # (instances that contain instructions how the object in supposed to be drawn) on background threads
+    calorimeter_loader = CalorimeterLoader("database/cell_geo+.root", use_cache=not args.no_geo_cache, lod_fraction=args.lod_fraction,
+                                           cell_volumes=args.cell_volumes)
+    event_loader = EventLoader(event_files, args.event_tree, args.cell_coord_branch, 
+                               lazy=args.lazy, cache_size=args.cache_size, 
+                               prefetch=args.prefetch, prefetch_budget=args.prefetch_budget, use_cell_ids=args.cell_ids,
+                               load_energies=args.energies)
+    startup_loader = StartupLoader(mainStage, window, launch_start_time)
+    
+    if args.record is not None:
+        recorder = InteractionRecorder(window, args.record)
+    if args.replay is not None:
+        replay_output = args.replay_output if args.replay_output is not None else f"{os.path.splitext(args.replay)[0]}_timings.json"
+        replayer = InteractionReplayer(window, args.replay, replay_output, repeats=args.replay_repeats)
+        startup_loader.loaded.connect(replayer.start)
+        startup_loader.loadingFailed.connect(replayer.abort)
+    startup_loader.start(calorimeter_loader, event_loader)
+    
+    exit_code = app.exec()
+    if args.profile is not None:
+        profiler.dump(args.profile)
+    if args.frame_stats is not None and mainStage.dumpFrameStats(args.frame_stats):
+        print(f"Frame times written to {args.frame_stats}")
+    sys.exit(exit_code)
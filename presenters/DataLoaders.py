@@ -0,0 +1,300 @@
+import time
+from PySide6.QtCore import QObject, QThread, Signal, Slot
+from PySide6.QtWidgets import QApplication
+
+from useCaseClasses.CalorimeterManager import CalorimeterManager
+from useCaseClasses.EventManager import EventManager
+from useCaseClasses.EventPrefetcher import EventPrefetcher
+from useCaseClasses.CellOccupancy import CellOccupancy
+from controllers.CalorimeterController import CalorimeterController
+from controllers.EventController import EventController
+from instrumentation.Profiler import profiler
+
+
+class CalorimeterLoader(QObject):
+    """
+    Worker (to be moved to a QThread) building the calorimeter geometry and its sub-detector controllers
+    """
+    progress = Signal(str)
+    layerReady = Signal(str, object)    # sub-detector name, SubDetectorController
+    finished = Signal(object)           # CalorimeterController
+    failed = Signal(str)
+
+    def __init__(self, file_name: str, use_cache: bool = True, lod_fraction: float = 0.08, cell_volumes: bool = False):
+        super().__init__()
+        self.file_name = file_name
+        self.use_cache = use_cache
+        self.lod_fraction = lod_fraction
+        self.cell_volumes = cell_volumes
+
+    @Slot()
+    def run(self):
+        try:
+            self.progress.emit("Loading calorimeter geometry...")
+            calorimeter_manager = CalorimeterManager(self.file_name, use_cache=self.use_cache)
+            calorimeter_controller = CalorimeterController(calorimeter_manager, lod_fraction=self.lod_fraction)
+            # Built here rather than on the first click
+            calorimeter_manager.getCellSpatialIndex()
+            if self.cell_volumes and calorimeter_manager.hasCellExtents():
+                calorimeter_manager.getCellVolumes()
+            for name, controller in calorimeter_controller.getAllSubDetector().items():
+                self.layerReady.emit(name, controller)
+            self.finished.emit(calorimeter_controller)
+        except Exception as e:
+            self.failed.emit(f"Failed to load calorimeter geometry: {e}")
+
+
+class EventLoader(QObject):
+    """
+    Worker (to be moved to a QThread) reading the event file and building the event controller.
+    Event numbers are sent (as one sorted array) as soon as they are indexed, before the rest of the events is loaded.
+    In cell-ID mode the loader needs the geometry: `calorimeter_manager` is set (by StartupLoader) before it runs.
+    """
+    progress = Signal(str)
+    eventNumbersReady = Signal(object)  # sorted event numbers (np.ndarray)
+    finished = Signal(object)           # EventController
+    failed = Signal(str)
+
+    def __init__(self, file_name, tree_name: str, branch_prefix: str, lazy=False, cache_size=256,
+                 prefetch=0, prefetch_budget=256, use_cell_ids=False,
+                 load_energies=False):
+        super().__init__()
+        self.file_name = file_name
+        self.tree_name = tree_name
+        self.branch_prefix = branch_prefix
+        self.lazy = lazy
+        self.cache_size = cache_size
+        self.prefetch = prefetch
+        self.prefetch_budget = prefetch_budget
+        self.use_cell_ids = use_cell_ids
+        self.load_energies = load_energies
+        self.calorimeter_manager = None
+
+    @Slot()
+    def run(self):
+        try:
+            self.progress.emit(f"Loading events from {self.file_name if isinstance(self.file_name, str) else ', '.join(self.file_name)}...")
+            event_manager = EventManager(self.file_name, self.tree_name, self.branch_prefix,
+                                         lazy=self.lazy, cache_size=self.cache_size,
+                                         progress_callback=self.progress.emit,
+                                         event_numbers_callback=self._emitEventNumbers,
+                                         calorimeter_manager=self.calorimeter_manager if self.use_cell_ids else None,
+                                         load_energies=self.load_energies)
+            event_prefetcher = None
+            if self.prefetch > 0:
+                event_prefetcher = EventPrefetcher(event_manager, radius=self.prefetch, cache_budget_mb=self.prefetch_budget)
+            self.finished.emit(EventController(event_manager, event_prefetcher))
+        except Exception as e:
+            self.failed.emit(f"Failed to load events: {e}")
+
+    def _emitEventNumbers(self, event_numbers):
+        self.eventNumbersReady.emit(event_numbers)
+
+
+class OccupancyLoader(QObject):
+    """
+    Worker (to be moved to a QThread) accumulating the cell occupancy over all events (see CellOccupancy)
+    """
+    progress = Signal(str)
+    finished = Signal(object)           # CellOccupancy
+    failed = Signal(str)
+
+    def __init__(self, event_manager: EventManager, calorimeter_manager: CalorimeterManager):
+        super().__init__()
+        self.event_manager = event_manager
+        self.calorimeter_manager = calorimeter_manager
+
+    @Slot()
+    def run(self):
+        try:
+            start_time = time.perf_counter()
+            self.progress.emit("Accumulating the cell occupancy over all events...")
+            with profiler.span("occupancy.total"):
+                occupancy = CellOccupancy.fromEventManager(self.event_manager, self.calorimeter_manager, progress_callback=self.progress.emit)
+            self.progress.emit(f"Cell occupancy of {occupancy.n_events} events: {occupancy.n_hit_cells} cells hit "
+                               f"({time.perf_counter() - start_time:.2f} s)")
+            self.finished.emit(occupancy)
+        except Exception as e:
+            self.failed.emit(f"Failed to accumulate the cell occupancy: {e}")
+
+
+class EventSummaryLoader(QObject):
+    """
+    Worker (to be moved to a QThread) computing the per-event summaries used by the event queries (see EventSummary),
+    with the cells per layer: from the in-memory events in eager mode, by reading all files once in lazy mode
+    """
+    progress = Signal(str)
+    finished = Signal(object)           # EventSummary
+    failed = Signal(str)
+
+    def __init__(self, event_manager: EventManager, calorimeter_manager: CalorimeterManager):
+        super().__init__()
+        self.event_manager = event_manager
+        self.calorimeter_manager = calorimeter_manager
+
+    @Slot()
+    def run(self):
+        try:
+            start_time = time.perf_counter()
+            event_summary = self.event_manager.getEventSummary(self.calorimeter_manager)
+            self.progress.emit(f"Event summaries of {len(event_summary)} events ready for queries "
+                               f"({time.perf_counter() - start_time:.2f} s)")
+            self.finished.emit(event_summary)
+        except Exception as e:
+            self.failed.emit(f"Failed to compute the event summaries: {e}")
+
+
+class StartupLoader(QObject):
+    """
+    Runs the loaders on background threads while the window is already on screen:
+    geometry layers are added to the main stage as soon as they are ready, the event drop-down list
+    is filled as event numbers arrive, the event summaries for the queries are computed once both are
+    loaded, and the startup milestones (first frame, first frame with
+    geometry, first frame with events) are measured from `start_time` and reported.
+    """
+    loaded = Signal()                   # Emitted once both the geometry and the events are loaded
+    loadingFailed = Signal(str)
+
+    def __init__(self, mainStage, window, start_time: float):
+        super().__init__()
+        self.mainStage = mainStage
+        self.window = window
+        self.start_time = start_time
+        self.timings = {}               # milestone -> seconds since start_time
+        self._threads = []
+        self._loaders = []
+        self._geometry_loaded = False
+        self._events_loaded = False
+        self._event_controller = None
+        self._calorimeter_controller = None
+        self._deferred_event_loader = None
+        self._occupancy_requested = False
+        self._occupancy_loader = None
+        self._summary_loader = None
+
+        self.mainStage.frameRendered.connect(self._onFrameRendered)
+        self.mainStage.occupancyRequested.connect(self._onOccupancyRequested)
+        QApplication.instance().aboutToQuit.connect(self._onAboutToQuit)
+
+    # (Public) Start both loaders, each on its own thread
+    # (in cell-ID mode, the event loader is only started once the geometry is loaded)
+    def start(self, calorimeterLoader: CalorimeterLoader, eventLoader: EventLoader):
+        calorimeterLoader.progress.connect(self.window.showStatusMessage)
+        calorimeterLoader.layerReady.connect(self.mainStage.addSubDetectorController)
+        calorimeterLoader.finished.connect(self._onGeometryLoaded)
+        calorimeterLoader.failed.connect(self._onLoadingFailed)
+        self._runInThread(calorimeterLoader)
+
+        eventLoader.progress.connect(self.window.showStatusMessage)
+        eventLoader.eventNumbersReady.connect(self.window.appendEventNumbers)
+        eventLoader.finished.connect(self._onEventsLoaded)
+        eventLoader.failed.connect(self._onLoadingFailed)
+        if eventLoader.use_cell_ids:
+            self._deferred_event_loader = eventLoader
+        else:
+            self._runInThread(eventLoader)
+
+    def _runInThread(self, loader: QObject):
+        thread = QThread()
+        loader.moveToThread(thread)
+        thread.started.connect(loader.run)
+        loader.finished.connect(thread.quit)
+        loader.failed.connect(thread.quit)
+        self._threads.append(thread)
+        self._loaders.append(loader)
+        thread.start()
+
+    def _recordMilestone(self, milestone: str):
+        if milestone in self.timings:
+            return
+        elapsed = time.perf_counter() - self.start_time
+        self.timings[milestone] = elapsed
+        profiler.record("startup." + milestone.replace(" ", "_"), elapsed)
+        print(f"Startup: {milestone} after {elapsed:.3f} s")
+
+    @Slot(object)
+    def _onGeometryLoaded(self, calorimeterController):
+        self._geometry_loaded = True
+        self._calorimeter_controller = calorimeterController
+        self.mainStage.setCalorimeterManager(calorimeterController.calo_manager)
+        self.mainStage.setCalorimeterController(calorimeterController)
+        self.window.setCellVolumesAvailable(calorimeterController.calo_manager.hasCellExtents())
+        self._recordMilestone("geometry loaded")
+        self._giveGeometryToEvents()
+        if self._deferred_event_loader is not None:
+            self._deferred_event_loader.calorimeter_manager = calorimeterController.calo_manager
+            self._runInThread(self._deferred_event_loader)
+            self._deferred_event_loader = None
+
+    @Slot(object)
+    def _onEventsLoaded(self, eventController):
+        self._events_loaded = True
+        self._event_controller = eventController
+        self.mainStage.setEventController(eventController)
+        self._giveGeometryToEvents()
+        self._recordMilestone("events loaded")
+        self.window.showStatusMessage(f"Loaded {len(eventController.eventManager.getEventNumbers())} events")
+
+    def _giveGeometryToEvents(self):
+        # Once both are loaded, the event hit cells can be grouped by layer
+        if self._calorimeter_controller is not None and self._event_controller is not None:
+            self._event_controller.setCalorimeterManager(self._calorimeter_controller.calo_manager)
+            self.mainStage.update()
+            self._startSummaryLoader()
+            self._startOccupancyLoader()
+            self.loaded.emit()
+
+    def _startSummaryLoader(self):
+        # Once, with the geometry, so that the summaries include the cells per layer
+        if self._summary_loader is not None:
+            return
+        self._summary_loader = EventSummaryLoader(self._event_controller.eventManager, self._calorimeter_controller.calo_manager)
+        self._summary_loader.progress.connect(self.window.showStatusMessage)
+        self._summary_loader.finished.connect(self.mainStage.setEventSummary)
+        self._summary_loader.failed.connect(self._onLoadingFailed)
+        self._runInThread(self._summary_loader)
+
+    @Slot()
+    def _onOccupancyRequested(self):
+        # Accumulated once, as soon as both the geometry and the events are loaded
+        self._occupancy_requested = True
+        self._startOccupancyLoader()
+
+    def _startOccupancyLoader(self):
+        if (not self._occupancy_requested or self._occupancy_loader is not None
+                or self._calorimeter_controller is None or self._event_controller is None):
+            return
+        self._occupancy_loader = OccupancyLoader(self._event_controller.eventManager, self._calorimeter_controller.calo_manager)
+        self._occupancy_loader.progress.connect(self.window.showStatusMessage)
+        self._occupancy_loader.finished.connect(self.mainStage.setCellOccupancy)
+        self._occupancy_loader.failed.connect(self._onLoadingFailed)
+        self._runInThread(self._occupancy_loader)
+
+    @Slot(str)
+    def _onLoadingFailed(self, message: str):
+        print(message)
+        self.window.showStatusMessage(message)
+        self.loadingFailed.emit(message)
+
+    @Slot()
+    def _onFrameRendered(self):
+        self._recordMilestone("time to first frame")
+        if self._geometry_loaded:
+            self._recordMilestone("time to first frame with geometry")
+        if self._events_loaded:
+            self._recordMilestone("time to first frame with events")
+        if self._geometry_loaded and self._events_loaded:
+            self.mainStage.frameRendered.disconnect(self._onFrameRendered)
+            self.window.showStatusMessage(
+                f"Ready: first frame {self.timings['time to first frame']:.2f} s, "
+                f"geometry {self.timings['time to first frame with geometry']:.2f} s, "
+                f"events {self.timings['time to first frame with events']:.2f} s")
+
+    @Slot()
+    def _onAboutToQuit(self):
+        if self._event_controller is not None and self._event_controller.prefetcher is not None:
+            self._event_controller.prefetcher.shutdown()
+        # Let the loaders finish before the threads are destroyed
+        for thread in self._threads:
+            thread.quit()
+            thread.wait()
@@ -0,0 +1,223 @@
+import sys
+import json
+import time
+import numpy as np
+from PySide6.QtCore import QObject, QTimer, Slot
+from PySide6.QtWidgets import QApplication
+
+from presenters.MainStage import MainStage
+
+
+class InteractionRecorder(QObject):
+    """
+    Records the interactions with the window into a JSON-lines file, to be replayed by InteractionReplayer:
+    the camera changes of the main stage (rotation, panning, zoom, reset, and whether the camera is being
+    moved, i.e. drawn at low detail), the displayed event, and the layer, layer group and axis toggles.
+
+    The first line is a header (format version, launch arguments, window size, initial camera), then one
+    record per action: {"t": seconds since the start, "type": "camera" | "event" | "layer" | "group" | "axis", ...}.
+    Every record is written as soon as it happens, so that the file is usable even if the program is killed.
+    """
+    format_name = "calolite-interactions"
+    format_version = 1
+
+    def __init__(self, window, path: str):
+        super().__init__()
+        self.window = window
+        self.mainStage: MainStage = window.mainStageWidget
+        self.path = path
+        self.n_records = 0
+        self._start_time = time.perf_counter()
+        self._file = open(path, "w")
+        self._write({"format": self.format_name, "version": self.format_version, "launch_args": sys.argv[1:],
+                     "window_size": [window.width(), window.height()],
+                     "stage_size": [self.mainStage.width(), self.mainStage.height()],
+                     "camera": self.mainStage.cameraState()})
+
+        self.mainStage.cameraChanged.connect(self._onCameraChanged)
+        window.drop_down_list.currentIndexChanged.connect(self._onEventSelected)
+        window.toggle_axis.toggled.connect(self._onAxisToggled)
+        for name, checkbox in window.subDetector_checkboxes.items():
+            checkbox.toggled.connect(lambda checked, name=name: self._record("layer", name=name, visible=checked))
+        # Clicks on a group header (the children are then set with their signals blocked, so not recorded twice)
+        for name, checkbox in window.group_checkboxes.items():
+            checkbox.clicked.connect(lambda checked, name=name: self._record("group", name=name, checked=checked))
+        QApplication.instance().aboutToQuit.connect(self.close)
+
+    # (Public) Stop recording and close the file
+    @Slot()
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            print(f"Recorded {self.n_records} interactions to {self.path}")
+
+    def _record(self, record_type: str, **values):
+        if self._file is None:
+            return
+        self._write({"t": round(time.perf_counter() - self._start_time, 4), "type": record_type, **values})
+        self.n_records += 1
+
+    def _write(self, record: dict):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+
+    @Slot()
+    def _onCameraChanged(self):
+        self._record("camera", **self.mainStage.cameraState())
+
+    @Slot(int)
+    def _onEventSelected(self, row: int):
+        self._record("event", event=self.window.event_list_model.eventNumberAt(row))
+
+    @Slot(bool)
+    def _onAxisToggled(self, checked: bool):
+        self._record("axis", visible=checked)
+
+
+class InteractionReplayer(QObject):
+    """
+    Replays a file written by InteractionRecorder against the window, once the data is loaded (start), and
+    measures every frame, for frame-time regression tests (e.g. python launch.py --replay session.jsonl, on the
+    offscreen platform).
+
+    The replay is deterministic: the records are applied in order, regardless of their recorded times, through
+    the same window and main stage methods as the user input, and each one is followed by one frame drawn
+    synchronously. For each record, the time to apply it (e.g. reading and uploading an event) and the time
+    of its frame are kept; the results (percentiles per record type, the per-frame list, and the frame
+    statistics of the main stage with the GPU times) are written to a JSON file and the application quits.
+    """
+    def __init__(self, window, path: str, output_path: str, repeats: int = 1, quit_when_done: bool = True):
+        super().__init__()
+        self.window = window
+        self.mainStage: MainStage = window.mainStageWidget
+        self.path = path
+        self.output_path = output_path
+        self.repeats = repeats
+        self.quit_when_done = quit_when_done
+        self.header, self.records = self.load(path)
+        self.frames = []                # {"repeat", "record": index, "type", "action_ms", "frame_ms", "low_detail"} per frame
+        # Same window size as when recording (the main stage size is matched once laid out, see _restoreStageSize)
+        window.resize(*self.header["window_size"])
+
+    # (Public) Return (header, records) of a recorded file, raises ValueError if it is not one
+    @staticmethod
+    def load(path: str):
+        with open(path) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        if not lines or lines[0].get("format") != InteractionRecorder.format_name:
+            raise ValueError(f"{path} is not a recorded interaction file")
+        if lines[0].get("version") != InteractionRecorder.format_version:
+            raise ValueError(f"{path}: unsupported interaction file version {lines[0].get('version')}")
+        return lines[0], lines[1:]
+
+    # (Public) Replay the records (call once the geometry and the events are loaded)
+    @Slot()
+    def start(self):
+        # Let the pending repaints and loading messages go through first
+        QTimer.singleShot(0, self._replay)
+
+    @Slot(str)
+    def abort(self, message: str):
+        print(f"Replay aborted: {message}")
+        if self.quit_when_done:
+            QApplication.instance().exit(1)
+
+    def _replay(self):
+        recorded_args = self.header.get("launch_args", [])
+        if recorded_args != sys.argv[1:]:
+            print(f"Note: recorded with the arguments {' '.join(recorded_args)}")
+        self._restoreStageSize()
+        self.mainStage.setFrameStatsEnabled(True)
+        self.mainStage.setCameraState(self.header["camera"])
+        self._drawFrame()
+        print(f"Replaying {len(self.records)} interactions from {self.path} ({self.repeats} time(s))...")
+        start_time = time.perf_counter()
+        for repeat in range(self.repeats):
+            for record_idx, record in enumerate(self.records):
+                action_start = time.perf_counter()
+                self._apply(record)
+                action_ms = (time.perf_counter() - action_start) * 1e3
+                low_detail = self.mainStage.lod_enabled and self.mainStage.interacting
+                self.frames.append({"repeat": repeat, "record": record_idx, "type": record["type"], "action_ms": action_ms,
+                                    "frame_ms": self._drawFrame(), "low_detail": low_detail})
+        elapsed = time.perf_counter() - start_time
+        self.mainStage.flushFrameStats()
+        results = self.results()
+        with open(self.output_path, "w") as f:
+            json.dump(results, f, indent=1)
+        print(f"Replayed {len(self.frames)} frames in {elapsed:.2f} s, frame times written to {self.output_path}")
+        for record_type, percentiles in results["frame_ms"].items():
+            print(f"    {record_type:<8} {percentiles['count']:6d} frames   p50 {percentiles['p50']:7.2f} ms   "
+                  f"p95 {percentiles['p95']:7.2f} ms   p99 {percentiles['p99']:7.2f} ms")
+        if self.quit_when_done:
+            QApplication.instance().quit()
+
+    def _restoreStageSize(self):
+        # Same main stage size as when recording, so that the frames cover as many pixels: the side panels may not
+        # take the same room (style, fonts), the window is resized by the difference
+        stage_size = self.header["stage_size"]
+        width_difference, height_difference = stage_size[0] - self.mainStage.width(), stage_size[1] - self.mainStage.height()
+        if width_difference != 0 or height_difference != 0:
+            self.window.resize(self.window.width() + width_difference, self.window.height() + height_difference)
+            QApplication.processEvents()
+        if [self.mainStage.width(), self.mainStage.height()] != stage_size:
+            print(f"Warning: replaying on a {self.mainStage.width()}x{self.mainStage.height()} main stage, recorded on "
+                  f"{stage_size[0]}x{stage_size[1]}: the frame times are not comparable with the recording")
+
+    # Apply a record through the window, as the user input would
+    def _apply(self, record: dict):
+        record_type = record["type"]
+        if record_type == "camera":
+            self.mainStage.setCameraState(record)
+        elif record_type == "event":
+            evtnum = record["event"]
+            row = 0 if evtnum is None else self.window.event_list_model.rowOfEvent(evtnum)
+            if row is not None:
+                self.window.drop_down_list.setCurrentIndex(row)
+            else:
+                # Not in the list (e.g. another query): shown directly
+                self.mainStage.changeEventDisplay(evtnum)
+        elif record_type == "layer":
+            self.window.subDetector_checkboxes[record["name"]].setChecked(record["visible"])
+        elif record_type == "group":
+            self.window.on_group_toggled(record["name"], record["checked"])
+        elif record_type == "axis":
+            self.window.toggle_axis.setChecked(record["visible"])
+        else:
+            print(f"Replay: unknown record type {record_type}, skipped")
+
+    def _drawFrame(self) -> float:
+        # Draw synchronously (repaint, not the coalesced update), including the wait for the GPU
+        start_time = time.perf_counter()
+        self.mainStage.repaint()
+        if self.mainStage.isValid():
+            self.mainStage.makeCurrent()
+            self.mainStage.context().functions().glFinish()
+            self.mainStage.doneCurrent()
+        return (time.perf_counter() - start_time) * 1e3
+
+    # (Public) Frame-time percentiles per record type (and for all records), the frames, and the main stage frame statistics
+    def results(self) -> dict:
+        frame_ms = {}
+        for record_type in ["all"] + sorted({frame["type"] for frame in self.frames}):
+            frames = [frame for frame in self.frames if record_type == "all" or frame["type"] == record_type]
+            frame_ms[record_type] = self._percentiles([frame["frame_ms"] for frame in frames])
+        action_ms = {record_type: self._percentiles([frame["action_ms"] for frame in self.frames if frame["type"] == record_type])
+                     for record_type in sorted({frame["type"] for frame in self.frames})}
+        frame_stats = self.mainStage.frameStats
+        return {"recording": self.path, "launch_args": sys.argv[1:], "n_records": len(self.records), "repeats": self.repeats,
+                "stage_size": [self.mainStage.width(), self.mainStage.height()], "recorded_stage_size": self.header["stage_size"],
+                "frame_ms": frame_ms, "action_ms": action_ms,
+                "frame_stats": frame_stats.summary() if frame_stats is not None else None,
+                "gl_info": frame_stats.gl_info if frame_stats is not None else {},
+                "frames": self.frames}
+
+    @staticmethod
+    def _percentiles(values: list) -> dict:
+        if not values:
+            return {"count": 0}
+        values = np.asarray(values)
+        return {"count": len(values), "mean": float(values.mean()), "p50": float(np.percentile(values, 50)),
+                "p90": float(np.percentile(values, 90)), "p95": float(np.percentile(values, 95)),
+                "p99": float(np.percentile(values, 99)), "max": float(values.max())}
@@ -1,16 +1,33 @@
+import time
+import numpy as np
 from OpenGL.GL import *
 from OpenGL.GLU import *
 from PySide6.QtOpenGLWidgets import QOpenGLWidget
-from PySide6.QtCore import Qt, QPoint
+from PySide6.QtCore import Qt, QPoint, QTimer, Signal
+from PySide6.QtGui import QPainter, QFont, QColor
 
 from controllers.Renderable import Axis
 from controllers.CalorimeterController import SubDetectorController
 from controllers.EventController import EventController
+from controllers.EventOverlayController import EventOverlayController
 from presenters.Scene import Scene
+from instrumentation.Profiler import profiler
+from instrumentation.FrameStats import FrameStats, GpuTimer
 
 
 class MainStage(QOpenGLWidget):
-    def __init__(self, scene:Scene, axis:Axis, subDetectorControllers:dict[str, SubDetectorController], eventController: EventController, parent=None):
+    # Emitted at the end of every paintGL
+    frameRendered = Signal()
+    # Emitted after a click on the stage: dict describing the picked cell (see pickCell), or None
+    cellPicked = Signal(object)
+    # Emitted when a geometry colour mode needs the cell occupancy, which is then given with setCellOccupancy
+    occupancyRequested = Signal()
+    # Emitted after every change of the camera (rotation, panning, zoom, reset, end of the interaction)
+    cameraChanged = Signal()
+    
+    # Sub-detector and event controllers can be given later (see addSubDetectorController / setEventController),
+    # so that the window can be shown before the data is loaded
+    def __init__(self, scene:Scene, axis:Axis, subDetectorControllers:dict[str, SubDetectorController] = None, eventController: EventController = None, parent=None):
         super().__init__(parent)
         self.lastPos = QPoint()
         self.xRot = 0.0
@@ -21,22 +38,159 @@ class MainStage(QOpenGLWidget):
         self.cam_dist_init = 15
         self.translation_sensitivity = 0.03 # Adjust for desired panning speed
         
+        # Level of detail: while the camera is moved (drag or zoom), the calorimeter layers are drawn from their
+        # decimated subsets and repaints are paced to the display refresh rate; full detail is drawn again
+        # lod_restore_ms after the last camera input
+        self.lod_enabled = True
+        self.lod_restore_ms = 200
+        self.interacting = False
+        self.low_detail = False             # True while a low level-of-detail frame is painted (read by the renderables)
+        self._last_frame_time = 0.0
+        self._frame_timer = QTimer(self)
+        self._frame_timer.setSingleShot(True)
+        self._frame_timer.timeout.connect(self.update)
+        self._interaction_timer = QTimer(self)
+        self._interaction_timer.setSingleShot(True)
+        self._interaction_timer.timeout.connect(self._endInteraction)
+        
         self.axis = axis
         self.show_axis = True
         
-        self.subDetectorControllers = subDetectorControllers
-        self.subDetectorNames = list(subDetectorControllers.keys())
+        self.subDetectorControllers = {}
+        self.subDetectorNames = []
         self.subDetector_visibilities = {}
-        for name in self.subDetectorNames:
-            self.subDetector_visibilities[name] = True
         
-        self.eventController = eventController
+        self.eventController = None
+        self.pendingEventNumber = None      # Event selected before the event controller was available
+        self.overlayController = None       # Hit cells of many events at once (see setOverlayEvents), made with the event controller
+        self.overlayColorMode = "cluster"   # Colour of the overlaid cells, "cluster" or "event"
+        # Colours of the calorimeter layers: "layer" (one colour per layer), or the occupancy accumulated over all
+        # events, "hits" (hit count per cell) or "energy" (summed energy per cell), on a log scale
+        self.calorimeterController = None
+        self.geometryColorMode = "layer"
+        self.cellOccupancy = None
+        # Per-event summaries for the event queries, computed in the background once the events are loaded (see queryEvents)
+        self.eventSummary = None
+        self.cellColorMode = ("cluster", "linear", "viridis")  # (mode, scale, colormap) of the hit cells, see EventController.setColorMode
+        # Cells drawn as volumes (boxes/wedges from their extents) rather than points: outlines for the calorimeter
+        # layers, filled for the event hit cells (see setCellVolumesEnabled)
+        self.show_cell_volumes = False
+        
+        # Mouse picking: a click (press and release without dragging) picks the closest cell within
+        # pick_radius_px of the cursor, event hit cells first, then geometry cells of the visible layers
+        self.calorimeterManager = None      # Given once the geometry is loaded (see setCalorimeterManager)
+        self.fov_y = 45.0
+        self.pick_radius_px = 6
+        self.pickedCellCoord = None         # (x, y, z) of the picked cell, highlighted
+        self._pressPos = QPoint()
         
+        # Frame-time statistics (see setFrameStatsEnabled): FPS, CPU and GPU time of each frame and of each renderable,
+        # shown on the optional HUD (setHudVisible) and written with dumpFrameStats
+        self.frameStats = None
+        self.show_hud = False
+        self._gpuTimer = None
+        self._modelview_matrix = None       # Matrices of the last frame, to cast rays from the mouse position
+        self._projection_matrix = None
+        
+        # Renderables by key ("axis", "layer:<name>", "event", "overlay"); any change of the scene schedules a repaint
         self.scene = scene
-        self.scene.add(axis)
-        for controller in self.subDetectorControllers.values():
-            self.scene.add(controller)
-        self.scene.add(eventController)
+        self.scene.redraw_callback = self.update
+        self.scene.add(axis, "axis")
+        for name, controller in (subDetectorControllers or {}).items():
+            self.addSubDetectorController(name, controller)
+        if eventController is not None:
+            self.setEventController(eventController)
+        
+    def addSubDetectorController(self, name: str, controller: SubDetectorController):
+        self.subDetectorControllers[name] = controller
+        if name not in self.subDetectorNames:
+            self.subDetectorNames.append(name)
+        # Keep a visibility that was set on the layer before it was loaded
+        if self.subDetector_visibilities.setdefault(name, True):
+            self.scene.add(controller, f"layer:{name}")
+        self.update()
+        
+    def setCalorimeterManager(self, calorimeterManager):
+        self.calorimeterManager = calorimeterManager
+        if self.show_cell_volumes and not calorimeterManager.hasCellExtents():
+            print("MainStage: the geometry file has no cell extents, the cells are drawn as points")
+            self.show_cell_volumes = False
+        if self.overlayController is not None:
+            self.overlayController.setCalorimeterManager(calorimeterManager)
+        self._applyCellVolumes()
+        
+    def setCalorimeterController(self, calorimeterController):
+        self.calorimeterController = calorimeterController
+        self._applyGeometryColors()
+        self._applyCellVolumes()
+        
+    # (Public) Draw the calorimeter cells as the outlines of their volumes and the hit cells as filled volumes (see
+    # CalorimeterManager.getCellVolumes), or both as points; applied to the geometry and events once they are loaded.
+    # Raises ValueError if the loaded geometry has no cell extents (volumes enabled before that are turned off on load)
+    def setCellVolumesEnabled(self, enabled: bool):
+        if enabled and self.calorimeterManager is not None and not self.calorimeterManager.hasCellExtents():
+            raise ValueError("The geometry file has no cell extents, the cells cannot be drawn as volumes")
+        self.show_cell_volumes = enabled
+        self._applyCellVolumes()
+        
+    def _applyCellVolumes(self):
+        if self.calorimeterController is not None and self.calorimeterController.show_volumes != self.show_cell_volumes:
+            self.calorimeterController.showCellVolumes(self.show_cell_volumes)
+        if self.eventController is not None and self.calorimeterManager is not None:
+            cell_volumes = self.calorimeterManager.getCellVolumes() if self.show_cell_volumes else None
+            if self.eventController.cell_volumes is not cell_volumes:
+                self.eventController.setCellVolumes(cell_volumes)
+        self.update()
+        
+    # (Public) Colour the calorimeter cells by layer ("layer") or by cross-event occupancy ("hits" or "energy"); the occupancy
+    # is requested (occupancyRequested) the first time it is needed. Raises ValueError if the energies are not loaded.
+    def setGeometryColorMode(self, mode: str):
+        if mode not in ("layer", "hits", "energy"):
+            raise ValueError(f"Unknown geometry colour mode {mode} (layer, hits or energy)")
+        if mode == "energy" and self.eventController is not None and not self.eventController.eventManager.load_energies:
+            raise ValueError("Cell energies are not loaded (launch with --energies to sum the cell energies)")
+        self.geometryColorMode = mode
+        if mode != "layer" and self.cellOccupancy is None:
+            self.occupancyRequested.emit()
+        self._applyGeometryColors()
+        
+    def setCellOccupancy(self, cellOccupancy):
+        self.cellOccupancy = cellOccupancy
+        self._applyGeometryColors()
+        
+    def _applyGeometryColors(self):
+        if self.calorimeterController is None:
+            return
+        occupancy = self.cellOccupancy
+        if self.geometryColorMode == "hits" and occupancy is not None:
+            self.calorimeterController.showCellValues(occupancy.hit_counts, scale="log")
+        elif self.geometryColorMode == "energy" and occupancy is not None and occupancy.energy_sums is not None:
+            self.calorimeterController.showCellValues(occupancy.energy_sums, scale="log")
+        else:
+            self.calorimeterController.showCellValues(None)
+        self.update()
+        
+    def setEventController(self, eventController: EventController):
+        self.eventController = eventController
+        self.scene.add(eventController, "event")
+        self.overlayController = EventOverlayController(eventController.eventManager)
+        self.overlayController.setColorMode(self.overlayColorMode)
+        if self.calorimeterManager is not None:
+            self.overlayController.setCalorimeterManager(self.calorimeterManager)
+        self.scene.add(self.overlayController, "overlay")
+        # Hit cells of the layers hidden so far are hidden too
+        for name, visible in self.subDetector_visibilities.items():
+            self.eventController.setLayerVisibility(name, visible)
+            self.overlayController.setLayerVisibility(name, visible)
+        try:
+            self.eventController.setColorMode(*self.cellColorMode)
+        except ValueError as e:
+            print(f"MainStage: {e}")
+        self._applyCellVolumes()
+        if self.pendingEventNumber is not None:
+            self.eventController.updateTargetEventDisplay(self.pendingEventNumber)
+            self.pendingEventNumber = None
+        self.update()
         
     # =====================================================================
     # Basic camera/interactive window controls
@@ -52,12 +206,20 @@ class MainStage(QOpenGLWidget):
         glViewport(0, 0, w, h)
         glMatrixMode(GL_PROJECTION)
         glLoadIdentity()
-        gluPerspective(45.0, w/h, 0.1, 100.0)
+        gluPerspective(self.fov_y, w/h, 0.1, 100.0)
         glMatrixMode(GL_MODELVIEW)
         
     
     def mousePressEvent(self, event):
         self.lastPos = event.position().toPoint() if hasattr(event, 'position') else event.pos()
+        self._pressPos = self.lastPos
+        
+    def mouseReleaseEvent(self, event):
+        pos = event.position().toPoint() if hasattr(event, 'position') else event.pos()
+        # A click without dragging picks a cell
+        if event.button() == Qt.LeftButton and (pos - self._pressPos).manhattanLength() <= 3:
+            self.cellPicked.emit(self.pickCell(pos.x(), pos.y()))
+            self.update()
         
     def mouseMoveEvent(self, event):
         pos = event.position().toPoint() if hasattr(event, 'position') else event.pos()
@@ -66,17 +228,39 @@ class MainStage(QOpenGLWidget):
         if event.buttons() & Qt.LeftButton:
             self.xRot += dy
             self.yRot += dx
-            self.update()
+            self._onCameraMoved()
         elif event.buttons() & Qt.MiddleButton:
             effective_sensitivity = self.translation_sensitivity / self.zoom
             self.xTrans += dx * effective_sensitivity
             self.yTrans -= dy * effective_sensitivity # Screen Y is inverted relative to OpenGL Y
-            self.update()
+            self._onCameraMoved()
         self.lastPos = pos
         
     def wheelEvent(self, event):
         delta = event.angleDelta().y() / 360 
         self.zoom = max(0.1, min(self.zoom + delta*0.1, 10.0))
+        self._onCameraMoved()
+        
+    def _onCameraMoved(self):
+        # Enter (or stay in) the interaction mode, full detail is restored once the inputs stop
+        self.interacting = True
+        self._interaction_timer.start(self.lod_restore_ms)
+        self.cameraChanged.emit()
+        
+        # Coalesce the repaints to the display refresh rate: input events can come much faster than frames
+        if self._frame_timer.isActive():
+            return
+        screen = self.screen()
+        refresh_rate = screen.refreshRate() if screen is not None and screen.refreshRate() > 0 else 60.0
+        wait = self._last_frame_time + 1.0 / refresh_rate - time.perf_counter()
+        if wait <= 0:
+            self.update()
+        else:
+            self._frame_timer.start(int(wait * 1000) + 1)
+        
+    def _endInteraction(self):
+        self.interacting = False
+        self.cameraChanged.emit()
         self.update()
         
     def resetCamera(self):
@@ -87,6 +271,21 @@ class MainStage(QOpenGLWidget):
         self.xTrans = 0.0
         self.yTrans = 0.0
         self.cam_dist_init = 15
+        self.cameraChanged.emit()
+        self.update()
+        
+    # (Public) Camera state (rotations, zoom, panning) and whether the camera is being moved (low level of detail)
+    def cameraState(self) -> dict:
+        return {"xRot": self.xRot, "yRot": self.yRot, "zoom": self.zoom, "xTrans": self.xTrans, "yTrans": self.yTrans,
+                "interacting": self.interacting}
+        
+    # (Public) Set the camera from a cameraState() (e.g. replaying recorded interactions); the interaction mode is
+    # taken as given, without the timer ending it
+    def setCameraState(self, state: dict):
+        self.xRot, self.yRot, self.zoom = state["xRot"], state["yRot"], state["zoom"]
+        self.xTrans, self.yTrans = state["xTrans"], state["yTrans"]
+        self._interaction_timer.stop()
+        self.interacting = state.get("interacting", False)
         self.update()
         
     # ==============================================================================================
@@ -94,6 +293,21 @@ class MainStage(QOpenGLWidget):
         
     # Render objects on scene, and controls over how it supposed to be rendered on scene
     def paintGL(self):
+        frame_start = time.perf_counter()
+        self._last_frame_time = frame_start
+        self.low_detail = self.lod_enabled and self.interacting
+        if self.frameStats is not None:
+            self._gpuTimer.beginFrame()
+        with profiler.span("paintGL.low_detail" if self.low_detail else "paintGL"):
+            self._paintScene()
+        if self.frameStats is not None:
+            self._gpuTimer.endFrame()
+            self._addFrameStats(frame_start, (time.perf_counter() - frame_start) * 1e3)
+            if self.show_hud:
+                self._render_hud()
+        self.frameRendered.emit()
+        
+    def _paintScene(self):
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
         glLoadIdentity()
         
@@ -105,12 +319,141 @@ class MainStage(QOpenGLWidget):
         glRotatef(self.xRot, 1.0, 0.0, 0.0)
         glRotatef(self.yRot, 0.0, 1.0, 0.0)
         
+        # Kept to turn mouse positions into rays (OpenGL returns column-major matrices)
+        self._modelview_matrix = np.array(glGetDoublev(GL_MODELVIEW_MATRIX)).reshape(4, 4).T
+        self._projection_matrix = np.array(glGetDoublev(GL_PROJECTION_MATRIX)).reshape(4, 4).T
+        if self.frameStats is not None:
+            self._gpuTimer.mark("clear")
+        
         self.scene.render_all(self)
+        self._render_picked_cell()
+        
+    def _render_picked_cell(self):
+        if self.pickedCellCoord is None:
+            return
+        glPointSize(14.0)
+        glColor3f(1.0, 0.9, 0.0)
+        glBegin(GL_POINTS)
+        glVertex3f(*self.pickedCellCoord)
+        glEnd()
+        
+    # =====================================================================
+    # Frame-time statistics and HUD
+    
+    # (Public) Collect the frame times (FrameStats), including the GPU times when timer queries are available
+    def setFrameStatsEnabled(self, enabled: bool):
+        if enabled and self.frameStats is None:
+            self.frameStats = FrameStats()
+            self._gpuTimer = GpuTimer()
+            self.scene.gpu_timer = self._gpuTimer
+        elif not enabled and self.frameStats is not None:
+            self.show_hud = False
+            if self.context() is not None:
+                self.makeCurrent()
+                self._gpuTimer.release()
+                self.doneCurrent()
+            self.frameStats = None
+            self._gpuTimer = None
+            self.scene.gpu_timer = None
+        self.scene.collect_timings = enabled
+        self.update()
+        
+    # (Public) Show the frame times (FPS, CPU/GPU time per frame and of the costliest renderables) over the stage;
+    # frame times are collected from then on
+    def setHudVisible(self, visible: bool):
+        if visible:
+            self.setFrameStatsEnabled(True)
+        self.show_hud = visible
+        self.update()
+        
+    # (Public) Write the frame-time statistics and histograms to a JSON file (see FrameStats.dump), False if not collected.
+    # The GPU times of the last frames are collected first (see flushFrameStats).
+    def dumpFrameStats(self, path: str) -> bool:
+        if self.frameStats is None:
+            return False
+        self.flushFrameStats()
+        self.frameStats.dump(path)
+        return True
+        
+    # (Public) Wait for the GPU to finish the frames drawn so far and add their GPU times
+    def flushFrameStats(self):
+        if self.frameStats is None or not self.isValid():
+            return
+        self.makeCurrent()
+        glFinish()
+        for gpu_ms, renderable_gpu_ms in self._gpuTimer.collect():
+            self.frameStats.addGpuFrame(gpu_ms, renderable_gpu_ms)
+        self.doneCurrent()
+        
+    def _addFrameStats(self, frame_start: float, cpu_ms: float):
+        if not self.frameStats.gl_info:
+            self.frameStats.gl_info = {name: (glGetString(constant) or b"").decode(errors="replace")
+                                       for name, constant in (("gl_renderer", GL_RENDERER), ("gl_version", GL_VERSION), ("gl_vendor", GL_VENDOR))}
+            self.frameStats.gl_info["gpu_timer_queries"] = bool(self._gpuTimer.supported)
+        self.frameStats.addFrame(frame_start, cpu_ms, self.scene.last_frame_timings)
+        # GPU times of earlier frames, once the GPU is done with them
+        for gpu_ms, renderable_gpu_ms in self._gpuTimer.collect():
+            self.frameStats.addGpuFrame(gpu_ms, renderable_gpu_ms)
+        
+    def _render_hud(self):
+        lines = self.frameStats.hudLines()
+        painter = QPainter(self)
+        try:
+            font = QFont("Monospace", 9)
+            font.setStyleHint(QFont.TypeWriter)
+            painter.setFont(font)
+            line_height = painter.fontMetrics().height()
+            width = max(painter.fontMetrics().horizontalAdvance(line) for line in lines) + 12
+            painter.fillRect(4, 4, width, line_height * len(lines) + 8, QColor(0, 0, 0, 150))
+            painter.setPen(Qt.white)
+            for line_idx, line in enumerate(lines):
+                painter.drawText(10, 8 + line_height * line_idx + painter.fontMetrics().ascent(), line)
+        finally:
+            painter.end()
+        
+    # =====================================================================
+    # Mouse picking
+    
+    # (Public) Return (origin, direction) in world coordinates of the ray through a widget position, None before the first frame
+    def rayFromWidgetPosition(self, x: float, y: float):
+        if self._modelview_matrix is None or self.width() == 0 or self.height() == 0:
+            return None
+        ndc_x = 2.0 * x / self.width() - 1.0
+        ndc_y = 1.0 - 2.0 * y / self.height()
+        inverse_modelview = np.linalg.inv(self._modelview_matrix)
+        far_point = inverse_modelview @ np.linalg.inv(self._projection_matrix) @ np.array([ndc_x, ndc_y, 1.0, 1.0])
+        eye = inverse_modelview @ np.array([0.0, 0.0, 0.0, 1.0])
+        origin = eye[:3] / eye[3]
+        return origin, far_point[:3] / far_point[3] - origin
+        
+    # (Public) Return a dict describing the cell under a widget position (cell_id, layer, x, y, z, eta, phi,
+    # plus event and cluster for a hit cell), or None. Hidden layers are skipped.
+    def pickCell(self, x: float, y: float):
+        start_time = time.perf_counter()
+        ray = self.rayFromWidgetPosition(x, y)
+        info = None
+        if ray is not None:
+            origin, direction = ray
+            # Angle seen by pick_radius_px pixels at the centre of the view
+            max_angle = self.pick_radius_px * 2 * np.tan(np.radians(self.fov_y) / 2) / self.height()
+            if self.eventController is not None:
+                info = self.eventController.pickHitCell(origin, direction, max_angle)
+            if info is None and self.calorimeterManager is not None:
+                visible_layers = [self.subDetector_visibilities.get(name, True) and name in self.subDetectorControllers
+                                  for name in self.calorimeterManager.layer_namelist]
+                picked = self.calorimeterManager.getCellSpatialIndex().pickRay(origin, direction, max_angle, visible_layers)
+                if picked is not None:
+                    info = self.calorimeterManager.getCellInfo(picked[0])
+        
+        self.pickedCellCoord = (info["x"], info["y"], info["z"]) if info is not None else None
+        if info is not None:
+            info["pick_ms"] = (time.perf_counter() - start_time) * 1e3
+        return info
         
     def set_axis_visibility(self, visible: bool):
         self.show_axis = visible
         if self.show_axis:
-            self.scene.add(self.axis)
+            self.scene.add(self.axis, "axis")
         else:
             self.scene.remove(self.axis)
             
@@ -119,17 +462,75 @@ class MainStage(QOpenGLWidget):
 
     def set_sub_detector_visibility(self, name: str, visible: bool):
         self.subDetector_visibilities[name] = visible
+        # The hit cells of the event in this layer follow the layer visibility
+        if self.eventController is not None:
+            self.eventController.setLayerVisibility(name, visible)
+            self.overlayController.setLayerVisibility(name, visible)
+            self.update()
+        if name not in self.subDetectorControllers:
+            # Layer not loaded yet, the visibility is applied when it is added
+            return
         if visible:
-            self.scene.add(self.subDetectorControllers[name])
+            self.scene.add(self.subDetectorControllers[name], f"layer:{name}")
         else:
             self.scene.remove(self.subDetectorControllers[name])
 
         self.update()
         
+    # (Public) Colour the hit cells by cluster or by energy (see EventController.setColorMode), raises ValueError if not possible
+    def setCellColorMode(self, mode: str, scale: str = "linear", colormap: str = "viridis"):
+        if self.eventController is not None:
+            self.eventController.setColorMode(mode, scale, colormap)
+        self.cellColorMode = (mode, scale, colormap)
+        self.update()
+        
+    # (Public) Overlay the hit cells and truth trajectories of these events (in one buffer, see EventOverlayController),
+    # only the events that were not overlaid yet are read. Returns False while the events are not loaded.
+    def setOverlayEvents(self, eventNumbers: list[int]) -> bool:
+        if self.overlayController is None:
+            return False
+        self.overlayController.setEvents(eventNumbers)
+        self.update()
+        return True
+        
+    # (Public) Colour the overlaid cells by "cluster" or by "event", raises ValueError for another mode
+    def setOverlayColorMode(self, mode: str):
+        if self.overlayController is not None:
+            self.overlayController.setColorMode(mode)
+        elif mode not in ("cluster", "event"):
+            raise ValueError(f"Unknown overlay colour mode {mode} (cluster or event)")
+        self.overlayColorMode = mode
+        self.update()
+        
+    def clearOverlay(self):
+        if self.overlayController is not None:
+            self.overlayController.clear()
+            self.update()
+        
     def changeEventDisplay(self, eventNumber: int):
+        if self.eventController is None:
+            self.pendingEventNumber = eventNumber
+            return
         self.eventController.updateTargetEventDisplay(eventNumber)
+        self.pickedCellCoord = None
         self.update()
         
+    def setEventSummary(self, eventSummary):
+        self.eventSummary = eventSummary
+        
+    # (Public) Return the sorted event numbers (np.ndarray) passing a query over the per-event summaries (see EventSummary),
+    # e.g. "1.3 <= eta <= 1.6 and n_clusters >= 3", or None while the summaries are not given (see setEventSummary).
+    # Raises ValueError for an invalid query.
+    def queryEvents(self, expression: str):
+        if self.eventSummary is None:
+            return None
+        with profiler.span("events.query"):
+            return self.eventSummary.query(expression)
+        
     def resetEventDisplay(self):
+        self.pendingEventNumber = None
+        if self.eventController is None:
+            return
         self.eventController.reset()
+        self.pickedCellCoord = None
         self.update()
\ No newline at end of file
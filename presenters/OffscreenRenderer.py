@@ -0,0 +1,87 @@
+from OpenGL.GL import *
+from OpenGL.GLU import *
+from PySide6.QtCore import QSize
+from PySide6.QtGui import QImage, QOffscreenSurface, QOpenGLContext, QSurfaceFormat
+from PySide6.QtOpenGL import QOpenGLFramebufferObject, QOpenGLFramebufferObjectFormat, QOpenGLPaintDevice
+
+from presenters.Scene import Scene
+from instrumentation.Profiler import profiler
+
+
+class OffscreenRenderer(QOpenGLPaintDevice):
+    """
+    Renders a Scene to images without a window (e.g. Qt offscreen platform with software OpenGL).
+
+    An offscreen surface, an OpenGL context and a framebuffer object (with a depth buffer) take the place
+    of the QOpenGLWidget of MainStage; the GL state and the camera parameters are the same as on the main
+    stage, so the renderables (calorimeter layers, event controller, axis) are drawn unchanged. The renderer
+    is also the paint device of the frame, for the renderables that draw with a QPainter (axis labels).
+    A QGuiApplication must exist before it is created.
+    """
+    def __init__(self, scene: Scene, width: int = 800, height: int = 600, samples: int = 0):
+        super().__init__(QSize(width, height))
+        self.scene = scene
+        self.frame_width = width
+        self.frame_height = height
+
+        # Camera, as on MainStage
+        self.xRot = 0.0
+        self.yRot = 0.0
+        self.zoom = 1.0
+        self.xTrans = 0.0
+        self.yTrans = 0.0
+        self.cam_dist_init = 15
+        self.fov_y = 45.0
+        self.low_detail = False     # Always full detail (read by the renderables)
+
+        surface_format = QSurfaceFormat()
+        surface_format.setDepthBufferSize(24)
+        self.surface = QOffscreenSurface()
+        self.surface.setFormat(surface_format)
+        self.surface.create()
+        self.context = QOpenGLContext()
+        self.context.setFormat(surface_format)
+        if not self.context.create() or not self.context.makeCurrent(self.surface):
+            raise RuntimeError("Could not create an OpenGL context for offscreen rendering "
+                               "(run with QT_QPA_PLATFORM=offscreen and a software OpenGL, e.g. LIBGL_ALWAYS_SOFTWARE=1)")
+
+        framebuffer_format = QOpenGLFramebufferObjectFormat()
+        framebuffer_format.setAttachment(QOpenGLFramebufferObject.CombinedDepthStencil)
+        framebuffer_format.setSamples(samples)
+        self.framebuffer = QOpenGLFramebufferObject(width, height, framebuffer_format)
+
+    # (Public) Draw the scene with the current camera and return the frame
+    def render(self) -> QImage:
+        self.context.makeCurrent(self.surface)
+        self.framebuffer.bind()
+        with profiler.span("offscreen.render"):
+            self._paintScene()
+            glFinish()
+            image = self.framebuffer.toImage()
+        self.framebuffer.release()
+        return image
+
+    def _paintScene(self):
+        # GL state of MainStage.initializeGL, set on every frame since QPainter (axis labels) may change it
+        glClearColor(0.8, 0.8, 0.8, 1.0)
+        glEnable(GL_DEPTH_TEST)
+        glEnable(GL_CULL_FACE)
+        glEnable(GL_POINT_SMOOTH)
+
+        glViewport(0, 0, self.frame_width, self.frame_height)
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        gluPerspective(self.fov_y, self.frame_width / self.frame_height, 0.1, 100.0)
+        glMatrixMode(GL_MODELVIEW)
+
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        glLoadIdentity()
+
+        # Same camera transform as MainStage._paintScene
+        glTranslatef(0.0, 0.0, -self.cam_dist_init)
+        glTranslatef(self.xTrans, self.yTrans, 0.0)
+        glScalef(self.zoom, self.zoom, self.zoom)
+        glRotatef(self.xRot, 1.0, 0.0, 0.0)
+        glRotatef(self.yRot, 0.0, 1.0, 0.0)
+
+        self.scene.render_all(self)
@@ -1,4 +1,8 @@
-from controllers.Renderable import Renderable
+import time
+from OpenGL.GL import *
+
+from controllers.Renderable import Renderable, DrawState
+from instrumentation.Profiler import profiler
 
 class Scene:
     """
@@ -6,19 +10,159 @@ class Scene:
 
     The Scene class is responsible for holding all objects that can be drawn
     (i.e., instances of classes implementing the Renderable interface).
+
+    Objects are kept in a registry by key (given to add, or the object itself), so that adding, removing and
+    looking them up cost O(1). When drawing, the objects are grouped by their DrawState (point size, line
+    width), each state being set once per group instead of by every object; the groups are drawn in the order
+    their first object was added. Cacheable objects (see Renderable) are recorded in a display list on their
+    first draw and replayed while their render key is unchanged, i.e. until they are marked dirty.
+    Changes of the scene (add, remove, markDirty) call redraw_callback, e.g. to schedule a repaint.
+
+    With collect_timings, the CPU time of each object (and of the parts of its render, see Renderable.renderParts,
+    when they are executed rather than replayed) is kept in last_frame_timings, and a GpuTimer (gpu_timer) is marked
+    after each object; objects are labelled by their key, or by their class when the key is not a string.
     """
     def __init__(self):
-        self._objects = []
-        
-    def add(self, obj:Renderable):
-        if obj not in self._objects:
-            self._objects.append(obj)
-        
-    def remove(self, obj:Renderable):
-        if obj in self._objects:
-            self._objects.remove(obj)
-        
+        self._objects = {}              # key -> Renderable, in the order they were added
+        self._keys = {}                 # id(Renderable) -> key
+        self._display_lists = {}        # key -> (display list, render key it was recorded with)
+        self._released_lists = []       # Display lists of removed objects, deleted on the next render_all (GL context current)
+        self.redraw_callback = None
+        # Counts of the last render_all: objects drawn, display lists replayed and recorded, draw state changes
+        self.last_frame_stats = {"objects": 0, "replayed": 0, "recorded": 0, "state_changes": 0}
+        # Optional per-object timings (see FrameStats): label -> CPU time [ms] of the last render_all
+        self.collect_timings = False
+        self.gpu_timer = None
+        self.last_frame_timings = {}
+
+    # (Public) Add an object under a key (default: the object itself) and return the key; an object already in the
+    # scene is kept under its key, an object added under the key of another one replaces it
+    def add(self, obj:Renderable, key=None):
+        if id(obj) in self._keys:
+            return self._keys[id(obj)]
+        key = obj if key is None else key
+        if key in self._objects:
+            self.remove(key)
+        self._objects[key] = obj
+        self._keys[id(obj)] = key
+        self._requestRedraw()
+        return key
+
+    # (Public) Remove an object, given by itself or by its key (nothing happens if it is not in the scene)
+    def remove(self, obj_or_key):
+        key = self._keys.get(id(obj_or_key), obj_or_key)
+        obj = self._objects.pop(key, None)
+        if obj is None:
+            return
+        del self._keys[id(obj)]
+        if key in self._display_lists:
+            self._released_lists.append(self._display_lists.pop(key)[0])
+        self._requestRedraw()
+
+    # (Public) Object of a key, None if there is none
+    def get(self, key):
+        return self._objects.get(key)
+
+    def __contains__(self, obj_or_key):
+        return id(obj_or_key) in self._keys or obj_or_key in self._objects
+
+    def __len__(self):
+        return len(self._objects)
+
+    # (Public) Tell the scene that an object (given by itself or by its key) draws something else, or that the scene
+    # needs to be drawn again (None)
+    def markDirty(self, obj_or_key=None):
+        if obj_or_key is not None:
+            obj = self._objects.get(self._keys.get(id(obj_or_key), obj_or_key))
+            if obj is not None:
+                obj.markDirty()
+        self._requestRedraw()
+
     def render_all(self, target_stage):
-        for obj in self._objects:
-            obj.render(target_stage)
-            
\ No newline at end of file
+        if self._released_lists:
+            for display_list in self._released_lists:
+                glDeleteLists(display_list, 1)
+            self._released_lists.clear()
+
+        stats = {"objects": len(self._objects), "replayed": 0, "recorded": 0, "state_changes": 0}
+        timings = {} if self.collect_timings else None
+        current_state = None
+        for draw_state, keyed_objects in self._groupByDrawState().items():
+            if draw_state is not None and draw_state != current_state:
+                self._applyDrawState(draw_state, current_state)
+                stats["state_changes"] += 1
+            for key, obj in keyed_objects:
+                if timings is None:
+                    self._renderObject(key, obj, target_stage, stats)
+                else:
+                    self._renderTimed(key, obj, target_stage, stats, timings)
+            # Objects without a draw state may have changed any state
+            current_state = draw_state
+        self.last_frame_stats = stats
+        self.last_frame_timings = timings if timings is not None else {}
+
+    # (Public) Drop all recorded display lists (e.g. before the GL context is destroyed, with it current)
+    def releaseCaches(self):
+        for display_list, _ in self._display_lists.values():
+            glDeleteLists(display_list, 1)
+        self._display_lists.clear()
+
+
+    def _groupByDrawState(self) -> dict:
+        groups = {}
+        for key, obj in self._objects.items():
+            groups.setdefault(obj.draw_state, []).append((key, obj))
+        return groups
+
+    @staticmethod
+    def _applyDrawState(draw_state: DrawState, current_state: DrawState):
+        if draw_state.point_size is not None and (current_state is None or current_state.point_size != draw_state.point_size):
+            glPointSize(draw_state.point_size)
+        if draw_state.line_width is not None and (current_state is None or current_state.line_width != draw_state.line_width):
+            glLineWidth(draw_state.line_width)
+
+    def _renderObject(self, key, obj: Renderable, target_stage, stats: dict, render=None):
+        render = obj.render if render is None else render
+        if obj.cacheable:
+            self._renderCached(key, obj, target_stage, stats, render)
+        else:
+            render(target_stage)
+
+    def _renderTimed(self, key, obj: Renderable, target_stage, stats: dict, timings: dict):
+        label = key if isinstance(key, str) else type(obj).__name__
+        def renderParts(target_stage):
+            for part, render_part in obj.renderParts():
+                part_start = time.perf_counter()
+                render_part(target_stage)
+                if part is not None:
+                    part_label = f"{label}.{part}"
+                    timings[part_label] = timings.get(part_label, 0.0) + (time.perf_counter() - part_start) * 1e3
+        start_time = time.perf_counter()
+        self._renderObject(key, obj, target_stage, stats, renderParts)
+        timings[label] = timings.get(label, 0.0) + (time.perf_counter() - start_time) * 1e3
+        if self.gpu_timer is not None:
+            self.gpu_timer.mark(label)
+
+    def _renderCached(self, key, obj: Renderable, target_stage, stats: dict, render):
+        render_key = obj.renderKey(target_stage)
+        cached = self._display_lists.get(key)
+        if cached is not None and cached[1] == render_key:
+            glCallList(cached[0])
+            stats["replayed"] += 1
+            return
+        display_list = cached[0] if cached is not None else glGenLists(1)
+        with profiler.span("scene.record"):
+            # Recorded, then replayed (GL_COMPILE_AND_EXECUTE is slow on some drivers)
+            glNewList(display_list, GL_COMPILE)
+            try:
+                render(target_stage)
+            finally:
+                glEndList()
+        self._display_lists[key] = (display_list, render_key)
+        glCallList(display_list)
+        stats["recorded"] += 1
+
+    def _requestRedraw(self):
+        if self.redraw_callback is not None:
+            self.redraw_callback()
+
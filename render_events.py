@@ -0,0 +1,195 @@
+"""
+Render events to PNG images without opening a window (thumbnails/galleries for review).
+
+Run from the repository root, e.g.:
+    python render_events.py -ef "database/pi0_*.root" -r 1000 2000 -o renders -j 8
+    python render_events.py -q "n_clusters >= 3 and n_cells > 200" -n 500 -o renders
+
+The events are split across a pool of worker processes. Each worker loads the geometry once (from the
+geometry cache), opens the event files in lazy mode (so it only reads its own events) and draws them
+with the same Scene, CalorimeterController and EventController as the interactive window, through an
+OffscreenRenderer (Qt offscreen platform, software OpenGL). The throughput is reported at the end.
+"""
+import os
+import io
+import sys
+import time
+import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from database import config as cfg
+from useCaseClasses.CalorimeterManager import CalorimeterManager
+from useCaseClasses.EventManager import EventManager
+
+
+# State of a worker process, set up once by _initWorker
+_worker = {}
+
+
+def _initWorker(options: dict):
+    # Qt must be configured before the application is created
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    os.environ.setdefault("LIBGL_ALWAYS_SOFTWARE", "1")
+    start_time = time.perf_counter()
+    try:
+        from PySide6.QtGui import QGuiApplication
+        from controllers.Renderable import Axis
+        from controllers.CalorimeterController import CalorimeterController
+        from controllers.EventController import EventController
+        from presenters.Scene import Scene
+        from presenters.OffscreenRenderer import OffscreenRenderer
+
+        app = QGuiApplication.instance() or QGuiApplication(sys.argv[:1])
+        with contextlib.redirect_stdout(io.StringIO()):
+            calorimeter_manager = CalorimeterManager(options["geometry_file"])
+            event_manager = EventManager(options["event_files"], options["tree_name"], options["branch_prefix"], lazy=True, cache_size=1,
+                                         calorimeter_manager=calorimeter_manager if options["cell_ids"] else None,
+                                         load_energies=options["color_mode"] == "energy")
+        calorimeter_controller = CalorimeterController(calorimeter_manager, lod_fraction=0)
+        event_controller = EventController(event_manager)
+        event_controller.setCalorimeterManager(calorimeter_manager)
+        event_controller.setColorMode(options["color_mode"], options["scale"], options["colormap"])
+        if options["cell_volumes"]:
+            calorimeter_controller.showCellVolumes(True)
+            event_controller.setCellVolumes(calorimeter_manager.getCellVolumes())
+
+        scene = Scene()
+        renderer = OffscreenRenderer(scene, options["width"], options["height"])
+        if options["axis"]:
+            scene.add(Axis())
+        for name, controller in calorimeter_controller.getAllSubDetector().items():
+            visible = name in options["layers"]
+            event_controller.setLayerVisibility(name, visible)
+            if visible:
+                scene.add(controller)
+        scene.add(event_controller)
+        renderer.xRot, renderer.yRot, renderer.zoom = options["x_rot"], options["y_rot"], options["zoom"]
+
+        _worker.update(app=app, event_manager=event_manager, event_controller=event_controller, renderer=renderer,
+                       output_dir=options["output_dir"], error=None)
+    except Exception as e:
+        _worker.update(error=f"{type(e).__name__}: {e}")
+    _worker["setup_seconds"] = time.perf_counter() - start_time
+
+
+# Render a chunk of events in a worker, return (pid, worker setup time, number of images, render time, failures, worker error)
+def _renderEvents(event_numbers: list[int]):
+    if _worker["error"] is not None:
+        return os.getpid(), _worker["setup_seconds"], 0, 0.0, [], _worker["error"]
+    start_time = time.perf_counter()
+    n_rendered, failures = 0, []
+    for evtnum in event_numbers:
+        try:
+            # Silence the per-event printout of the event controller
+            with contextlib.redirect_stdout(io.StringIO()):
+                _worker["event_controller"].updateTargetEventDisplay(evtnum)
+            image = _worker["renderer"].render()
+            if not image.save(os.path.join(_worker["output_dir"], f"event_{evtnum}.png")):
+                raise OSError("could not write the image")
+            n_rendered += 1
+        except Exception as e:
+            failures.append((evtnum, f"{type(e).__name__}: {e}"))
+    return os.getpid(), _worker["setup_seconds"], n_rendered, time.perf_counter() - start_time, failures, None
+
+
+def _selectEvents(args, event_numbers: list[int], event_manager: EventManager, calorimeter_manager) -> list[int]:
+    selected = event_numbers
+    if args.events is not None:
+        available = set(event_numbers)
+        missing = [evtnum for evtnum in args.events if evtnum not in available]
+        if missing:
+            print(f"Warning: {len(missing)} requested event(s) not in the event files: {missing[:10]}{' ...' if len(missing) > 10 else ''}")
+        selected = [evtnum for evtnum in args.events if evtnum in available]
+    if args.range is not None:
+        selected = [evtnum for evtnum in selected if args.range[0] <= evtnum < args.range[1]]
+    if args.query is not None:
+        matching = set(event_manager.getEventSummary(calorimeter_manager).query(args.query).tolist())
+        selected = [evtnum for evtnum in selected if evtnum in matching]
+    if args.max_events is not None:
+        selected = selected[:args.max_events]
+    return selected
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Render events of the ATLAS Calorimeter to PNG images without a window, with a process pool")
+    parser.add_argument('-ft', "--file_type", type=str, default="pi0", choices=["pi0", "pi+"], help="Choose event file type (pi0, pi+)")
+    parser.add_argument('-ef', "--event_files", type=str, nargs='+', default=None, help="Event file(s) or glob pattern(s), overrides --file_type")
+    parser.add_argument('-et', "--event_tree", type=str, default="EventTree", help="TTree name in the event file")
+    parser.add_argument('-cb', "--cell_coord_branch", type=str, default="mgex422_cluster_cell", help="TTree branch prefix of the cell coordinates in the event file")
+    parser.add_argument('-id', "--cell_ids", action="store_true", help="Read the cluster cells as cell IDs looked up in the geometry")
+    parser.add_argument('-gf', "--geometry_file", type=str, default="database/cell_geo+.root", help="Calorimeter geometry file")
+    parser.add_argument('-ev', "--events", type=int, nargs='+', default=None, help="Event numbers to render (default: all events)")
+    parser.add_argument('-r', "--range", type=int, nargs=2, default=None, metavar=("START", "STOP"), help="Only render the event numbers in [START, STOP)")
+    parser.add_argument('-q', "--query", type=str, default=None, help="Only render the events passing an event query, e.g. \"n_clusters >= 3 and n_cells > 200\"")
+    parser.add_argument('-n', "--max_events", type=int, default=None, help="Render at most this many events")
+    parser.add_argument('-o', "--output_dir", type=str, default="renders", help="Directory the images (event_<number>.png) are written to")
+    parser.add_argument('-j', "--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument('-cs', "--chunk_size", type=int, default=16, help="Number of events given to a worker at a time")
+    parser.add_argument("--width", type=int, default=800, help="Width of the images")
+    parser.add_argument("--height", type=int, default=600, help="Height of the images")
+    parser.add_argument('-rx', "--x_rot", type=float, default=0.0, help="Camera rotation around the X axis [deg]")
+    parser.add_argument('-ry', "--y_rot", type=float, default=0.0, help="Camera rotation around the Y axis [deg]")
+    parser.add_argument('-z', "--zoom", type=float, default=1.0, help="Camera zoom")
+    parser.add_argument('-l', "--layers", type=str, nargs='+', default=cfg.sub_detector_namelist, choices=cfg.sub_detector_namelist, help="Calorimeter layers drawn (default: all)")
+    parser.add_argument('-cm', "--color_mode", type=str, default="cluster", choices=["cluster", "energy"], help="Colour the hit cells by cluster or by cell energy")
+    parser.add_argument('-sc', "--scale", type=str, default="linear", choices=["linear", "log"], help="Energy colour scale")
+    parser.add_argument("--colormap", type=str, default="viridis", choices=list(cfg.cell_colormaps), help="Energy colour map")
+    parser.add_argument('-cv', "--cell_volumes", action="store_true", help="Draw the cells as their volumes (outlines, hit cells filled) instead of points")
+    parser.add_argument('-na', "--no_axis", action="store_true", help="Do not draw the axis")
+    args = parser.parse_args()
+
+    if args.file_type == "pi0": f = "pi0.mltree.root"
+    elif args.file_type == "pi+": f = "piplus.mltree.root"
+    event_files = args.event_files if args.event_files is not None else f"database/{f}"
+
+    # Only the event numbers are read here (lazy mode), plus the per-event summaries for a query
+    calorimeter_manager = CalorimeterManager(args.geometry_file) if args.cell_ids or args.query is not None or args.cell_volumes else None
+    if args.cell_volumes and not calorimeter_manager.hasCellExtents():
+        sys.exit(f"--cell_volumes: the geometry file {args.geometry_file} has no cell extents (cell_geo_deta/cell_geo_dphi)")
+    event_manager = EventManager(event_files, args.event_tree, args.cell_coord_branch, lazy=True,
+                                 calorimeter_manager=calorimeter_manager if args.cell_ids else None)
+    try:
+        event_numbers = _selectEvents(args, event_manager.getEventNumbers(), event_manager, calorimeter_manager)
+    except ValueError as e:
+        sys.exit(str(e))
+    finally:
+        event_manager.close()
+    if not event_numbers:
+        sys.exit("No event to render")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    options = {"geometry_file": args.geometry_file, "event_files": event_manager.fileNames, "tree_name": args.event_tree,
+               "branch_prefix": args.cell_coord_branch, "cell_ids": args.cell_ids, "output_dir": args.output_dir,
+               "width": args.width, "height": args.height, "x_rot": args.x_rot, "y_rot": args.y_rot, "zoom": args.zoom,
+               "layers": set(args.layers), "axis": not args.no_axis, "cell_volumes": args.cell_volumes,
+               "color_mode": args.color_mode, "scale": args.scale, "colormap": args.colormap}
+    chunks = [event_numbers[start:start+args.chunk_size] for start in range(0, len(event_numbers), args.chunk_size)]
+    n_workers = max(1, min(args.workers, len(chunks)))
+    print(f"Rendering {len(event_numbers)} events to {args.output_dir} with {n_workers} worker(s)...")
+
+    start_time = time.perf_counter()
+    n_rendered, render_seconds, failures, setup_seconds = 0, 0.0, [], {}
+    # Spawned (not forked) workers: each one starts its own Qt application and OpenGL context
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_initWorker, initargs=(options,)) as executor:
+        futures = [executor.submit(_renderEvents, chunk) for chunk in chunks]
+        for future in as_completed(futures):
+            pid, worker_setup_seconds, chunk_rendered, chunk_seconds, chunk_failures, error = future.result()
+            if error is not None:
+                for other in futures:
+                    other.cancel()
+                sys.exit(f"Worker could not be set up: {error}")
+            setup_seconds[pid] = worker_setup_seconds
+            n_rendered += chunk_rendered
+            render_seconds += chunk_seconds
+            failures += chunk_failures
+            print(f"  {n_rendered + len(failures)}/{len(event_numbers)} events, {n_rendered / (time.perf_counter() - start_time):.1f} images/s")
+    elapsed = time.perf_counter() - start_time
+
+    for evtnum, message in failures:
+        print(f"Failed to render event {evtnum}: {message}")
+    print(f"Rendered {n_rendered} images in {elapsed:.2f} s: {n_rendered / elapsed:.1f} images/s with {n_workers} worker(s) "
+          f"(worker setup {max(setup_seconds.values()):.2f} s, {render_seconds / max(n_rendered, 1) * 1e3:.1f} ms per image and worker)")
+    sys.exit(1 if failures else 0)
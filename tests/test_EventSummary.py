@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+
+from useCaseClasses.EventStore import EventStore
+from useCaseClasses.EventSummary import EventSummary
+
+
+@pytest.fixture
+def summary():
+    # 4 events: clusters of (10, 5), (), (40), (1, 2, 3) cells; the second event has no truth particle
+    store = EventStore(event_numbers=[7, 3, 5, 9],
+                       event_cluster_offsets=[0, 2, 2, 3, 6],
+                       cluster_cell_offsets=[0, 10, 15, 55, 56, 58, 61],
+                       cells_coord=np.zeros((61, 3)),
+                       event_particle_offsets=[0, 1, 1, 2, 4],
+                       truth_eta_phi=[[0.5, 0.1], [-1.5, 2.0], [2.2, -1.0], [0.0, 0.0]],
+                       truth_traj_xyz=np.zeros((4, 3)))
+    return EventSummary.fromEventStore(store)
+
+
+def test_columns(summary):
+    assert summary.columns["n_clusters"].tolist() == [2, 0, 1, 3]
+    assert summary.columns["n_cells"].tolist() == [15, 0, 40, 6]
+    assert summary.columns["max_cluster_cells"].tolist() == [10, 0, 40, 3]
+    assert summary.columns["min_cluster_cells"].tolist() == [5, 0, 40, 1]
+    assert np.isnan(summary.columns["eta"][1])
+
+
+@pytest.mark.parametrize("expression, events", [
+    ("", [3, 5, 7, 9]),
+    ("  ", [3, 5, 7, 9]),
+    ("n_clusters >= 2", [7, 9]),
+    ("n_cells == 40", [5]),
+    ("n_cells != 40", [3, 7, 9]),
+    ("0 < n_cells < 20", [7, 9]),
+    ("1 <= n_clusters <= 2", [5, 7]),
+    ("abs(eta) > 1", [5, 9]),
+    ("-eta > 1", [5]),
+    ("+eta > 1", [9]),
+    ("n_clusters >= 2 and n_cells > 10", [7]),
+    ("n_cells == 0 or n_cells == 40", [3, 5]),
+    ("not n_clusters > 0", [3]),
+    ("(n_clusters == 0) | (n_cells > 30)", [3, 5]),
+    ("(n_clusters > 0) & ~(n_cells > 30)", [7, 9]),
+    ("(n_cells + 5) * 2 - 1 > 40", [5]),
+    ("n_cells % 2 == 0", [3, 5, 9]),
+    ("n_cells / 2 >= 7.5", [5, 7]),
+    ("n_cells / n_clusters > 5", [5, 7]),
+    ("n_cells % n_clusters == 0", [5, 9]),
+    ("not (n_cells / n_clusters > 5)", [3, 9]),
+    ("event > 4 and True", [5, 7, 9]),
+])
+def test_accepted_expressions(summary, expression, events):
+    assert summary.query(expression).tolist() == events
+
+
+def test_evaluate_is_a_mask_in_row_order(summary):
+    assert summary.evaluate("n_clusters > 0").tolist() == [True, False, True, True]
+    assert summary.evaluate("True").tolist() == [True] * 4
+
+
+@pytest.mark.parametrize("expression", [
+    "n_cells % 0 == 0",
+    "n_cells / 0 > 1",
+    "n_cells / (2 - 2) > 1",
+    "n_cells % (1 * 0) == 0",
+    "n_cells / 0.0 > 1",
+])
+def test_division_by_zero_is_rejected(summary, expression):
+    with pytest.raises(ValueError, match="division by zero"):
+        summary.query(expression)
+
+
+@pytest.mark.parametrize("expression", [
+    # Calls (other than abs with one argument)
+    "len(n_cells) > 0",
+    "__import__('os').getcwd() == 0",
+    "abs(eta, 1) > 0",
+    "abs(x=eta) > 0",
+    "n_cells.sum() > 0",
+    # Attributes
+    "n_cells.size > 0",
+    "eta.__class__ == 0",
+    # Subscripts
+    "n_cells[0] > 0",
+    "n_cells[0:2] > 0",
+    # Strings and other constants
+    "'abc' == 'abc'",
+    "n_cells == 'a'",
+    "n_cells == None",
+    "b'x' == n_cells",
+    # Other nodes
+    "[n_cells] == 1",
+    "(lambda: 1)() == 1",
+    "n_cells if eta else n_clusters",
+    "n_cells ** 2 > 4",
+    "n_cells in (1, 2)",
+    "n_cells is n_cells",
+    "(y := n_cells) > 0",
+])
+def test_unsupported_nodes_are_rejected(summary, expression):
+    with pytest.raises(ValueError, match="Invalid query"):
+        summary.query(expression)
+
+
+@pytest.mark.parametrize("expression, message", [
+    ("n_cell > 3", "unknown column 'n_cell'"),
+    ("n_cells >", "Invalid query"),
+    ("n_cells + 1", "not a condition"),
+])
+def test_invalid_queries(summary, expression, message):
+    with pytest.raises(ValueError, match=message):
+        summary.query(expression)
+
+
+def test_concatenate_keeps_row_order(summary):
+    merged = EventSummary.concatenate([summary, summary])
+    assert len(merged) == 8
+    assert merged.evaluate("n_clusters > 0").tolist() == [True, False, True, True] * 2
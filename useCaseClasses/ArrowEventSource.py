@@ -0,0 +1,150 @@
+import os
+import numpy as np
+import threading
+
+from useCaseClasses.EventSource import EventSource, EventColumns
+from instrumentation.Profiler import profiler
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+class ArrowEventSource(EventSource):
+    """
+    Events read from the Arrow IPC (.arrow/.feather) or Parquet (.parquet) files written by convert_events.py,
+    one table per file (the tree name is not used) with the columns:
+        eventNumber                     int64
+        truthPartEta, truthPartPhi      list<float32>
+        {prefix}_XYZ                    list<list<fixed_size_list<float32, 3>>>     cell coordinates [m], per event and cluster
+        {prefix}_ID                     list<list<uint64>>                          cell IDs (if the ROOT file had them)
+        {prefix}_E                      list<list<float32>>                         cell energies [MeV] (if the ROOT file had them)
+
+    Arrow IPC files are memory-mapped: the offsets, cell coordinates, IDs and energies handed to EventManager are
+    NumPy views of the mapped record batches (no read nor copy, the pages are loaded by the OS on first access),
+    so that opening a file and reading one entry cost almost nothing. Parquet files are memory-mapped too, but
+    their row groups are decoded on read (the last decoded row group of each file is kept for lazy mode).
+    Needs pyarrow.
+    """
+    def __init__(self, file_names: list[str], tree_name: str, branch_prefix: str, cell_id_mode: bool = False, load_energies: bool = False):
+        if pa is None:
+            raise ImportError("pyarrow is needed to read Arrow/Parquet event files (pip install pyarrow)")
+        super().__init__(file_names, tree_name, branch_prefix, cell_id_mode, load_energies)
+        self.cells_column = f'{branch_prefix}_ID' if cell_id_mode else f'{branch_prefix}_XYZ'
+        self.energy_column = f'{branch_prefix}_E'
+        # file index -> (reader, first entry of each record batch / row group)
+        self._open_files = {}
+        self._row_group_cache = {}          # file index -> (row group index, decoded table), Parquet only
+        self._file_lock = threading.Lock()
+
+    def columns(self) -> list[str]:
+        return ['eventNumber', 'truthPartEta', 'truthPartPhi', self.cells_column] + ([self.energy_column] if self.load_energies else [])
+
+    def readEventNumbers(self, file_idx: int) -> np.ndarray:
+        reader, _ = self._getOpenFile(file_idx)
+        if self._isParquet(file_idx):
+            table = reader.read(columns=['eventNumber'])
+            return np.asarray(table.column('eventNumber').to_numpy(), dtype=np.int64)
+        event_numbers = [reader.get_batch(batch_idx).column('eventNumber').to_numpy() for batch_idx in range(reader.num_record_batches)]
+        return np.concatenate(event_numbers).astype(np.int64, copy=False) if event_numbers else np.zeros(0, dtype=np.int64)
+
+    def iterateColumns(self, file_indices: list[int] = None, step_size="100 MB"):
+        # Chunks are the record batches / row groups of the files (step_size is not used)
+        file_indices = range(len(self.file_names)) if file_indices is None else file_indices
+        for file_idx in file_indices:
+            reader, batch_starts = self._getOpenFile(file_idx)
+            for batch_idx in range(len(batch_starts) - 1):
+                with profiler.span("events.read_chunk"):
+                    batch = self._readBatch(file_idx, reader, batch_idx)
+                with profiler.span("events.convert"):
+                    yield self._toColumns(batch)
+
+    def readEntry(self, file_idx: int, entry: int) -> EventColumns:
+        with profiler.span("event.read_entry"):
+            reader, batch_starts = self._getOpenFile(file_idx)
+            batch_idx = int(np.searchsorted(batch_starts, entry, side='right')) - 1
+            if not 0 <= entry < batch_starts[-1]:
+                raise IndexError(f"Entry {entry} out of range of {self.file_names[file_idx]}")
+            if self._isParquet(file_idx):
+                with self._file_lock:
+                    cached = self._row_group_cache.get(file_idx)
+                    if cached is None or cached[0] != batch_idx:
+                        cached = (batch_idx, self._readBatch(file_idx, reader, batch_idx))
+                        self._row_group_cache[file_idx] = cached
+                batch = cached[1]
+            else:
+                batch = reader.get_batch(batch_idx)
+            row = batch.slice(entry - batch_starts[batch_idx], 1)
+        with profiler.span("event.convert"):
+            return self._toColumns(row)
+
+    def close(self):
+        with self._file_lock:
+            self._open_files.clear()
+            self._row_group_cache.clear()
+
+    def _isParquet(self, file_idx: int) -> bool:
+        return os.path.splitext(self.file_names[file_idx])[1].lower() in self.parquet_extensions
+
+    def _getOpenFile(self, file_idx: int):
+        with self._file_lock:
+            if file_idx in self._open_files:
+                return self._open_files[file_idx]
+            file_name = self.file_names[file_idx]
+            with profiler.span("events.arrow_open"):
+                if self._isParquet(file_idx):
+                    reader = pq.ParquetFile(file_name, memory_map=True)
+                    schema_names = reader.schema_arrow.names
+                    batch_rows = [reader.metadata.row_group(idx).num_rows for idx in range(reader.num_row_groups)]
+                else:
+                    reader = pa.ipc.open_file(pa.memory_map(file_name, 'r'))
+                    schema_names = reader.schema.names
+                    batch_rows = [reader.get_batch(idx).num_rows for idx in range(reader.num_record_batches)]
+            missing = [column for column in self.columns() if column not in schema_names]
+            if missing:
+                raise ValueError(f"{file_name} has no column {', '.join(missing)} (see convert_events.py)")
+            self._open_files[file_idx] = (reader, EventColumns.countsToOffsets(batch_rows))
+            return self._open_files[file_idx]
+
+    def _readBatch(self, file_idx: int, reader, batch_idx: int):
+        if self._isParquet(file_idx):
+            return reader.read_row_group(batch_idx, columns=self.columns())
+        return reader.get_batch(batch_idx)
+
+    @staticmethod
+    def _column(data, name: str):
+        # Column of a record batch (Array) or of a table read from Parquet (ChunkedArray)
+        column = data.column(name)
+        return column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+
+    @staticmethod
+    def _listParts(list_array):
+        # (offsets starting at 0, values of the listed range) of a possibly sliced list array, without copying the values
+        offsets = list_array.offsets.to_numpy()
+        values = list_array.values.slice(offsets[0], offsets[-1] - offsets[0])
+        return (offsets - offsets[0]).astype(np.int64), values
+
+    def _nestedLeaves(self, data, name: str):
+        # (event -> cluster offsets, cluster -> cell offsets, cell values) of a list<list<...>> column
+        event_cluster_offsets, clusters = self._listParts(self._column(data, name))
+        cluster_cell_offsets, cells = self._listParts(clusters)
+        return event_cluster_offsets, cluster_cell_offsets, cells
+
+    def _toColumns(self, data) -> EventColumns:
+        event_cluster_offsets, cluster_cell_offsets, cells = self._nestedLeaves(data, self.cells_column)
+        if self.cell_id_mode:
+            cells_coord, cell_ids = None, cells.to_numpy(zero_copy_only=True)
+        else:
+            # (N,) fixed-size lists of 3 floats -> (N, 3) view of their values
+            coords = cells.values.slice(cells.offset * 3, len(cells) * 3)
+            cells_coord, cell_ids = coords.to_numpy(zero_copy_only=True).reshape(-1, 3), None
+        cell_energies = self._nestedLeaves(data, self.energy_column)[2].to_numpy(zero_copy_only=True) if self.load_energies else None
+
+        event_particle_offsets, truth_eta = self._listParts(self._column(data, 'truthPartEta'))
+        _, truth_phi = self._listParts(self._column(data, 'truthPartPhi'))
+        return EventColumns(self._column(data, 'eventNumber').to_numpy(), event_cluster_offsets, cluster_cell_offsets,
+                            event_particle_offsets, truth_eta.to_numpy(), truth_phi.to_numpy(),
+                            cells_coord=cells_coord, cell_ids=cell_ids, cell_energies=cell_energies)
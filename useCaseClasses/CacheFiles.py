@@ -0,0 +1,42 @@
+import os
+import hashlib
+
+
+class CacheFiles:
+    """
+    Helpers shared by the on-disk caches (GeometryCache, EventIndex, CellOccupancy): the key telling whether a
+    source file changed since a cache was written, and the atomic write of a cache file (written to a temporary
+    file then renamed over the old one, so that a killed or concurrent run never leaves a partial cache).
+    """
+
+    # (Public) Return the key of a file, {"size", "mtime_ns"} (and "sha1" of its content if with_hash),
+    # stored with a cache and compared to the file's current key to tell whether the cache is stale
+    @staticmethod
+    def fileKey(file_name: str, with_hash: bool = False) -> dict:
+        stat = os.stat(file_name)
+        key = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        if with_hash:
+            key["sha1"] = CacheFiles.hashFile(file_name)
+        return key
+
+    # (Public) Return the sha1 of the content of a file (read by chunks)
+    @staticmethod
+    def hashFile(file_name: str) -> str:
+        sha1 = hashlib.sha1()
+        with open(file_name, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    # (Public) Write `path` atomically: write(tmp_path) writes the content to a temporary file next to it (with the
+    # same extension, e.g. for np.savez), which then replaces `path`. Raises OSError if it fails (nothing is replaced).
+    @staticmethod
+    def writeAtomically(path: str, write):
+        tmp_path = f"{path}.tmp{os.path.splitext(path)[1]}"
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
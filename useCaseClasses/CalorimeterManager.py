@@ -1,46 +1,225 @@
-import uproot
+import time
+import numpy as np
 from database import config as cfg
+from useCaseClasses.GeometryCache import GeometryCache
+from useCaseClasses.CellSpatialIndex import CellSpatialIndex
+from useCaseClasses.CellVolumes import CellVolumes
+from instrumentation.Profiler import profiler
 
 class CalorimeterManager:
-    def __init__(self, file_name: str) -> None:
+    def __init__(self, file_name: str, use_cache: bool = True) -> None:
         self.fileName = file_name
         self.treeName = "CellGeo"
-        
-        with uproot.open(self.fileName) as f:
+        self.layer_namelist = cfg.sub_detector_namelist
+
+        # All cells grouped by sampling layer: layer i is rows layer_offsets[i]:layer_offsets[i+1]
+        self.cells_coord = None     # np.ndarray (N, 3), float32 [m]
+        self.cell_ids = None        # np.ndarray (N,), uint64
+        self.cell_extents = None    # np.ndarray (N, 2), float32: (deta, dphi) of each cell, None if the file has no extents
+        self.layer_offsets = None   # np.ndarray (n_layers+1,), int64
+        # Sorted-ID index for the cell ID -> row lookup, built on first use: (sorted cell IDs, row of each of them)
+        self._sorted_id_index = None
+        # Same for the cell coordinate -> row lookup, on coordinates quantised to coord_key_resolution [m]
+        self._sorted_coord_index = None
+        self.coord_key_resolution = 1e-4
+        # Uniform grid over all cells for mouse picking, built on first use (see getCellSpatialIndex)
+        self._spatial_index = None
+        # Box/wedge of every cell for the volume display, computed on first use (see getCellVolumes)
+        self._cell_volumes = None
+
+        start_time = time.perf_counter()
+        cache = GeometryCache(self.fileName) if use_cache else None
+        with profiler.span("geometry.cache_load"):
+            cached = cache.load(self.layer_namelist) if cache is not None else None
+
+        if cached is not None:
+            self.cells_coord, self.cell_ids, self.cell_extents, self.layer_offsets, meta = cached
+            self.load_seconds = time.perf_counter() - start_time
+            print(f"CalorimeterManager: geometry mapped from cache in {self.load_seconds:.3f} s "
+                  f"(cold load from ROOT file took {meta['cold_load_seconds']:.3f} s)")
+        else:
+            self._loadFromROOTFile()
+            with profiler.span("geometry.partition"):
+                self._makeSubdetectorToCellsCoordMap()
+            self.load_seconds = time.perf_counter() - start_time
+            print(f"CalorimeterManager: geometry loaded from ROOT file in {self.load_seconds:.3f} s")
+            if cache is not None:
+                cache.save(self.cells_coord, self.cell_ids, self.cell_extents, self.layer_offsets, self.layer_namelist, self.load_seconds)
+
+        self.map_samp_cellsCoord = {}
+        self.map_samp_cellIDs = {}
+        for samp_num, samp_name in enumerate(self.layer_namelist):
+            start, end = self.layer_offsets[samp_num], self.layer_offsets[samp_num+1]
+            self.map_samp_cellsCoord[samp_name] = self.cells_coord[start:end]
+            self.map_samp_cellIDs[samp_name] = self.cell_ids[start:end]
+
+    def _loadFromROOTFile(self) -> None:
+        # uproot is only needed when the geometry cache is missing or stale
+        import uproot
+
+        with profiler.span("geometry.root_open"):
+            f = uproot.open(self.fileName)
+        with f, profiler.span("geometry.read_branches"):
             tree = f[self.treeName]
-            
-            self.cell_geo_ID = tree['cell_geo_ID'].array()[0]
-            self.cell_geo_samp = tree['cell_geo_sampling'].array()[0]
-            self.cell_geo_X = tree['cell_geo_X'].array()[0]
-            self.cell_geo_Y = tree['cell_geo_Y'].array()[0]
-            self.cell_geo_Z = tree['cell_geo_Z'].array()[0]
-            
-        self.map_samp_cellsCoord = {} 
-        self._makeSubdetectorToCellsCoordMap()
-        
-    # Map cell coordinates for all 24 sampling layer
+
+            self.cell_geo_ID = tree['cell_geo_ID'].array()[0].to_numpy()
+            self.cell_geo_samp = tree['cell_geo_sampling'].array()[0].to_numpy()
+            self.cell_geo_X = tree['cell_geo_X'].array()[0].to_numpy()
+            self.cell_geo_Y = tree['cell_geo_Y'].array()[0].to_numpy()
+            self.cell_geo_Z = tree['cell_geo_Z'].array()[0].to_numpy()
+            # The cell extents are optional (only needed to draw the cells as volumes)
+            if 'cell_geo_deta' in tree and 'cell_geo_dphi' in tree:
+                self.cell_geo_deta = tree['cell_geo_deta'].array()[0].to_numpy()
+                self.cell_geo_dphi = tree['cell_geo_dphi'].array()[0].to_numpy()
+            else:
+                self.cell_geo_deta = self.cell_geo_dphi = None
+
+    # Map cell coordinates for all 24 sampling layer, stored contiguously layer after layer.
+    # Done in a single pass: one stable argsort over the sampling numbers groups the cells by layer
+    # (keeping the file order within a layer), and one bincount gives the size of each layer.
     def _makeSubdetectorToCellsCoordMap(self) -> None:
-        for samp_num, samp_name in enumerate(cfg.sub_detector_namelist):
-            cells_coord = self._makeSampLayerAllCellCoord(samp_num)
-            self.map_samp_cellsCoord[samp_name] = cells_coord
-            
-    # Map cell coordinates for a specific sampling layer
-    def _makeSampLayerAllCellCoord(self, samp_num: int):
-        cells_X = self.cell_geo_X[self.cell_geo_samp == samp_num] /1000 #[m]
-        cells_Y = self.cell_geo_Y[self.cell_geo_samp == samp_num] /1000 #[m]
-        cells_Z = self.cell_geo_Z[self.cell_geo_samp == samp_num] /1000 #[m]
+        n_layers = len(self.layer_namelist)
+        cells_order = np.argsort(self.cell_geo_samp, kind='stable')
+        layer_counts = np.bincount(self.cell_geo_samp, minlength=n_layers)[:n_layers]
         
-        cells_coord = list(zip(cells_X, cells_Y, cells_Z))
-        return cells_coord
-    
-    # (Public) Return all cells coordinate for a particular layer 
-    def getCalorimeterCells(self, samp_name: str):
+        self.layer_offsets = np.zeros(n_layers + 1, dtype=np.int64)
+        np.cumsum(layer_counts, out=self.layer_offsets[1:])
+        
+        # Cells with a sampling number outside of the known layers end up at the back, and are dropped
+        cells_order = cells_order[:self.layer_offsets[-1]]
+        self.cell_ids = self.cell_geo_ID[cells_order].astype(np.uint64)
+        self.cells_coord = np.empty((len(cells_order), 3), dtype=np.float32)
+        for axis, cell_geo_coord in enumerate((self.cell_geo_X, self.cell_geo_Y, self.cell_geo_Z)):
+            self.cells_coord[:, axis] = cell_geo_coord[cells_order] /1000 #[m]
+        if self.cell_geo_deta is not None:
+            self.cell_extents = np.empty((len(cells_order), 2), dtype=np.float32)
+            self.cell_extents[:, 0] = self.cell_geo_deta[cells_order]
+            self.cell_extents[:, 1] = self.cell_geo_dphi[cells_order]
+
+    # (Public) Return all cells coordinate for a particular layer, shape (N, 3)
+    def getCalorimeterCells(self, samp_name: str) -> np.ndarray:
         return self.map_samp_cellsCoord[samp_name]
-    
+
+    # (Public) Return the cell IDs of a particular layer, in the same order as getCalorimeterCells
+    def getCalorimeterCellIDs(self, samp_name: str) -> np.ndarray:
+        return self.map_samp_cellIDs[samp_name]
+
+    # (Public) Return a decimated subset (about `fraction` of the cells, at least min_cells) of a layer for the
+    # low level-of-detail display (see getDecimatedCellRows)
+    def getDecimatedCalorimeterCells(self, samp_name: str, fraction: float = 0.08, min_cells: int = 500, seed: int = 0) -> np.ndarray:
+        cells = self.map_samp_cellsCoord[samp_name]
+        return np.ascontiguousarray(cells[self.getDecimatedCellRows(samp_name, fraction, min_cells, seed)])
+
+    # (Public) Return the sorted rows (within the layer) of the decimated subset of a layer. The sample is spatially
+    # stratified: the layer's bounding box is divided into about as many voxels as cells to keep, one random cell
+    # of every occupied voxel is taken first, then a second one, and so on, so that the subset covers the whole layer evenly.
+    def getDecimatedCellRows(self, samp_name: str, fraction: float = 0.08, min_cells: int = 500, seed: int = 0) -> np.ndarray:
+        cells = self.map_samp_cellsCoord[samp_name]
+        n_keep = min(len(cells), max(int(len(cells) * fraction), min_cells))
+        if n_keep == len(cells):
+            return np.arange(len(cells))
+
+        lower, upper = cells.min(axis=0), cells.max(axis=0)
+        extent = np.maximum(upper - lower, 1e-6)
+        voxel_size = (np.prod(extent) / n_keep) ** (1/3)
+        n_voxels = np.maximum(np.ceil(extent / voxel_size), 1).astype(np.int64)
+        voxel_idx = np.minimum(((cells - lower) / voxel_size).astype(np.int64), n_voxels - 1)
+        voxel_keys = np.ravel_multi_index(voxel_idx.T, n_voxels)
+
+        # Random order inside each voxel -> rank of each cell in its voxel -> cells ordered by rank
+        rng = np.random.default_rng(seed)
+        order = np.lexsort((rng.random(len(cells)), voxel_keys))
+        sorted_keys = voxel_keys[order]
+        voxel_start = np.flatnonzero(np.diff(sorted_keys, prepend=-1) != 0)
+        rank = np.arange(len(cells)) - np.repeat(voxel_start, np.diff(voxel_start, append=len(cells)))
+        kept = order[np.argsort(rank, kind='stable')[:n_keep]]
+        return np.sort(kept)
+
+    # (Public) Return the spatial index over all cells (rows of cells_coord), built once
+    def getCellSpatialIndex(self) -> CellSpatialIndex:
+        if self._spatial_index is None:
+            with profiler.span("geometry.spatial_index"):
+                cell_layers = np.repeat(np.arange(len(self.layer_namelist)), np.diff(self.layer_offsets))
+                self._spatial_index = CellSpatialIndex(self.cells_coord, cell_layers)
+        return self._spatial_index
+
+    # (Public) Whether the geometry file gives the extents (deta, dphi) of the cells, needed by getCellVolumes
+    def hasCellExtents(self) -> bool:
+        return self.cell_extents is not None
+
+    # (Public) Return the box/wedge of every cell (rows of cells_coord), computed once.
+    # Raises ValueError if the geometry file has no cell extents (see hasCellExtents)
+    def getCellVolumes(self) -> CellVolumes:
+        if not self.hasCellExtents():
+            raise ValueError(f"The geometry file {self.fileName} has no cell extents (cell_geo_deta/cell_geo_dphi), "
+                             "the cells cannot be drawn as volumes")
+        if self._cell_volumes is None:
+            with profiler.span("geometry.cell_volumes"):
+                self._cell_volumes = CellVolumes.fromGeometry(self.cells_coord, self.cell_extents, self.layer_offsets, self.layer_namelist)
+        return self._cell_volumes
+
+    # (Public) Return a dict describing a cell row: ID, layer name, (x, y, z) [m], eta, phi
+    def getCellInfo(self, cell_index: int) -> dict:
+        x, y, z = (float(coord) for coord in self.cells_coord[cell_index])
+        layer = int(self.getCellLayers(cell_index))
+        return {"cell_id": int(self.cell_ids[cell_index]), "layer": self.layer_namelist[layer],
+                **self.describePosition(x, y, z)}
+
+    # (Public) Return {"x", "y", "z", "eta", "phi"} of a position [m]; eta is +-inf on the beam axis
+    @staticmethod
+    def describePosition(x: float, y: float, z: float) -> dict:
+        r = float(np.hypot(x, y))
+        eta = float(np.arcsinh(z / r)) if r > 0 else float(np.copysign(np.inf, z))
+        return {"x": x, "y": y, "z": z, "eta": eta, "phi": float(np.arctan2(y, x))}
+
+    # (Public) Return (cells_coord, cell_ids, layer_offsets) for all layers at once,
+    # layer i being rows layer_offsets[i]:layer_offsets[i+1] of both arrays
+    def getAllCalorimeterCells(self):
+        return self.cells_coord, self.cell_ids, self.layer_offsets
+
+    # (Public) Return the row (in cells_coord / cell_ids) of each cell ID, -1 for IDs that are not in the geometry.
+    # Vectorised binary search in a sorted copy of the IDs, any array shape
+    def findCellIndices(self, cell_ids) -> np.ndarray:
+        sorted_ids, sorted_rows = self._getSortedIDIndex()
+        cell_ids = np.asarray(cell_ids).astype(np.uint64, copy=False)
+        pos = np.minimum(np.searchsorted(sorted_ids, cell_ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[pos] == cell_ids, sorted_rows[pos], -1).astype(np.int32)
+
+    # (Public) Return the row of each (x, y, z) cell position [m] of shape (N, 3), -1 for positions that are not a cell.
+    # Positions are matched to 0.1 mm (event cell coordinates come from the same geometry dump)
+    def findCellIndicesByCoord(self, cells_coord) -> np.ndarray:
+        sorted_keys, sorted_rows = self._getSortedCoordIndex()
+        keys = self._coordKeys(np.asarray(cells_coord).reshape(-1, 3))
+        pos = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        return np.where(sorted_keys[pos] == keys, sorted_rows[pos], -1).astype(np.int32)
+
+    # (Public) Return the sampling layer number of each cell row (as returned by findCellIndices), -1 stays -1
+    def getCellLayers(self, cell_indices) -> np.ndarray:
+        return (np.searchsorted(self.layer_offsets, cell_indices, side='right') - 1).astype(np.int16)
+
+    def _getSortedIDIndex(self):
+        # Built once (about 10 ms for the full geometry); concurrent first calls just build it twice
+        if self._sorted_id_index is None:
+            sorted_rows = np.argsort(self.cell_ids, kind='stable').astype(np.int32)
+            self._sorted_id_index = (self.cell_ids[sorted_rows], sorted_rows)
+        return self._sorted_id_index
+
+    def _coordKeys(self, cells_coord) -> np.ndarray:
+        # Pack the quantised x, y, z (21 bits each, +-100 m at 0.1 mm) into one int64 per cell
+        quantised = np.rint(cells_coord / self.coord_key_resolution).astype(np.int64) + (1 << 20)
+        return (quantised[:, 0] << 42) | (quantised[:, 1] << 21) | quantised[:, 2]
+
+    def _getSortedCoordIndex(self):
+        if self._sorted_coord_index is None:
+            keys = self._coordKeys(self.cells_coord)
+            sorted_rows = np.argsort(keys, kind='stable').astype(np.int32)
+            self._sorted_coord_index = (keys[sorted_rows], sorted_rows)
+        return self._sorted_coord_index
+
     # (Public) Return calorimeter cell namelist
     #def getCalorimeterNames(self):
     #    return cfg.sub_detector_namelist
-        
+
 
 #if __name__ == '__main__':
-#    _ = CalorimeterManager("../database/cell_geo+.root")
\ No newline at end of file
+#    _ = CalorimeterManager("../database/cell_geo+.root")
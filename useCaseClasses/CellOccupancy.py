@@ -0,0 +1,125 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from useCaseClasses.EventStore import EventStore
+from useCaseClasses.CacheFiles import CacheFiles
+from instrumentation.Profiler import profiler
+
+
+class CellOccupancy:
+    """
+    Cross-event occupancy of the calorimeter cells: how many times each geometry cell is a cluster cell over
+    all events of a sample (hit_counts), and optionally the summed energy of those hits (energy_sums, MeV).
+
+    Both are arrays with one entry per geometry cell (rows of CalorimeterManager.cells_coord), accumulated with
+    np.bincount over the geometry rows of the cluster cells (cell-ID mode: the stored indices, otherwise the
+    coordinates matched to the geometry; cells that are not in the geometry are skipped), one chunk of events at
+    a time. They are computed per event file and cached next to it (".calolite_occupancy_<key>.npz", the key
+    being a hash of the file, tree, branch prefix and geometry), so that later runs only accumulate the files
+    that changed.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, hit_counts, energy_sums=None, n_events: int = 0):
+        self.hit_counts = np.asarray(hit_counts, dtype=np.int64)                                  # (n_geometry_cells,)
+        self.energy_sums = np.asarray(energy_sums, dtype=np.float64) if energy_sums is not None else None   # (n_geometry_cells,) [MeV]
+        self.n_events = int(n_events)
+
+    # Number of cells hit at least once
+    @property
+    def n_hit_cells(self) -> int:
+        return int(np.count_nonzero(self.hit_counts))
+
+    # (Public) Accumulate the occupancy over all events of an EventManager (with the summed energies if the manager loads
+    # them). In eager mode the events in memory are used, in lazy mode the files are streamed chunk by chunk.
+    @staticmethod
+    def fromEventManager(eventManager, calorimeterManager, use_cache: bool = True, progress_callback=None) -> 'CellOccupancy':
+        with_energies = eventManager.load_energies
+        n_geometry_cells = len(calorimeterManager.cells_coord)
+        hit_counts = np.zeros(n_geometry_cells, dtype=np.int64)
+        energy_sums = np.zeros(n_geometry_cells, dtype=np.float64) if with_energies else None
+        n_events = 0
+
+        file_rows = np.concatenate([[0], np.cumsum(eventManager.event_index.file_event_counts)])
+        for file_idx, file_name in enumerate(eventManager.fileNames):
+            cache_path = CellOccupancy._cachePath(eventManager, calorimeterManager, file_name) if use_cache else None
+            file_occupancy = CellOccupancy._load(cache_path, file_name, calorimeterManager, with_energies) if use_cache else None
+            if file_occupancy is None:
+                if progress_callback is not None:
+                    progress_callback(f"Accumulating cell occupancy of file {file_idx+1}/{len(eventManager.fileNames)}: {os.path.basename(file_name)}")
+                with profiler.span("occupancy.accumulate_file"):
+                    if eventManager.lazy:
+                        file_occupancy = CellOccupancy._accumulate(eventManager.iterateEventStores([file_name]), calorimeterManager, with_energies)
+                    else:
+                        file_occupancy = CellOccupancy._accumulate([eventManager.event_store], calorimeterManager, with_energies,
+                                                                   file_rows[file_idx], file_rows[file_idx+1])
+                if use_cache:
+                    file_occupancy._save(cache_path, file_name, calorimeterManager)
+            hit_counts += file_occupancy.hit_counts
+            if with_energies:
+                energy_sums += file_occupancy.energy_sums
+            n_events += file_occupancy.n_events
+        return CellOccupancy(hit_counts, energy_sums, n_events)
+
+    @staticmethod
+    def _accumulate(stores, calorimeterManager, with_energies: bool, row_start: int = 0, row_end: int = None) -> 'CellOccupancy':
+        # Sum over the events of the stores (or of the rows row_start:row_end of a single store)
+        n_geometry_cells = len(calorimeterManager.cells_coord)
+        hit_counts = np.zeros(n_geometry_cells, dtype=np.int64)
+        energy_sums = np.zeros(n_geometry_cells, dtype=np.float64) if with_energies else None
+        n_events = 0
+        for store in stores:
+            store_row_end = len(store) if row_end is None else row_end
+            cell_start = store.cluster_cell_offsets[store.event_cluster_offsets[row_start]]
+            cell_end = store.cluster_cell_offsets[store.event_cluster_offsets[store_row_end]]
+            cell_indices = CellOccupancy._geometryRows(store, calorimeterManager, cell_start, cell_end)
+            known = cell_indices >= 0
+            hit_counts += np.bincount(cell_indices[known], minlength=n_geometry_cells)
+            if with_energies:
+                energy_sums += np.bincount(cell_indices[known], weights=store.cell_energies[cell_start:cell_end][known],
+                                           minlength=n_geometry_cells)
+            n_events += store_row_end - row_start
+        return CellOccupancy(hit_counts, energy_sums, n_events)
+
+    @staticmethod
+    def _geometryRows(store: EventStore, calorimeterManager, cell_start: int, cell_end: int) -> np.ndarray:
+        if store.cell_indices is not None:
+            return store.cell_indices[cell_start:cell_end]
+        return calorimeterManager.findCellIndicesByCoord(store.cells_coord[cell_start:cell_end])
+
+    @staticmethod
+    def _cachePath(eventManager, calorimeterManager, file_name: str) -> str:
+        file_name = os.path.abspath(file_name)
+        key_source = "\n".join([file_name, eventManager.treeName, eventManager.branch_prefix, str(eventManager.cell_id_mode),
+                                os.path.abspath(calorimeterManager.fileName)])
+        key = hashlib.sha1(key_source.encode()).hexdigest()[:16]
+        return os.path.join(os.path.dirname(file_name), f".calolite_occupancy_{key}.npz")
+
+    @staticmethod
+    def _load(cache_path: str, file_name: str, calorimeterManager, with_energies: bool):
+        # Return the cached occupancy of an event file, None if missing or stale (file or geometry changed)
+        try:
+            with np.load(cache_path) as stored:
+                meta = json.loads(str(stored["meta"]))
+                if (meta.get("format_version") != CellOccupancy.FORMAT_VERSION or meta.get("file") != CacheFiles.fileKey(file_name)
+                        or meta.get("geometry") != CacheFiles.fileKey(calorimeterManager.fileName)
+                        or len(stored["hit_counts"]) != len(calorimeterManager.cells_coord)):
+                    return None
+                if with_energies and "energy_sums" not in stored:
+                    return None
+                return CellOccupancy(stored["hit_counts"], stored["energy_sums"] if with_energies else None, meta["n_events"])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def _save(self, cache_path: str, file_name: str, calorimeterManager):
+        meta = {"format_version": self.FORMAT_VERSION, "n_events": int(self.n_events),
+                "file": CacheFiles.fileKey(file_name), "geometry": CacheFiles.fileKey(calorimeterManager.fileName)}
+        arrays = {"hit_counts": self.hit_counts.astype(np.int32)}
+        if self.energy_sums is not None:
+            arrays["energy_sums"] = self.energy_sums
+        try:
+            CacheFiles.writeAtomically(cache_path, lambda tmp_path: np.savez_compressed(tmp_path, meta=json.dumps(meta), **arrays))
+        except OSError as e:
+            print(f"Warning: could not write cell occupancy cache to {cache_path}: {e}")
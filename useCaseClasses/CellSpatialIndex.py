@@ -0,0 +1,111 @@
+import numpy as np
+
+
+class CellSpatialIndex:
+    """
+    Uniform grid over a set of cell positions, for picking the cell closest to a ray (mouse picking).
+
+    The cells are sorted by voxel key, the cells of a voxel being stored contiguously (CSR-style) with one
+    offset per voxel of the grid, so that building the index is one argsort and looking up a voxel is one
+    array read. A query only looks at the voxels of the cone around the ray: the grid is walked one slice
+    of voxels at a time along the axis closest to the ray (DDA-style, all slices at once), the cone inside
+    each slice is bounded by a small box of voxels, and the cells of those voxels are tested in one
+    vectorised pass. Each cell carries a layer number so that hidden layers can be skipped during the query.
+    """
+    def __init__(self, cells_coord, cell_layers, voxel_size: float = 0.2):
+        self.cells_coord = np.ascontiguousarray(cells_coord, dtype=np.float32).reshape(-1, 3)
+        self.cell_layers = np.asarray(cell_layers, dtype=np.int64)
+        self.voxel_size = voxel_size
+
+        if len(self.cells_coord) > 0:
+            self.lower = self.cells_coord.min(axis=0).astype(np.float64) - voxel_size
+            self.upper = self.cells_coord.max(axis=0).astype(np.float64) + voxel_size
+        else:
+            self.lower = self.upper = np.zeros(3)
+        self.n_voxels = np.maximum(np.ceil((self.upper - self.lower) / voxel_size).astype(np.int64), 1)
+
+        keys = self._voxelKeys(self._voxelCoords(self.cells_coord))
+        self._cell_order = np.argsort(keys, kind='stable')
+        # Cells of voxel key k: positions _voxel_starts[k]:_voxel_starts[k+1] in voxel order
+        self._voxel_starts = np.searchsorted(keys[self._cell_order], np.arange(np.prod(self.n_voxels) + 1))
+        # Copies in voxel order, so that the candidates of a query are read from contiguous ranges
+        self._sorted_coords = self.cells_coord[self._cell_order]
+        self._sorted_layers = self.cell_layers[self._cell_order]
+
+    def __len__(self):
+        return len(self.cells_coord)
+
+    # (Public) Return (cell index, angle [rad]) of the cell seen closest to the ray origin + t*direction (t > 0),
+    # among the cells within max_angle of the ray and in a visible layer (visible_layers[layer] is True), or None
+    def pickRay(self, origin, direction, max_angle: float, visible_layers=None):
+        if len(self.cells_coord) == 0:
+            return None
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        direction = direction / np.linalg.norm(direction)
+
+        # A point within max_angle of the ray at depth t is within max_angle*t of the ray point at t. Along the axis k
+        # closest to the ray (|direction[k]| >= 1/sqrt(3) > max_angle), the slice of voxels [s_near, s_far] therefore
+        # only holds points of depths t_near..t_far, and the box of the ray between them widened by max_angle*t_far
+        # bounds the cone inside the slice
+        k = int(np.argmax(np.abs(direction)))
+        sign = 1.0 if direction[k] > 0 else -1.0
+        slices = np.arange(self.n_voxels[k])
+        s_near = self.lower[k] + (slices + (sign < 0)) * self.voxel_size
+        s_far = self.lower[k] + (slices + (sign > 0)) * self.voxel_size
+        t_near = np.maximum((s_near - origin[k]) * sign / (abs(direction[k]) + max_angle), 0.0)
+        t_far = (s_far - origin[k]) * sign / max(abs(direction[k]) - max_angle, 1e-6)
+        in_front = t_far > 0
+        slices, t_near, t_far = slices[in_front], t_near[in_front], t_far[in_front]
+        near, far = origin + t_near[:, None] * direction, origin + t_far[:, None] * direction
+        radius = (max_angle * t_far)[:, None]
+        voxel_lo = self._voxelCoords(np.minimum(near, far) - radius)
+        voxel_hi = self._voxelCoords(np.maximum(near, far) + radius)
+        voxel_lo[:, k] = voxel_hi[:, k] = slices
+        inside = np.all((voxel_hi >= 0) & (voxel_lo < self.n_voxels), axis=1)
+        if not inside.any():
+            return None
+        voxel_lo = np.maximum(voxel_lo[inside], 0)
+        voxel_hi = np.minimum(voxel_hi[inside], self.n_voxels - 1)
+
+        # All voxels of the boxes (the slices do not overlap, so each voxel comes once)
+        widths = (voxel_hi - voxel_lo).max(axis=0) + 1
+        offsets = np.stack(np.meshgrid(*[np.arange(width) for width in widths], indexing='ij'), axis=-1).reshape(-1, 3)
+        voxels = voxel_lo[:, None, :] + offsets[None, :, :]
+        voxels = voxels[np.all(voxels <= voxel_hi[:, None, :], axis=2)]
+        keys = self._voxelKeys(voxels)
+        starts = self._voxel_starts[keys]
+        counts = self._voxel_starts[keys + 1] - starts
+
+        # Cells of the voxels the cone reaches: a point within the cone is within max_angle*depth of the ray, so the
+        # centre of its voxel is within max_angle*(depth + h) + h, h being the half diagonal of a voxel
+        relative = self.lower + (voxels + 0.5) * self.voxel_size - origin
+        depth = relative @ direction
+        half_diagonal = self.voxel_size * np.sqrt(3) / 2
+        reach = max_angle * np.maximum(depth + half_diagonal, 0) + half_diagonal
+        reached = (counts > 0) & (np.einsum('ij,ij->i', relative, relative) - depth**2 <= reach**2)
+        if not reached.any():
+            return None
+        starts, counts = starts[reached], counts[reached]
+        candidates = np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())    # positions in voxel order
+        if visible_layers is not None and not np.all(visible_layers):
+            candidates = candidates[np.asarray(visible_layers, dtype=bool)[self._sorted_layers[candidates]]]
+        if len(candidates) == 0:
+            return None
+
+        # Angle between the ray and the direction of each candidate, seen from the origin (tan, small angles),
+        # compared squared
+        relative = self._sorted_coords[candidates] - origin
+        depth = relative @ direction
+        with np.errstate(divide='ignore', invalid='ignore'):
+            angle_sq = np.where(depth > 0, (np.einsum('ij,ij->i', relative, relative) - depth**2) / depth**2, np.inf)
+        best = np.argmin(angle_sq)
+        if angle_sq[best] > max_angle**2:
+            return None
+        return int(self._cell_order[candidates[best]]), float(np.sqrt(max(angle_sq[best], 0.0)))
+
+    def _voxelCoords(self, coords) -> np.ndarray:
+        return np.floor((np.asarray(coords, dtype=np.float64) - self.lower) / self.voxel_size).astype(np.int64)
+
+    def _voxelKeys(self, voxel_coords) -> np.ndarray:
+        return (voxel_coords[:, 0] * self.n_voxels[1] + voxel_coords[:, 1]) * self.n_voxels[2] + voxel_coords[:, 2]
@@ -0,0 +1,90 @@
+import numpy as np
+from database import config as cfg
+
+
+class CellVolumes:
+    """
+    Box/wedge of every calorimeter cell, as one instance of a unit cube per cell (see controllers/InstancedMesh.py).
+
+    Row i of `instances` (N, 13) float32 places the unit cube [-0.5, 0.5]^3 of cell i:
+        [0:3]   centre (x, y, z) [m]
+        [3]     taper: relative widening of the cell per unit of depth (0 for a box)
+        [4:7]   u, the eta axis scaled by the eta extent of the cell
+        [7:10]  v, the phi axis scaled by the phi extent
+        [10:13] w, the depth axis scaled by the depth, pointing away from the interaction point
+    a corner (a, b, c) of the cube being centre + (a*u + b*v) * (1 + taper*c) + c*w. (u, v, w) are orthogonal and
+    right-handed, so that the faces keep their winding (back faces are culled).
+
+    Barrel layers have their depth along the radius and their eta extent along z; endcap layers have their
+    depth along z and their eta extent along the radius (see cfg.sub_detector_depth_axislist). The extents come from
+    the eta/phi extents of the geometry file at the cell centre, the depth of each layer is cfg.sub_detector_depthlist.
+    """
+    instance_floats = 13
+
+    def __init__(self, instances):
+        self.instances = np.ascontiguousarray(instances, dtype=np.float32).reshape(-1, self.instance_floats)
+
+    @property
+    def nbytes(self) -> int:
+        return self.instances.nbytes
+
+    # (Public) Return the instances of some cells (rows of the geometry, e.g. hit cells), cells of unknown row (-1) being
+    # drawn as cubes of side fallback_size [m] at their coordinates (N, 3)
+    def getInstances(self, cell_rows, cells_coord, fallback_size: float = 0.03) -> np.ndarray:
+        cell_rows = np.asarray(cell_rows)
+        instances = self.instances[np.maximum(cell_rows, 0)]
+        unknown = cell_rows < 0
+        if unknown.any():
+            instances[unknown] = self.boxInstances(np.asarray(cells_coord)[unknown], fallback_size)
+        return instances
+
+    # (Public) Return axis-aligned cubes of side `size` [m] at some positions (N, 3), as instances
+    @staticmethod
+    def boxInstances(centres, size: float) -> np.ndarray:
+        instances = np.zeros((len(centres), CellVolumes.instance_floats), dtype=np.float32)
+        instances[:, 0:3] = centres
+        instances[:, 4], instances[:, 8], instances[:, 12] = size, size, size
+        return instances
+
+    # (Public) Compute the volumes of all cells, grouped by layer (layer i is rows layer_offsets[i]:layer_offsets[i+1]),
+    # in one vectorised pass
+    @staticmethod
+    def fromGeometry(cells_coord, cell_extents, layer_offsets, layer_names: list[str]) -> 'CellVolumes':
+        cells_coord = np.asarray(cells_coord, dtype=np.float64)
+        cell_extents = np.asarray(cell_extents, dtype=np.float64)
+        layer_sizes = np.diff(layer_offsets)
+        depth = np.repeat([cfg.sub_detector_depthlist[cfg.sub_detector_namelist.index(name)] for name in layer_names], layer_sizes)
+        barrel = np.repeat([cfg.sub_detector_depth_axislist[cfg.sub_detector_namelist.index(name)] == "r" for name in layer_names], layer_sizes)
+        projective = np.repeat([name not in cfg.sub_detector_nonprojective_list for name in layer_names], layer_sizes)
+
+        x, y, z = cells_coord[:, 0], cells_coord[:, 1], cells_coord[:, 2]
+        r = np.maximum(np.hypot(x, y), 1e-6)
+        eta = np.arcsinh(z / r)
+        deta, dphi = cell_extents[:, 0], cell_extents[:, 1]
+        z_sign = np.where(z < 0, -1.0, 1.0)
+
+        # Unit vectors along the radius, phi and z at the cell centres
+        e_r = np.stack([x / r, y / r, np.zeros_like(r)], axis=1)
+        e_phi = np.stack([-y / r, x / r, np.zeros_like(r)], axis=1)
+        e_z = np.zeros_like(cells_coord)
+        e_z[:, 2] = 1.0
+
+        # Barrel: z = r*sinh(eta), so dz = r*cosh(eta)*deta; endcap: r = |z|/sinh|eta|, so dr = r*coth|eta|*deta
+        eta_length = np.where(barrel, r * np.cosh(eta) * deta, r * deta / np.maximum(np.abs(np.tanh(eta)), 1e-6))
+        u = np.where(barrel[:, None], e_z, e_r) * eta_length[:, None]
+        v = e_phi * (r * dphi)[:, None]
+        w = np.where(barrel[:, None], e_r, e_z * z_sign[:, None]) * depth[:, None]
+        # Projective cells widen with the distance from the interaction point along their depth axis
+        distance = np.where(barrel, r, np.maximum(np.abs(z), 1e-6))
+        taper = np.where(projective, depth / distance, 0.0)
+        # Right-handed (u, v, w): flip v where it is not
+        flip = np.einsum('ij,ij->i', np.cross(u, v), w) < 0
+        v[flip] = -v[flip]
+
+        instances = np.empty((len(cells_coord), CellVolumes.instance_floats), dtype=np.float32)
+        instances[:, 0:3] = cells_coord
+        instances[:, 3] = taper
+        instances[:, 4:7] = u
+        instances[:, 7:10] = v
+        instances[:, 10:13] = w
+        return CellVolumes(instances)
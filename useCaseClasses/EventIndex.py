@@ -0,0 +1,103 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+from useCaseClasses.EventSource import EventSource, EventColumns
+from useCaseClasses.CacheFiles import CacheFiles
+
+
+class EventIndex:
+    """
+    Event number -> (file, entry) index over one or several event files, persisted on disk.
+
+    Only the event numbers of each file are read to build it (through an EventSource). The index is
+    saved next to the first event file (".calolite_event_index_<key>.npz", the key being a hash of the
+    file list and tree name) together with the size and mtime of every file, so that later launches load it
+    directly and only re-read the files that changed.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, file_names: list[str], tree_name: str, index_path: str = None, progress_callback=None,
+                 event_source: EventSource = None):
+        self.file_names = [os.path.abspath(file_name) for file_name in file_names]
+        self.tree_name = tree_name
+        self.event_source = event_source if event_source is not None else EventSource.forFiles(file_names, tree_name, "")
+        self.index_path = index_path if index_path is not None else self._defaultIndexPath()
+        self.progress_callback = progress_callback
+
+        # Per file event numbers, in entry order
+        self._file_event_numbers = self._loadOrBuild()
+
+        # Global sorted view: sorted_event_numbers[i] is entry sorted_entries[i] of file sorted_file_indices[i]
+        file_event_counts = [len(event_numbers) for event_numbers in self._file_event_numbers]
+        self.file_event_counts = file_event_counts      # number of events of each file
+        all_event_numbers = np.concatenate(self._file_event_numbers) if self._file_event_numbers else np.zeros(0, dtype=np.int64)
+        all_file_indices = np.repeat(np.arange(len(self.file_names), dtype=np.int32), file_event_counts)
+        all_entries = np.concatenate([np.arange(count, dtype=np.int64) for count in file_event_counts]) if file_event_counts else np.zeros(0, dtype=np.int64)
+
+        order = np.argsort(all_event_numbers, kind='stable')
+        self.sorted_event_numbers = all_event_numbers[order]
+        self.sorted_file_indices = all_file_indices[order]
+        self.sorted_entries = all_entries[order]
+
+        n_duplicates = len(self.sorted_event_numbers) - len(np.unique(self.sorted_event_numbers))
+        if n_duplicates > 0:
+            print(f"Warning: {n_duplicates} duplicated event number(s) in {self.tree_name}, only the first occurrence is accessible")
+
+    def __len__(self):
+        return len(self.sorted_event_numbers)
+
+    # (Public) Return (file index, entry) of an event number, None if it is not in the index
+    def lookup(self, evtnum: int):
+        idx = np.searchsorted(self.sorted_event_numbers, evtnum)
+        if idx == len(self.sorted_event_numbers) or self.sorted_event_numbers[idx] != evtnum:
+            return None
+        return int(self.sorted_file_indices[idx]), int(self.sorted_entries[idx])
+
+    def _defaultIndexPath(self) -> str:
+        key = hashlib.sha1("\n".join([self.tree_name] + self.file_names).encode()).hexdigest()[:16]
+        return os.path.join(os.path.dirname(self.file_names[0]), f".calolite_event_index_{key}.npz")
+
+    def _loadOrBuild(self) -> list[np.ndarray]:
+        stored = self._loadStored()
+        file_event_numbers = []
+        n_reindexed = 0
+        for file_idx, file_name in enumerate(self.file_names):
+            file_key = CacheFiles.fileKey(file_name)
+            if file_name in stored and stored[file_name][0] == file_key:
+                file_event_numbers.append(stored[file_name][1])
+                continue
+            if self.progress_callback is not None:
+                self.progress_callback(f"Indexing event file {file_idx+1}/{len(self.file_names)}: {os.path.basename(file_name)}")
+            file_event_numbers.append(np.asarray(self.event_source.readEventNumbers(file_idx), dtype=np.int64))
+            n_reindexed += 1
+
+        if n_reindexed > 0:
+            self._save(file_event_numbers)
+        return file_event_numbers
+
+    def _loadStored(self) -> dict:
+        # file name -> (file key, event numbers)
+        try:
+            with np.load(self.index_path) as stored:
+                meta = json.loads(str(stored["meta"]))
+                if meta.get("format_version") != self.FORMAT_VERSION or meta.get("tree_name") != self.tree_name:
+                    return {}
+                event_numbers, file_offsets = stored["event_numbers"], stored["file_offsets"]
+        except (OSError, KeyError, ValueError):
+            return {}
+        return {file_info["path"]: ({"size": file_info["size"], "mtime_ns": file_info["mtime_ns"]},
+                                    event_numbers[file_offsets[i]:file_offsets[i+1]])
+                for i, file_info in enumerate(meta["files"])}
+
+    def _save(self, file_event_numbers: list[np.ndarray]):
+        file_offsets = EventColumns.countsToOffsets([len(event_numbers) for event_numbers in file_event_numbers])
+        meta = {"format_version": self.FORMAT_VERSION, "tree_name": self.tree_name,
+                "files": [{"path": file_name, **CacheFiles.fileKey(file_name)} for file_name in self.file_names]}
+        event_numbers = np.concatenate(file_event_numbers) if file_event_numbers else np.zeros(0, dtype=np.int64)
+        try:
+            CacheFiles.writeAtomically(self.index_path, lambda tmp_path: np.savez(tmp_path, meta=json.dumps(meta), file_offsets=file_offsets,
+                                                                                  event_numbers=event_numbers))
+        except OSError as e:
+            print(f"Warning: could not write event index to {self.index_path}: {e}")
@@ -1,88 +1,263 @@
-import uproot
+import glob
 import numpy as np
-from tqdm import tqdm
-import awkward as ak
+import threading
+from collections import OrderedDict
+
+from useCaseClasses.EventStore import EventStore
+from useCaseClasses.EventSource import EventSource, EventColumns
+from useCaseClasses.EventIndex import EventIndex
+from useCaseClasses.EventSummary import EventSummary
+from instrumentation.Profiler import profiler
 
 class EventManager:
-    def __init__(self, file_name, tree_name, cell_coord_branch_prefix):
-        self.fileName = file_name
+    def __init__(self, file_name, tree_name, cell_coord_branch_prefix, lazy=False, cache_size=256, 
+                 progress_callback=None, event_numbers_callback=None, step_size="100 MB", index_path=None,
+                 calorimeter_manager=None, load_energies=False):
+        # file_name: a file name, a glob pattern (e.g. "database/pi0_*.root"), or a list of them; ROOT files, or the
+        # Arrow/Parquet files written by convert_events.py (see EventSource)
+        self.fileNames = self._resolveFileNames(file_name)
+        self.fileName = self.fileNames[0]
         self.treeName = tree_name
         self.branch_prefix = cell_coord_branch_prefix
+        self.trajectory_length = 10.0
         
-        with uproot.open(self.fileName) as f:
-            tree = f[self.treeName]
-            
-            self.event_number_awkarr = tree['eventNumber'].array()
-            self.truthPartEta_awkarr = tree['truthPartEta'].array()
-            self.truthPartPhi_awkarr = tree['truthPartPhi'].array()
-            
-            self.cluster_cell_X_awkarr = tree[f'{self.branch_prefix}_X'].array() / 1000 #[m]
-            self.cluster_cell_Y_awkarr = tree[f'{self.branch_prefix}_Y'].array() / 1000 #[m]
-            self.cluster_cell_Z_awkarr = tree[f'{self.branch_prefix}_Z'].array() / 1000 #[m]
+        # Optional hooks for loading in the background: 
+        # progress_callback(message: str), event_numbers_callback(sorted event numbers, np.ndarray) called as soon as they are known
+        self.progress_callback = progress_callback
+        self.event_numbers_callback = event_numbers_callback
+        
+        # Lazy mode: only the event numbers are read at startup, each event's baskets are read on first access
+        self.lazy = lazy
+        self.cache_size = cache_size
+        # Eager mode: size of the chunks the files are streamed in (entries, or a memory size such as "100 MB")
+        self.step_size = step_size
+        
+        # Cell-ID mode (with a CalorimeterManager): the cells are read from the {prefix}_ID branch and stored as
+        # indices into the geometry, instead of reading and storing their X/Y/Z coordinates
+        self.calorimeter_manager = calorimeter_manager
+        self.cell_id_mode = calorimeter_manager is not None
+        self.n_unresolved_cells = 0     # cells whose ID is not in the geometry (dropped), counted by the first pass over all events
+        self._unresolved_counted = False
+        # Passes over all events may run concurrently (summary and occupancy loaders): the count is only set once.
+        # Its own lock, as getEventSummary holds _summary_lock while iterating
+        self._unresolved_lock = threading.Lock()
+        # Optional per-cell energies ({prefix}_E, e.g. to colour the cells by energy)
+        self.load_energies = load_energies
+        # Reader of the event files, from their format
+        self.event_source = EventSource.forFiles(self.fileNames, self.treeName, self.branch_prefix, self.cell_id_mode, self.load_energies)
+        
+        # Event number -> (file, entry), kept on disk and only rebuilt for the files that changed
+        with profiler.span("events.index"):
+            self.event_index = EventIndex(self.fileNames, self.treeName, index_path, progress_callback=self._reportProgress,
+                                          event_source=self.event_source)
+        self._setEventNumbers()
+        
+        # Per-event summaries for the event queries, built on first use (see getEventSummary)
+        self._event_summary = None
+        self._summary_lock = threading.Lock()
+        
+        if self.lazy:
+            self._initLazyEventIndex()
+        else:
+            self._initEagerEventStore()
+        
+    @staticmethod
+    def _resolveFileNames(file_name) -> list[str]:
+        patterns = [file_name] if isinstance(file_name, str) else list(file_name)
+        file_names = []
+        for pattern in patterns:
+            # Plain names are kept even if they do not exist, so that opening them reports the error
+            matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+            if not matches:
+                raise FileNotFoundError(f"No event file matches {pattern}")
+            file_names += matches
+        return file_names
+    
+    def _initEagerEventStore(self):
+        # Stream all files chunk by chunk: only one chunk of raw columns is alive at a time,
+        # each one is converted to a (compact) EventStore before reading the next
+        chunk_stores = []
+        n_read = 0
+        for chunk_store in self.iterateEventStores():
+            chunk_stores.append(chunk_store)
+            n_read += len(chunk_store)
+            self._reportProgress(f"Read {n_read}/{len(self.event_index)} events")
             
-
-        self.trajectory_length = 10.0
-        self.map_evtnum_truthPartEndTrajEtaPhi = {}
-        self._storeMapTrajEtaPhi()
-        print("Finished Loading all Events EtaPhi Trajectory")
-        self.map_evtnum_truthPartEndTrajXYZ = {}
-        self._storeMapTrajXYZ()
-        print("Finished Loading all Events XYZ Trajectory")
-        self.map_evtnum_ClustersCellsCoord = {}
-        self._storeMapClustersCellsCoor()
-        print("Finished Loading all Events Cluster Cells Coordinates")
-        
-        self.event_number_sorted_list = sorted(self.event_number_awkarr.tolist())
+        with profiler.span("events.concatenate"):
+            if not chunk_stores:
+                # No events in the files: an empty store of the same mode
+                self.event_store = EventStore.empty(self.calorimeter_manager.cells_coord if self.cell_id_mode else None,
+                                                    self.load_energies)
+            else:
+                self.event_store = EventStore.concatenate(chunk_stores) if len(chunk_stores) != 1 else chunk_stores[0]
+        self._reportProgress(f"Finished Loading all Events ({len(self.event_store)} events from {len(self.fileNames)} file(s), "
+                             f"{self.event_store.n_cells} cluster cells, {self.event_store.nbytes / 1024**2:.1f} MB)")
+        
+    # (Public) Yield one EventStore per chunk of step_size read from the files (default: all event files), in file order,
+    # without keeping them: e.g. to accumulate over all events with bounded memory
+    def iterateEventStores(self, file_names: list[str] = None):
+        file_indices = None if file_names is None else [self.fileNames.index(file_name) for file_name in file_names]
+        n_unresolved = 0
+        for columns in self.event_source.iterateColumns(file_indices, self.step_size):
+            chunk_store, n_chunk_unresolved = self._makeEventStore(columns)
+            n_unresolved += n_chunk_unresolved
+            yield chunk_store
+        # The first complete pass over all events (the eager loading, or the event summary in lazy mode) gives the
+        # number of dropped cells; single events and later passes are not counted again
+        if file_names is None:
+            with self._unresolved_lock:
+                first_pass = not self._unresolved_counted
+                self._unresolved_counted = True
+                if first_pass:
+                    self.n_unresolved_cells = n_unresolved
+            if first_pass and n_unresolved > 0:
+                print(f"Warning: {n_unresolved} cluster cell(s) with an ID not in the geometry were dropped")
+        
+    def _initLazyEventIndex(self):
+        # event number -> single-event EventStore, least recently used first
+        self._decoded_event_cache = OrderedDict()
+        # Events may be requested from worker threads (see EventPrefetcher)
+        self._cache_lock = threading.Lock()
+        self._reportProgress(f"Indexed {len(self.event_index)} events in {len(self.fileNames)} file(s) (lazy loading)")
         
     # (Public) Return a list of all event numbers
     def getEventNumbers(self):
         return self.event_number_sorted_list
     
     def getTruthEndTrajXYZforAnEvent(self, evtnum: int):
-        return self.map_evtnum_truthPartEndTrajXYZ[evtnum]
+        return self._getEventStore(evtnum).getTruthEndTrajXYZ(evtnum)
     
     def getTruthEndTrajEtaPhiforAnEvent(self, evtnum: int):
-        return self.map_evtnum_truthPartEndTrajEtaPhi[evtnum]
+        return self._getEventStore(evtnum).getTruthEndTrajEtaPhi(evtnum)
     
+    # Returns a list of (n_cells, 3) arrays, one per cluster
     def getClustersCellsCoordforAnEvent(self, evtnum: int):
-        return self.map_evtnum_ClustersCellsCoord[evtnum]
+        return self._getEventStore(evtnum).getClustersCellsCoord(evtnum)
+    
+    # Returns (cells_coord, cluster_offsets): all cells of the event as one (N, 3) float32 array, 
+    # with cluster k being cells_coord[cluster_offsets[k]:cluster_offsets[k+1]]
+    def getClustersCellsArrayforAnEvent(self, evtnum: int):
+        return self._getEventStore(evtnum).getClustersCellsArray(evtnum)
+    
+    # Cell-ID mode only: returns (cell_indices, cluster_offsets), the rows of the cells of the event in the 
+    # CalorimeterManager arrays (e.g. calorimeter_manager.getCellLayers(cell_indices) gives their sampling layers)
+    def getClustersCellIndicesforAnEvent(self, evtnum: int):
+        return self._getEventStore(evtnum).getClustersCellIndices(evtnum)
+    
+    # Energy mode only (load_energies): returns the (N,) energies [MeV] of the cells of the event, in the order of getClustersCellsArrayforAnEvent
+    def getClustersCellEnergiesforAnEvent(self, evtnum: int):
+        return self._getEventStore(evtnum).getClustersCellEnergies(evtnum)
+    
+    # (Public) Return the per-event summaries of all events (EventSummary), e.g. to select events with
+    # getEventSummary().query("n_clusters >= 3"). Computed once: from the in-memory store in eager mode, by
+    # streaming the files once in lazy mode. The cells per layer are included when a CalorimeterManager is known
+    # (given here or in cell-ID mode); a summary computed without it is recomputed once it is given.
+    def getEventSummary(self, calorimeter_manager=None) -> EventSummary:
+        calorimeter_manager = calorimeter_manager if calorimeter_manager is not None else self.calorimeter_manager
+        with self._summary_lock:
+            if self._event_summary is None or (calorimeter_manager is not None and not self._event_summary.has_layers):
+                with profiler.span("events.summary"):
+                    if self.lazy:
+                        chunk_summaries = [EventSummary.fromEventStore(chunk_store, calorimeter_manager) for chunk_store in self.iterateEventStores()]
+                        self._event_summary = (EventSummary.concatenate(chunk_summaries) if chunk_summaries
+                                               else EventSummary.fromEventStore(EventStore.empty(), calorimeter_manager))
+                    else:
+                        self._event_summary = EventSummary.fromEventStore(self.event_store, calorimeter_manager)
+            return self._event_summary
     
+    # (Public) Release the file handles held open (lazy mode)
+    def close(self):
+        self.event_source.close()
     
-    def _storeMapClustersCellsCoor(self):
-        coords_awk = ak.zip([self.cluster_cell_X_awkarr, self.cluster_cell_Y_awkarr, self.cluster_cell_Z_awkarr])
-        coords_list_of_lists_of_tuples = ak.to_list(coords_awk)
+    
+    def _setEventNumbers(self):
+        self.event_number_sorted_list = self.event_index.sorted_event_numbers.tolist()
+        if self.event_numbers_callback is not None:
+            self.event_numbers_callback(self.event_index.sorted_event_numbers)
+    
+    def _reportProgress(self, message: str):
+        print(message)
+        if self.progress_callback is not None:
+            self.progress_callback(message)
+    
+    # Return the EventStore holding a given event
+    def _getEventStore(self, evtnum: int) -> EventStore:
+        if self.lazy:
+            return self._getDecodedEvent(evtnum)
+        return self.event_store
+    
+    
+    # =========================================================
+    # Lazy mode: per-event reading with a bounded LRU cache
+    
+    def _getDecodedEvent(self, evtnum: int) -> EventStore:
+        with self._cache_lock:
+            if evtnum in self._decoded_event_cache:
+                self._decoded_event_cache.move_to_end(evtnum)
+                return self._decoded_event_cache[evtnum]
         
-        for i, evtnum in tqdm(enumerate(self.event_number_awkarr), desc="Processing Clusters Cells Coordinates", total=len(self.event_number_awkarr)):
-            clusters_data_for_event = coords_list_of_lists_of_tuples[i]
-            self.map_evtnum_ClustersCellsCoord[evtnum] = [[tuple(cell_coords) for cell_coords in cluster_data] for cluster_data in clusters_data_for_event]
+        location = self.event_index.lookup(evtnum)
+        if location is None:
+            raise KeyError(evtnum)
+        decoded_event = self._readAndDecodeEntry(*location)
+        with self._cache_lock:
+            self._decoded_event_cache[evtnum] = decoded_event
+            while len(self._decoded_event_cache) > self.cache_size:
+                self._decoded_event_cache.popitem(last=False)
+        return decoded_event
     
-    def _calculateTruthTrajectoryXYZ(self):
-        theta = 2 * np.arctan(np.exp(self.truthPartEta_awkarr))
-        r = self.trajectory_length * np.sin(theta)
+    def _readAndDecodeEntry(self, file_idx: int, entry: int) -> EventStore:
+        return self._makeEventStore(self.event_source.readEntry(file_idx, entry))[0]
+    
+    
+    # =========================================================
+    # Conversion of the columns read by the event source into the columnar EventStore
+    
+    # Returns (store, number of cells dropped for an unknown ID)
+    def _makeEventStore(self, columns: EventColumns) -> tuple[EventStore, int]:
+        cluster_cell_offsets = columns.cluster_cell_offsets
+        cell_energies = columns.cell_energies
+        n_unresolved = 0
+        if self.cell_id_mode:
+            cell_indices, n_cells_per_cluster, resolved = self._resolveCellIDs(columns.cell_ids, np.diff(cluster_cell_offsets))
+            if resolved is not None:
+                n_unresolved = int(len(resolved) - resolved.sum())
+                cluster_cell_offsets = EventColumns.countsToOffsets(n_cells_per_cluster)
+                if cell_energies is not None:
+                    cell_energies = cell_energies[resolved]
+        else:
+            cell_indices = None
         
-        x = r * np.cos(self.truthPartPhi_awkarr)
-        y = r * np.sin(self.truthPartPhi_awkarr)
-        z = 0.5 * r * (np.exp(self.truthPartEta_awkarr) - np.exp(-self.truthPartEta_awkarr))
+        eta = np.asarray(columns.truth_eta, dtype=np.float64)
+        phi = np.asarray(columns.truth_phi, dtype=np.float64)
+        traj_xyz = np.column_stack(self._calculateTruthTrajectoryXYZ(eta, phi))
         
-        return x, y, z
+        return EventStore(columns.event_numbers, columns.event_cluster_offsets, cluster_cell_offsets, columns.cells_coord,
+                          columns.event_particle_offsets, np.column_stack((eta, phi)), traj_xyz,
+                          cell_indices=cell_indices, 
+                          geometry_cells_coord=self.calorimeter_manager.cells_coord if self.cell_id_mode else None,
+                          cell_energies=cell_energies), n_unresolved
+    
+    def _resolveCellIDs(self, cell_ids, n_cells_per_cluster):
+        # Cell IDs -> geometry rows; cells with an unknown ID are dropped and the cluster sizes recounted
+        # Returns (cell indices, cells per cluster, mask of the kept cells or None if all are kept)
+        cell_indices = self.calorimeter_manager.findCellIndices(cell_ids)
+        resolved = cell_indices >= 0
+        if resolved.all():
+            return cell_indices, n_cells_per_cluster, None
+        cell_cluster = np.repeat(np.arange(len(n_cells_per_cluster)), n_cells_per_cluster)
+        n_cells_per_cluster = np.bincount(cell_cluster[resolved], minlength=len(n_cells_per_cluster))
+        return cell_indices[resolved], n_cells_per_cluster, resolved
         
-    def _storeMapTrajXYZ(self):
-        truthPartX_awkarr, truthPartY_awkarr, truthPartZ_awkarr = self._calculateTruthTrajectoryXYZ()
-        xyz_awk = ak.zip([truthPartX_awkarr, truthPartY_awkarr, truthPartZ_awkarr])
-        xyz_awk_list = ak.to_list(xyz_awk)
-
-        for i, evtnum in tqdm(enumerate(self.event_number_awkarr), desc="Processing Trajectory XYZ", total=len(self.event_number_awkarr)):
-            xyz_awk_for_event = xyz_awk_list[i]
-            self.map_evtnum_truthPartEndTrajXYZ[evtnum] = [tuple(xyz_traj) for xyz_traj in xyz_awk_for_event]
-
-            
-    def _storeMapTrajEtaPhi(self):
-        eta_phi_awk = ak.zip([self.truthPartEta_awkarr, self.truthPartPhi_awkarr])
-        eta_phi_awk_list = ak.to_list(eta_phi_awk)
+    def _calculateTruthTrajectoryXYZ(self, truthPartEta, truthPartPhi):
+        theta = 2 * np.arctan(np.exp(truthPartEta))
+        r = self.trajectory_length * np.sin(theta)
         
-        for i, evtnum in tqdm(enumerate(self.event_number_awkarr), desc="Processing Trajectory EtaPhi", total=len(self.event_number_awkarr)):
-            eta_phi_awk_for_event = eta_phi_awk_list[i]
-            self.map_evtnum_truthPartEndTrajEtaPhi[evtnum] = [tuple(eta_phi_traj) for eta_phi_traj in eta_phi_awk_for_event]
+        x = r * np.cos(truthPartPhi)
+        y = r * np.sin(truthPartPhi)
+        z = 0.5 * r * (np.exp(truthPartEta) - np.exp(-truthPartEta))
+        
+        return x, y, z
             
 #if __name__ == '__main__':
-#    EventManager("../database/piplus.mltree.root")
\ No newline at end of file
+#    EventManager("../database/piplus.mltree.root")
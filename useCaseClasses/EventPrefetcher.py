@@ -0,0 +1,132 @@
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import numpy as np
+
+from useCaseClasses.EventManager import EventManager
+from useCaseClasses.LayeredEventCells import LayeredEventCells
+
+
+class PreparedEvent:
+    """
+    Render-ready data of one event: contiguous float32 arrays that can be uploaded to the GPU as-is,
+    and the cells regrouped by layer once the geometry is known (layered_cells, otherwise None).
+    cell_energies (aligned with cells_coord) is only set when the event manager loads the energies.
+    """
+    def __init__(self, evtnum: int, traj_xyz, traj_eta_phi, cells_coord, cluster_offsets, layered_cells: LayeredEventCells = None,
+                 cell_energies=None):
+        self.evtnum = evtnum
+        self.traj_xyz = np.ascontiguousarray(traj_xyz, dtype=np.float32)           # (n_particles, 3)
+        self.traj_eta_phi = np.ascontiguousarray(traj_eta_phi, dtype=np.float32)   # (n_particles, 2)
+        self.cells_coord = np.ascontiguousarray(cells_coord, dtype=np.float32)     # (n_cells, 3)
+        self.cluster_offsets = np.asarray(cluster_offsets, dtype=np.int64)         # (n_clusters+1,)
+        self.layered_cells = layered_cells
+        self.cell_energies = None if cell_energies is None else np.ascontiguousarray(cell_energies, dtype=np.float32)   # (n_cells,)
+        self.nbytes = sum(arr.nbytes for arr in (self.traj_xyz, self.traj_eta_phi, self.cells_coord, self.cluster_offsets,
+                                                 self.cell_energies) if arr is not None)
+        if layered_cells is not None:
+            self.nbytes += layered_cells.nbytes
+
+
+class EventPrefetcher:
+    """
+    Prepares the events around the displayed one on a worker thread pool.
+
+    After an event is displayed, prefetchAround() queues the next and previous `radius` events
+    (in getEventNumbers() order, nearest first) so that stepping through the event list finds
+    them already decoded. Prepared events are kept in an LRU cache bounded by `cache_budget_mb`.
+    """
+    def __init__(self, eventManager: EventManager, radius: int = 5, cache_budget_mb: float = 256, max_workers: int = 2):
+        self.eventManager = eventManager
+        self.calorimeterManager = None      # Set once the geometry is loaded, to group the cells by layer
+        self.radius = radius
+        self.cache_budget_bytes = int(cache_budget_mb * 1024**2)
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="EventPrefetcher")
+        self._lock = threading.RLock()
+        self._prepared_events = OrderedDict()   # evtnum -> PreparedEvent, least recently used first
+        self._cached_bytes = 0
+        self._pending = {}                      # evtnum -> Future, queued or running
+
+    # (Public) Return the PreparedEvent of an event, from the cache if possible, otherwise prepared right away
+    def getPreparedEvent(self, evtnum: int) -> PreparedEvent:
+        with self._lock:
+            prepared_event = self._prepared_events.get(evtnum)
+            if prepared_event is not None:
+                self._prepared_events.move_to_end(evtnum)
+                return prepared_event
+            future = self._pending.get(evtnum)
+
+        # Already running on a worker: wait for it, still queued: do it here instead of waiting for the queue
+        if future is not None and not future.cancel():
+            return future.result()
+        prepared_event = self._prepareEvent(evtnum)
+        with self._lock:
+            self._storePreparedEvent(prepared_event)
+        return prepared_event
+
+    # (Public) Queue the preparation of the neighbours of an event, dropping queued work that is no longer nearby
+    def prefetchAround(self, evtnum: int):
+        if self.radius <= 0:
+            return
+
+        event_numbers = self.eventManager.getEventNumbers()
+        idx = bisect_left(event_numbers, evtnum)
+        neighbours = []
+        for offset in range(1, self.radius + 1):
+            for neighbour_idx in (idx + offset, idx - offset):
+                if 0 <= neighbour_idx < len(event_numbers):
+                    neighbours.append(event_numbers[neighbour_idx])
+
+        with self._lock:
+            neighbours_set = set(neighbours)
+            for pending_evtnum, future in list(self._pending.items()):
+                if pending_evtnum not in neighbours_set and future.cancel():
+                    self._pending.pop(pending_evtnum, None)
+
+            for neighbour in neighbours:
+                if neighbour in self._prepared_events or neighbour in self._pending:
+                    continue
+                future = self._executor.submit(self._prepareEvent, neighbour)
+                self._pending[neighbour] = future
+                future.add_done_callback(partial(self._onEventPrepared, neighbour))
+
+    # (Public) Group the cells of the events prepared from now on by layer
+    def setCalorimeterManager(self, calorimeterManager):
+        self.calorimeterManager = calorimeterManager
+
+    # (Public) Stop the workers, dropping all queued work
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def _prepareEvent(self, evtnum: int) -> PreparedEvent:
+        traj_xyz = self.eventManager.getTruthEndTrajXYZforAnEvent(evtnum)
+        traj_eta_phi = self.eventManager.getTruthEndTrajEtaPhiforAnEvent(evtnum)
+        cells_coord, cluster_offsets = self.eventManager.getClustersCellsArrayforAnEvent(evtnum)
+        layered_cells = None
+        calorimeterManager = self.calorimeterManager
+        if calorimeterManager is not None:
+            layered_cells = LayeredEventCells.fromEvent(self.eventManager, calorimeterManager, evtnum, cells_coord, cluster_offsets)
+        cell_energies = self.eventManager.getClustersCellEnergiesforAnEvent(evtnum) if self.eventManager.load_energies else None
+        return PreparedEvent(evtnum, traj_xyz, traj_eta_phi, cells_coord, cluster_offsets, layered_cells, cell_energies)
+
+    def _onEventPrepared(self, evtnum: int, future):
+        with self._lock:
+            if self._pending.get(evtnum) is future:
+                del self._pending[evtnum]
+            if future.cancelled() or future.exception() is not None:
+                return
+            self._storePreparedEvent(future.result())
+
+    def _storePreparedEvent(self, prepared_event: PreparedEvent):
+        if prepared_event.evtnum in self._prepared_events:
+            return
+        self._prepared_events[prepared_event.evtnum] = prepared_event
+        self._cached_bytes += prepared_event.nbytes
+        # Evict least recently used events until back under budget (always keeping the newest one)
+        while self._cached_bytes > self.cache_budget_bytes and len(self._prepared_events) > 1:
+            _, evicted_event = self._prepared_events.popitem(last=False)
+            self._cached_bytes -= evicted_event.nbytes
@@ -0,0 +1,89 @@
+import os
+import numpy as np
+from abc import ABC, abstractmethod
+
+
+class EventColumns:
+    """
+    Columns of a chunk of events as read by an EventSource, before the conversion into an EventStore:
+    CSR offsets (clusters of each event, cells of each cluster, truth particles of each event, starting at 0)
+    and flat per-cell / per-particle arrays. The cells are given either as (N, 3) coordinates [m] or as (N,) cell IDs
+    (cell-ID mode), with their (N,) energies [MeV] when requested.
+    """
+    def __init__(self, event_numbers, event_cluster_offsets, cluster_cell_offsets, event_particle_offsets, truth_eta, truth_phi,
+                 cells_coord=None, cell_ids=None, cell_energies=None):
+        self.event_numbers = event_numbers                      # (E,)
+        self.event_cluster_offsets = event_cluster_offsets      # (E+1,)
+        self.cluster_cell_offsets = cluster_cell_offsets        # (C+1,)
+        self.event_particle_offsets = event_particle_offsets    # (E+1,)
+        self.truth_eta = truth_eta                              # (P,)
+        self.truth_phi = truth_phi                              # (P,)
+        self.cells_coord = cells_coord                          # (N, 3) [m], or None in cell-ID mode
+        self.cell_ids = cell_ids                                # (N,), cell-ID mode only
+        self.cell_energies = cell_energies                      # (N,) [MeV], or None
+
+    def __len__(self):
+        return len(self.event_numbers)
+
+    # (Public) Return the CSR offsets (len(counts)+1,) int64 of items counted per row, starting at 0
+    @staticmethod
+    def countsToOffsets(counts) -> np.ndarray:
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return offsets
+
+
+class EventSource(ABC):
+    """
+    Where EventManager reads the events from: a list of event files of one format, read file by file (index,
+    eager streaming) or entry by entry (lazy mode), and always returned as EventColumns.
+
+    The cells are read from the columns/branches prefixed by `branch_prefix`: their coordinates, or their IDs in
+    cell-ID mode, plus their energies if load_energies. Implementations: ROOTEventSource (ROOT trees, uproot) and
+    ArrowEventSource (Arrow IPC / Parquet files written by convert_events.py, pyarrow); EventSource.forFiles picks
+    one from the file extension.
+    """
+    # Extensions of the files read by ArrowEventSource, all others are read as ROOT files
+    arrow_extensions = (".arrow", ".feather", ".ipc")
+    parquet_extensions = (".parquet", ".pq")
+
+    def __init__(self, file_names: list[str], tree_name: str, branch_prefix: str, cell_id_mode: bool = False, load_energies: bool = False):
+        self.file_names = list(file_names)
+        self.tree_name = tree_name
+        self.branch_prefix = branch_prefix
+        self.cell_id_mode = cell_id_mode
+        self.load_energies = load_energies
+
+    # (Public) Return the source reading a list of event files, from their extension (all files must have the same format)
+    @staticmethod
+    def forFiles(file_names: list[str], tree_name: str, branch_prefix: str, cell_id_mode: bool = False,
+                 load_energies: bool = False) -> 'EventSource':
+        columnar_extensions = EventSource.arrow_extensions + EventSource.parquet_extensions
+        is_columnar = [os.path.splitext(file_name)[1].lower() in columnar_extensions for file_name in file_names]
+        if any(is_columnar) and not all(is_columnar):
+            raise ValueError("Event files must all be ROOT files or all be Arrow/Parquet files")
+        if all(is_columnar):
+            from useCaseClasses.ArrowEventSource import ArrowEventSource
+            return ArrowEventSource(file_names, tree_name, branch_prefix, cell_id_mode, load_energies)
+        from useCaseClasses.ROOTEventSource import ROOTEventSource
+        return ROOTEventSource(file_names, tree_name, branch_prefix, cell_id_mode, load_energies)
+
+    # (Public) Return the event numbers of a file, in entry order
+    @abstractmethod
+    def readEventNumbers(self, file_idx: int) -> np.ndarray:
+        pass
+
+    # (Public) Yield the events of some files (default: all), in file and entry order, one chunk of step_size at a time
+    # (a number of entries or a memory size such as "100 MB"; sources with a chunking of their own may ignore it)
+    @abstractmethod
+    def iterateColumns(self, file_indices: list[int] = None, step_size="100 MB"):
+        pass
+
+    # (Public) Return the columns of a single entry of a file (lazy mode, may be called from worker threads)
+    @abstractmethod
+    def readEntry(self, file_idx: int, entry: int) -> EventColumns:
+        pass
+
+    # (Public) Release the file handles kept open
+    def close(self):
+        pass
@@ -0,0 +1,157 @@
+import numpy as np
+
+
+class EventStore:
+    """
+    Columnar (CSR-style) in-memory storage for the cluster cells and truth particles of a set of events.
+
+    All cell coordinates of all events live in one flat (N, 3) float32 array; offsets arrays give,
+    for each event, the range of its clusters, and for each cluster, the range of its cells:
+        cells of cluster c          -> cells_coord[cluster_cell_offsets[c] : cluster_cell_offsets[c+1]]
+        clusters of event (row) i   -> event_cluster_offsets[i] : event_cluster_offsets[i+1]
+    Truth particles are stored the same way with event_particle_offsets.
+    Rows are in file order; event numbers are looked up through a sorted copy with np.searchsorted,
+    and every getter returns NumPy views into the flat arrays (no copy of the coordinates).
+
+    In cell-ID mode (cell_indices given instead of cells_coord), each cell is stored as an int32 row
+    index into the geometry coordinates (`geometry_cells_coord`, see CalorimeterManager), a third of
+    the memory of its coordinates; getClustersCellsArray then gathers the coordinates of the event.
+
+    The cell energies (optional, `cell_energies`) are stored as one flat float32 array aligned with the cells.
+    """
+    def __init__(self, event_numbers, event_cluster_offsets, cluster_cell_offsets, cells_coord,
+                 event_particle_offsets, truth_eta_phi, truth_traj_xyz, cell_indices=None, geometry_cells_coord=None,
+                 cell_energies=None):
+        self.event_numbers = np.asarray(event_numbers, dtype=np.int64)                       # (E,)
+        self.event_cluster_offsets = np.asarray(event_cluster_offsets, dtype=np.int64)       # (E+1,)
+        self.cluster_cell_offsets = np.asarray(cluster_cell_offsets, dtype=np.int64)         # (C+1,)
+        if cell_indices is not None:
+            self.cells_coord = None
+            self.cell_indices = np.ascontiguousarray(cell_indices, dtype=np.int32)                   # (N,)
+        else:
+            self.cells_coord = np.ascontiguousarray(cells_coord, dtype=np.float32).reshape(-1, 3)    # (N, 3) [m]
+            self.cell_indices = None
+        self.geometry_cells_coord = geometry_cells_coord                                     # shared, not owned
+        self.cell_energies = None if cell_energies is None else np.ascontiguousarray(cell_energies, dtype=np.float32)  # (N,) [MeV]
+        self.event_particle_offsets = np.asarray(event_particle_offsets, dtype=np.int64)     # (E+1,)
+        self.truth_eta_phi = np.ascontiguousarray(truth_eta_phi, dtype=np.float32).reshape(-1, 2)    # (P, 2)
+        self.truth_traj_xyz = np.ascontiguousarray(truth_traj_xyz, dtype=np.float32).reshape(-1, 3)  # (P, 3) [m]
+
+        # Sorted event numbers, and the row each of them is stored at
+        self._sorted_rows = np.argsort(self.event_numbers, kind='stable')
+        self.sorted_event_numbers = self.event_numbers[self._sorted_rows]
+
+    # (Public) Return a store without events, in cell-ID mode if geometry_cells_coord is given (e.g. for an empty file)
+    @staticmethod
+    def empty(geometry_cells_coord=None, with_energies=False) -> 'EventStore':
+        cell_id_mode = geometry_cells_coord is not None
+        return EventStore(np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64),
+                          None if cell_id_mode else np.empty((0, 3), dtype=np.float32), np.zeros(1, dtype=np.int64),
+                          np.empty((0, 2), dtype=np.float32), np.empty((0, 3), dtype=np.float32),
+                          cell_indices=np.empty(0, dtype=np.int32) if cell_id_mode else None,
+                          geometry_cells_coord=geometry_cells_coord,
+                          cell_energies=np.empty(0, dtype=np.float32) if with_energies else None)
+
+    # (Public) Merge several stores (e.g. read chunk by chunk) into one, rows keep their order; no stores gives
+    # an empty store (without cell IDs nor energies, see empty)
+    @staticmethod
+    def concatenate(stores: list['EventStore']) -> 'EventStore':
+        if not stores:
+            return EventStore.empty()
+        def concatenate_offsets(offsets_list):
+            # Shift each offsets array by the number of items before it, dropping the duplicated boundaries
+            shifted, base = [np.zeros(1, dtype=np.int64)], 0
+            for offsets in offsets_list:
+                shifted.append(offsets[1:] + base)
+                base += offsets[-1]
+            return np.concatenate(shifted)
+
+        cell_id_mode = stores[0].cell_indices is not None
+        with_energies = stores[0].cell_energies is not None
+        return EventStore(np.concatenate([store.event_numbers for store in stores]),
+                          concatenate_offsets([store.event_cluster_offsets for store in stores]),
+                          concatenate_offsets([store.cluster_cell_offsets for store in stores]),
+                          None if cell_id_mode else np.concatenate([store.cells_coord for store in stores]),
+                          concatenate_offsets([store.event_particle_offsets for store in stores]),
+                          np.concatenate([store.truth_eta_phi for store in stores]),
+                          np.concatenate([store.truth_traj_xyz for store in stores]),
+                          cell_indices=np.concatenate([store.cell_indices for store in stores]) if cell_id_mode else None,
+                          geometry_cells_coord=stores[0].geometry_cells_coord,
+                          cell_energies=np.concatenate([store.cell_energies for store in stores]) if with_energies else None)
+
+    def __len__(self):
+        return len(self.event_numbers)
+
+    def __contains__(self, evtnum):
+        return self.findRow(evtnum) is not None
+
+    # Number of cluster cells of all events
+    @property
+    def n_cells(self) -> int:
+        return int(self.cluster_cell_offsets[-1])
+
+    # Memory held by the store (the geometry coordinates shared in cell-ID mode are not counted)
+    @property
+    def nbytes(self) -> int:
+        return sum(arr.nbytes for arr in (self.event_numbers, self.event_cluster_offsets, self.cluster_cell_offsets,
+                                          self.cells_coord, self.cell_indices, self.cell_energies, self.event_particle_offsets, self.truth_eta_phi,
+                                          self.truth_traj_xyz, self._sorted_rows, self.sorted_event_numbers) if arr is not None)
+
+    # (Public) Return the row index of an event number, None if it is not stored
+    def findRow(self, evtnum: int):
+        idx = np.searchsorted(self.sorted_event_numbers, evtnum)
+        if idx == len(self.sorted_event_numbers) or self.sorted_event_numbers[idx] != evtnum:
+            return None
+        return int(self._sorted_rows[idx])
+
+    def _getRow(self, evtnum: int) -> int:
+        row = self.findRow(evtnum)
+        if row is None:
+            raise KeyError(evtnum)
+        return row
+
+    def _getCellRange(self, evtnum: int):
+        # Return (first cell, last cell + 1, cluster offsets relative to the first cell) of an event
+        row = self._getRow(evtnum)
+        clus_start, clus_end = self.event_cluster_offsets[row], self.event_cluster_offsets[row+1]
+        cluster_offsets = self.cluster_cell_offsets[clus_start:clus_end+1]
+        return cluster_offsets[0], cluster_offsets[-1], cluster_offsets - cluster_offsets[0]
+
+    # (Public) Return (cells_coord, cluster_offsets) of an event:
+    # cells_coord is a (N, 3) array of all cells of the event (a view, or a gathered copy in cell-ID mode),
+    # cluster k is cells_coord[cluster_offsets[k]:cluster_offsets[k+1]]
+    def getClustersCellsArray(self, evtnum: int):
+        start, end, cluster_offsets = self._getCellRange(evtnum)
+        if self.cell_indices is not None:
+            return self.geometry_cells_coord[self.cell_indices[start:end]], cluster_offsets
+        return self.cells_coord[start:end], cluster_offsets
+
+    # (Public) Cell-ID mode only: return (cell_indices, cluster_offsets) of an event,
+    # cell_indices being a (N,) view of the geometry rows of all cells of the event
+    def getClustersCellIndices(self, evtnum: int):
+        if self.cell_indices is None:
+            raise ValueError("Cell indices are only stored in cell-ID mode")
+        start, end, cluster_offsets = self._getCellRange(evtnum)
+        return self.cell_indices[start:end], cluster_offsets
+
+    # (Public) Return a (N,) view of the energies of all cells of an event, in the order of getClustersCellsArray
+    def getClustersCellEnergies(self, evtnum: int):
+        if self.cell_energies is None:
+            raise ValueError("Cell energies are not stored (see EventManager load_energies)")
+        start, end, _ = self._getCellRange(evtnum)
+        return self.cell_energies[start:end]
+
+    # (Public) Return a list of (n_cells, 3) views, one per cluster of the event
+    def getClustersCellsCoord(self, evtnum: int):
+        cells_coord, cluster_offsets = self.getClustersCellsArray(evtnum)
+        return [cells_coord[start:end] for start, end in zip(cluster_offsets[:-1], cluster_offsets[1:])]
+
+    # (Public) Return a (n_particles, 3) view of the truth trajectory end points of an event
+    def getTruthEndTrajXYZ(self, evtnum: int):
+        row = self._getRow(evtnum)
+        return self.truth_traj_xyz[self.event_particle_offsets[row]:self.event_particle_offsets[row+1]]
+
+    # (Public) Return a (n_particles, 2) view of the truth (eta, phi) of an event
+    def getTruthEndTrajEtaPhi(self, evtnum: int):
+        row = self._getRow(evtnum)
+        return self.truth_eta_phi[self.event_particle_offsets[row]:self.event_particle_offsets[row+1]]
@@ -0,0 +1,170 @@
+import ast
+import functools
+import operator
+import numpy as np
+
+from useCaseClasses.EventStore import EventStore
+
+
+class EventSummary:
+    """
+    Columnar per-event summaries of an event sample, for selecting events with filter expressions.
+
+    Every column is a NumPy array with one entry per event (same row order as the EventStore it was
+    computed from), so that a query is evaluated over all events at once:
+        event                   event number
+        n_particles             number of truth particles
+        eta, phi                truth (Eta, Phi) of the first truth particle (NaN without particle)
+        n_clusters              number of clusters
+        n_cells                 number of cluster cells (all clusters)
+        max_cluster_cells       cells of the largest / smallest cluster (0 without cluster)
+        min_cluster_cells
+        cells_<layer>           cluster cells in each sampling layer (e.g. cells_EMB2), only when the
+                                summary is computed with a CalorimeterManager
+    Queries are Python-like expressions over the column names, e.g.
+        "1.3 <= eta <= 1.6 and n_clusters >= 3 and n_cells > 200"
+    with comparisons (chained or not), and/or/not, + - * / %, parentheses and abs(). They are parsed
+    with the ast module and evaluated column-wise with NumPy (no eval of arbitrary code). A division or
+    modulo by a constant zero is rejected; rows where a column divisor is zero have no value (NaN), so
+    that no comparison on them is true.
+    """
+    def __init__(self, columns: dict[str, np.ndarray]):
+        self.columns = columns
+        self.has_layers = any(name.startswith("cells_") for name in columns)
+
+    def __len__(self):
+        return len(self.columns["event"])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns.values())
+
+    # (Public) Compute the summaries of all events of a store in one vectorised pass;
+    # with a CalorimeterManager, the cluster cells are also counted per sampling layer
+    @staticmethod
+    def fromEventStore(store: EventStore, calorimeter_manager=None) -> 'EventSummary':
+        n_events = len(store)
+        n_particles = np.diff(store.event_particle_offsets)
+        n_clusters = np.diff(store.event_cluster_offsets)
+        cluster_sizes = np.diff(store.cluster_cell_offsets)
+        cell_offsets = store.cluster_cell_offsets[store.event_cluster_offsets]
+        n_cells = np.diff(cell_offsets)
+
+        # First truth particle of each event
+        has_particle = n_particles > 0
+        first_particle = store.event_particle_offsets[:-1][has_particle]
+        eta = np.full(n_events, np.nan, dtype=np.float32)
+        phi = np.full(n_events, np.nan, dtype=np.float32)
+        eta[has_particle] = store.truth_eta_phi[first_particle, 0]
+        phi[has_particle] = store.truth_eta_phi[first_particle, 1]
+
+        # Largest / smallest cluster: reduceat over the clusters of each event (events without cluster set to 0)
+        has_cluster = n_clusters > 0
+        max_cluster_cells = np.zeros(n_events, dtype=np.int64)
+        min_cluster_cells = np.zeros(n_events, dtype=np.int64)
+        if has_cluster.any():
+            first_cluster = store.event_cluster_offsets[:-1][has_cluster]
+            max_cluster_cells[has_cluster] = np.maximum.reduceat(cluster_sizes, first_cluster)
+            min_cluster_cells[has_cluster] = np.minimum.reduceat(cluster_sizes, first_cluster)
+
+        columns = {"event": store.event_numbers, "n_particles": n_particles, "eta": eta, "phi": phi,
+                   "n_clusters": n_clusters, "n_cells": n_cells,
+                   "max_cluster_cells": max_cluster_cells, "min_cluster_cells": min_cluster_cells}
+
+        if calorimeter_manager is not None:
+            # Cells per (event, layer) with one bincount; cells of unknown layer (-1) are not counted
+            if store.cell_indices is not None:
+                cell_indices = store.cell_indices
+            else:
+                cell_indices = calorimeter_manager.findCellIndicesByCoord(store.cells_coord)
+            cell_layers = calorimeter_manager.getCellLayers(cell_indices)
+            n_layers = len(calorimeter_manager.layer_namelist)
+            cell_events = np.repeat(np.arange(n_events, dtype=np.int64), n_cells)
+            known = cell_layers >= 0
+            layer_counts = np.bincount(cell_events[known] * n_layers + cell_layers[known],
+                                       minlength=n_events * n_layers).reshape(n_events, n_layers)
+            for layer_idx, layer_name in enumerate(calorimeter_manager.layer_namelist):
+                columns[f"cells_{layer_name}"] = np.ascontiguousarray(layer_counts[:, layer_idx], dtype=np.int32)
+
+        return EventSummary(columns)
+
+    # (Public) Merge the summaries of several stores (e.g. read chunk by chunk), rows keep their order
+    @staticmethod
+    def concatenate(summaries: list['EventSummary']) -> 'EventSummary':
+        return EventSummary({name: np.concatenate([summary.columns[name] for summary in summaries])
+                             for name in summaries[0].columns})
+
+    # (Public) Return the sorted event numbers of the events passing a query expression (all events for an empty query).
+    # Raises ValueError for an invalid expression or an unknown column.
+    def query(self, expression: str) -> np.ndarray:
+        return np.sort(self.columns["event"][self.evaluate(expression)])
+
+    # (Public) Return the boolean mask (one entry per row) of a query expression
+    def evaluate(self, expression: str) -> np.ndarray:
+        if not expression.strip():
+            return np.ones(len(self), dtype=bool)
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as e:
+            raise ValueError(f"Invalid query: {e.msg}") from None
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mask = self._evaluateNode(tree.body)
+        mask = np.asarray(mask)
+        if mask.dtype != bool:
+            raise ValueError("Invalid query: the expression is not a condition (use comparisons, e.g. n_cells > 200)")
+        return np.broadcast_to(mask, (len(self),))
+
+    _comparisons = {ast.Lt: operator.lt, ast.LtE: operator.le, ast.Gt: operator.gt, ast.GtE: operator.ge,
+                    ast.Eq: operator.eq, ast.NotEq: operator.ne}
+    _binary_operations = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+                          ast.Mod: operator.mod, ast.BitAnd: np.logical_and, ast.BitOr: np.logical_or}
+    _functions = {"abs": np.abs}
+
+    def _evaluateNode(self, node):
+        if isinstance(node, ast.BoolOp):
+            # Pairwise, so that columns and constants can be mixed (e.g. "n_cells > 5 and True")
+            operation = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return functools.reduce(operation, [self._evaluateNode(value) for value in node.values])
+        if isinstance(node, ast.Compare):
+            # a < b <= c  ->  (a < b) and (b <= c)
+            operands = [self._evaluateNode(node.left)] + [self._evaluateNode(comparator) for comparator in node.comparators]
+            result = True
+            for op, left, right in zip(node.ops, operands[:-1], operands[1:]):
+                if type(op) not in self._comparisons:
+                    raise ValueError(f"Invalid query: unsupported comparison {type(op).__name__}")
+                result = np.logical_and(result, self._comparisons[type(op)](left, right))
+            return result
+        if isinstance(node, ast.UnaryOp):
+            operand = self._evaluateNode(node.operand)
+            if isinstance(node.op, (ast.Not, ast.Invert)):
+                return np.logical_not(operand)
+            if isinstance(node.op, ast.USub):
+                return -operand
+            if isinstance(node.op, ast.UAdd):
+                return operand
+        if isinstance(node, ast.BinOp) and type(node.op) in self._binary_operations:
+            operation = self._binary_operations[type(node.op)]
+            left, right = self._evaluateNode(node.left), self._evaluateNode(node.right)
+            if isinstance(node.op, (ast.Div, ast.Mod)):
+                return self._divide(operation, left, right)
+            return operation(left, right)
+        if isinstance(node, ast.Name):
+            if node.id not in self.columns:
+                raise ValueError(f"Invalid query: unknown column '{node.id}' (columns: {', '.join(self.columns)})")
+            return self.columns[node.id]
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float, bool)):
+            return node.value
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in self._functions and len(node.args) == 1 and not node.keywords:
+            return self._functions[node.func.id](self._evaluateNode(node.args[0]))
+        raise ValueError(f"Invalid query: unsupported expression '{ast.unparse(node)}'")
+
+    @staticmethod
+    def _divide(operation, left, right):
+        if np.ndim(right) == 0:
+            if right == 0:
+                raise ValueError("Invalid query: division by zero")
+            return operation(left, right)
+        zero = np.asarray(right) == 0
+        result = operation(np.asarray(left, dtype=np.float64), np.where(zero, 1, right))
+        return np.where(zero, np.nan, result)
@@ -0,0 +1,99 @@
+import os
+import json
+import numpy as np
+
+from useCaseClasses.CacheFiles import CacheFiles
+
+
+class GeometryCache:
+    """
+    Memory-mappable binary sidecar of the calorimeter geometry, so that later launches
+    do not need to open the ROOT file (nor import uproot) at all.
+
+    The cache is a directory next to the ROOT file ("<file>.cache/") containing:
+        meta.json           key of the source file (size, mtime, sha1), layer names, cold load time
+        cells_coord.npy     (N, 3) float32 cell coordinates [m], cells grouped by sampling layer
+        cell_ids.npy        (N,) uint64 cell IDs, in the same order
+        cell_extents.npy    (N, 2) float32 (deta, dphi) extents of the cells, in the same order (only if the
+                            geometry file has them, see "has_extents" in meta.json)
+        layer_offsets.npy   (n_layers+1,) int64, layer i is rows layer_offsets[i]:layer_offsets[i+1]
+    """
+    FORMAT_VERSION = 2
+
+    def __init__(self, source_file: str, cache_dir: str = None):
+        self.source_file = source_file
+        self.cache_dir = cache_dir if cache_dir is not None else f"{source_file}.cache"
+        self.meta_path = os.path.join(self.cache_dir, "meta.json")
+
+    # (Public) Return (cells_coord, cell_ids, cell_extents, layer_offsets, meta) mapped from disk, None if there is no valid cache
+    def load(self, layer_names: list[str]):
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if meta.get("format_version") != self.FORMAT_VERSION or meta.get("layer_names") != list(layer_names):
+            return None
+        if not self._matchesSourceFile(meta):
+            return None
+
+        try:
+            cells_coord = np.load(os.path.join(self.cache_dir, "cells_coord.npy"), mmap_mode='r')
+            cell_ids = np.load(os.path.join(self.cache_dir, "cell_ids.npy"), mmap_mode='r')
+            # Caches written before "has_extents" always have the extents
+            cell_extents = np.load(os.path.join(self.cache_dir, "cell_extents.npy"), mmap_mode='r') if meta.get("has_extents", True) else None
+            layer_offsets = np.load(os.path.join(self.cache_dir, "layer_offsets.npy"))
+        except (OSError, ValueError):
+            return None
+        return cells_coord, cell_ids, cell_extents, layer_offsets, meta
+
+    # (Public) Write the geometry arrays to the sidecar, meta.json is written last to mark the cache as complete.
+    # cell_extents may be None (geometry file without extents)
+    def save(self, cells_coord, cell_ids, cell_extents, layer_offsets, layer_names: list[str], cold_load_seconds: float) -> bool:
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            if os.path.exists(self.meta_path):
+                os.remove(self.meta_path)
+            np.save(os.path.join(self.cache_dir, "cells_coord.npy"), np.ascontiguousarray(cells_coord, dtype=np.float32))
+            np.save(os.path.join(self.cache_dir, "cell_ids.npy"), np.ascontiguousarray(cell_ids, dtype=np.uint64))
+            extents_path = os.path.join(self.cache_dir, "cell_extents.npy")
+            if cell_extents is not None:
+                np.save(extents_path, np.ascontiguousarray(cell_extents, dtype=np.float32))
+            elif os.path.exists(extents_path):
+                os.remove(extents_path)
+            np.save(os.path.join(self.cache_dir, "layer_offsets.npy"), np.asarray(layer_offsets, dtype=np.int64))
+
+            meta = {"format_version": self.FORMAT_VERSION,
+                    "layer_names": list(layer_names),
+                    "has_extents": cell_extents is not None,
+                    "cold_load_seconds": cold_load_seconds,
+                    **CacheFiles.fileKey(self.source_file, with_hash=True)}
+            self._writeMeta(meta)
+        except OSError as e:
+            print(f"Warning: could not write geometry cache to {self.cache_dir}: {e}")
+            return False
+        return True
+
+    def _matchesSourceFile(self, meta: dict) -> bool:
+        key = CacheFiles.fileKey(self.source_file)
+        if key["size"] != meta.get("size"):
+            return False
+        if key["mtime_ns"] == meta.get("mtime_ns"):
+            return True
+
+        # Same size but touched (e.g. copied): only trust the cache if the content is identical
+        if CacheFiles.hashFile(self.source_file) != meta.get("sha1"):
+            return False
+        meta["mtime_ns"] = key["mtime_ns"]
+        try:
+            self._writeMeta(meta)
+        except OSError:
+            pass
+        return True
+
+    def _writeMeta(self, meta: dict):
+        def write(tmp_path):
+            with open(tmp_path, "w") as f:
+                json.dump(meta, f, indent=2)
+        CacheFiles.writeAtomically(self.meta_path, write)
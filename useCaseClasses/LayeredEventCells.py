@@ -0,0 +1,62 @@
+import numpy as np
+
+
+class LayeredEventCells:
+    """
+    Cluster cells of one event regrouped by sampling layer, for drawing with per-layer visibility.
+
+    The cells are reordered by (layer, cluster), so that the cells of one cluster in one layer form one
+    contiguous segment: segment s is cells_coord[segment_first[s] : segment_first[s]+segment_count[s]],
+    drawn with the colour of cluster segment_cluster[s], and the segments of layer l are
+    layer_segment_offsets[l] : layer_segment_offsets[l+1]. Hiding a layer only skips its segments when
+    drawing. Cells whose layer is unknown (-1) form an extra last group (index n_layers), always drawn.
+    The cells of one layer are also one contiguous range (layer_cell_offsets), for per-vertex coloured drawing.
+    When the geometry rows of the cells are given, they are kept in the same order (cell_rows, e.g. for their volumes).
+    """
+    def __init__(self, cells_coord, cluster_offsets, cell_layers, n_layers: int, cell_rows=None):
+        cells_coord = np.asarray(cells_coord, dtype=np.float32).reshape(-1, 3)
+        cluster_offsets = np.asarray(cluster_offsets, dtype=np.int64)
+        n_clusters = len(cluster_offsets) - 1
+        self.n_layers = n_layers
+
+        cell_clusters = np.repeat(np.arange(n_clusters, dtype=np.int64), np.diff(cluster_offsets))
+        cell_groups = np.where(np.asarray(cell_layers) < 0, n_layers, cell_layers).astype(np.int64)
+        segment_keys = cell_groups * max(n_clusters, 1) + cell_clusters
+        order = np.argsort(segment_keys, kind='stable')
+        segment_keys = segment_keys[order]
+
+        self.cells_coord = np.ascontiguousarray(cells_coord[order])    # (N, 3)
+        self.cell_layers = cell_groups[order]                          # (N,), n_layers for unknown
+        self.cell_order = order                                        # (N,), original index of each cell
+        self.cell_rows = np.asarray(cell_rows)[order] if cell_rows is not None else None   # (N,), geometry row, -1 for unknown
+
+        # A segment starts wherever the (layer, cluster) key changes
+        segment_first = np.flatnonzero(np.diff(segment_keys, prepend=-1) != 0)
+        segment_groups = self.cell_layers[segment_first]
+        self.layer_segment_offsets = np.searchsorted(segment_groups, np.arange(n_layers + 2)).tolist()
+        # Cells of layer l are cells_coord[layer_cell_offsets[l]:layer_cell_offsets[l+1]]
+        self.layer_cell_offsets = np.searchsorted(self.cell_layers, np.arange(n_layers + 2)).tolist()
+        # Plain lists: they are only iterated over when drawing
+        self.segment_first = segment_first.tolist()
+        self.segment_count = np.diff(segment_first, append=len(order)).tolist()
+        self.segment_cluster = cell_clusters[order][segment_first].tolist()
+
+    @property
+    def nbytes(self) -> int:
+        return (self.cells_coord.nbytes + self.cell_layers.nbytes + self.cell_order.nbytes
+                + (self.cell_rows.nbytes if self.cell_rows is not None else 0))
+
+    # (Public) Return the number of hit cells in each layer (the last entry counting the cells of unknown layer)
+    def getLayerCellCounts(self) -> np.ndarray:
+        return np.bincount(self.cell_layers, minlength=self.n_layers + 1)
+
+    # (Public) Tag the cells of an event with their sampling layer and regroup them:
+    # through the stored cell indices in cell-ID mode, otherwise by matching the coordinates to the geometry
+    @staticmethod
+    def fromEvent(eventManager, calorimeterManager, evtnum: int, cells_coord, cluster_offsets) -> 'LayeredEventCells':
+        if eventManager.cell_id_mode:
+            cell_indices, _ = eventManager.getClustersCellIndicesforAnEvent(evtnum)
+        else:
+            cell_indices = calorimeterManager.findCellIndicesByCoord(cells_coord)
+        return LayeredEventCells(cells_coord, cluster_offsets, calorimeterManager.getCellLayers(cell_indices),
+                                 len(calorimeterManager.layer_namelist), cell_rows=cell_indices)
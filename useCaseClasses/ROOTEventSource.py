@@ -0,0 +1,95 @@
+import uproot
+import numpy as np
+import awkward as ak
+import threading
+from collections import OrderedDict
+
+from useCaseClasses.EventSource import EventSource, EventColumns
+from instrumentation.Profiler import profiler
+
+
+class ROOTEventSource(EventSource):
+    """
+    Events read from ROOT trees with uproot: {prefix}_X/_Y/_Z [mm] (or {prefix}_ID in cell-ID mode) and {prefix}_E,
+    nested per event and cluster, eventNumber, truthPartEta and truthPartPhi.
+
+    In lazy mode, files are opened on first access and kept open (up to max_open_files), so that each entry
+    read only costs the read of its own baskets.
+    """
+    # Maximum number of event files kept open at the same time in lazy mode
+    max_open_files = 16
+
+    def __init__(self, file_names: list[str], tree_name: str, branch_prefix: str, cell_id_mode: bool = False, load_energies: bool = False):
+        super().__init__(file_names, tree_name, branch_prefix, cell_id_mode, load_energies)
+        if cell_id_mode:
+            self.cell_branches = [f'{branch_prefix}_ID']
+        else:
+            self.cell_branches = [f'{branch_prefix}_X', f'{branch_prefix}_Y', f'{branch_prefix}_Z']
+        self.energy_branch = f'{branch_prefix}_E'
+        # file index -> uproot file, least recently used first
+        self._open_files = OrderedDict()
+        self._file_lock = threading.Lock()
+
+    def branches(self) -> list[str]:
+        return ['eventNumber', 'truthPartEta', 'truthPartPhi'] + self.cell_branches + ([self.energy_branch] if self.load_energies else [])
+
+    def readEventNumbers(self, file_idx: int) -> np.ndarray:
+        with uproot.open(self.file_names[file_idx]) as f:
+            return np.asarray(f[self.tree_name]['eventNumber'].array(library="np"), dtype=np.int64)
+
+    def iterateColumns(self, file_indices: list[int] = None, step_size="100 MB"):
+        file_indices = range(len(self.file_names)) if file_indices is None else file_indices
+        chunks = uproot.iterate({self.file_names[file_idx]: self.tree_name for file_idx in file_indices}, self.branches(),
+                                step_size=step_size, library="ak")
+        while True:
+            with profiler.span("events.read_chunk"):
+                arrays = next(chunks, None)
+            if arrays is None:
+                return
+            with profiler.span("events.convert"):
+                yield self._toColumns(arrays)
+
+    def readEntry(self, file_idx: int, entry: int) -> EventColumns:
+        with self._file_lock, profiler.span("event.read_entry"):
+            tree = self._getOpenFile(file_idx)[self.tree_name]
+            arrays = tree.arrays(self.branches(), entry_start=entry, entry_stop=entry+1)
+        with profiler.span("event.convert"):
+            return self._toColumns(arrays)
+
+    def close(self):
+        with self._file_lock:
+            for f in self._open_files.values():
+                f.close()
+            self._open_files.clear()
+
+    # Return the (kept open) uproot file of a file index, closing the least recently used one if too many are open
+    # (to be called with _file_lock held)
+    def _getOpenFile(self, file_idx: int):
+        if file_idx in self._open_files:
+            self._open_files.move_to_end(file_idx)
+            return self._open_files[file_idx]
+        with profiler.span("events.root_open"):
+            f = uproot.open(self.file_names[file_idx])
+        self._open_files[file_idx] = f
+        while len(self._open_files) > self.max_open_files:
+            self._open_files.popitem(last=False)[1].close()
+        return f
+
+    def _toColumns(self, arrays) -> EventColumns:
+        # Clusters per event and cells per cluster -> CSR offsets
+        cells_branch = arrays[self.cell_branches[0]]
+        n_clusters_per_event = ak.to_numpy(ak.num(cells_branch, axis=1))
+        n_cells_per_cluster = ak.to_numpy(ak.flatten(ak.num(cells_branch, axis=2), axis=None))
+        if self.cell_id_mode:
+            cells_coord, cell_ids = None, ak.to_numpy(ak.flatten(cells_branch, axis=None))
+        else:
+            cells_coord = np.column_stack([ak.to_numpy(ak.flatten(arrays[branch], axis=None)) for branch in self.cell_branches]) / 1000 #[m]
+            cell_ids = None
+        cell_energies = ak.to_numpy(ak.flatten(arrays[self.energy_branch], axis=None)) if self.load_energies else None
+
+        n_particles_per_event = ak.to_numpy(ak.num(arrays['truthPartEta'], axis=1))
+        return EventColumns(ak.to_numpy(arrays['eventNumber']),
+                            EventColumns.countsToOffsets(n_clusters_per_event), EventColumns.countsToOffsets(n_cells_per_cluster),
+                            EventColumns.countsToOffsets(n_particles_per_event),
+                            ak.to_numpy(ak.flatten(arrays['truthPartEta'])), ak.to_numpy(ak.flatten(arrays['truthPartPhi'])),
+                            cells_coord=cells_coord, cell_ids=cell_ids, cell_energies=cell_energies)